@@ -0,0 +1,62 @@
+# ------------------- Imports ---------------------
+
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Artifact Sinks -------------------
+# The pipeline hands stage results around in memory; a sink is only for keeping a copy.
+
+
+def new_run_id() -> str:
+    """Sortable, collision-safe id for one pipeline run, e.g. 20250518-141503-3f9a2c1b."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+class ArtifactSink:
+    """Where a finished pipeline run is persisted. Subclasses implement save_run."""
+
+    def save_run(self, run_id: str, artifacts: dict):
+        raise NotImplementedError
+
+
+class RunDirectorySink(ArtifactSink):
+    """
+    Writes every stage of a run to its own directory:
+    <base_dir>/<run_id>/conflict_output.json, exa_output.json, classified_bias_output.json
+    """
+
+    def __init__(self, base_dir: str = "runs"):
+        self.base_dir = base_dir
+
+    def save_run(self, run_id: str, artifacts: dict):
+        run_dir = os.path.join(self.base_dir, run_id)
+        try:
+            os.makedirs(run_dir, exist_ok=True)
+            for name, data in artifacts.items():
+                with open(os.path.join(run_dir, f"{name}.json"), "w", encoding="utf-8") as f:
+                    json.dump(data, f, indent=2, ensure_ascii=False)
+            logger.info(f"Saved run artifacts to {run_dir}")
+        except Exception as e:
+            logger.error(f"Failed to save run artifacts: {str(e)}")
+
+
+class JsonlRecordSink(ArtifactSink):
+    """Appends one compact JSON line per run to a single file."""
+
+    def __init__(self, path: str = "pipeline_runs.jsonl"):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def save_run(self, run_id: str, artifacts: dict):
+        record = json.dumps({"run_id": run_id, **artifacts}, ensure_ascii=False, separators=(",", ":"))
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(record + "\n")
+        except Exception as e:
+            logger.error(f"Failed to append run record: {str(e)}")
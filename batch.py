@@ -0,0 +1,163 @@
+# ------------------- Imports ---------------------
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Batch Pipeline -------------------
+# Runs the conflict pipeline over a JSONL corpus, one {"id": ..., "text": ...} article per line:
+#
+#   python batch.py articles.jsonl results.jsonl --workers 8
+#
+# Every finished article is appended to the output right away, and the output doubles as the
+# checkpoint: rerunning the same command skips ids that already have a result there.
+
+DEFAULT_WORKERS = 4
+PROGRESS_INTERVAL = 10.0  # seconds between items/sec reports
+
+
+def read_articles(path: str) -> Iterator[Tuple[str, str]]:
+    """Yields (id, text) per line; an article without an "id" is keyed by its line number."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable line {line_number} of {path}")
+                continue
+            yield str(record.get("id", line_number)), record.get("text", "")
+
+
+def completed_ids(output_path: str, retry_failed: bool = True) -> Set[str]:
+    """Ids already in the output; with retry_failed, ids whose run errored are left out so they run again."""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # An interrupted write can leave a torn last line; that article simply runs again
+                continue
+            if retry_failed and record.get("error"):
+                continue
+            done.add(str(record["id"]))
+    return done
+
+
+class BatchRunner:
+    """
+    Feeds articles to a pool of pipeline workers and appends each result to the output JSONL
+    as soon as it is done. At most 2 * workers articles are read ahead, so the corpus is
+    streamed rather than loaded.
+    """
+
+    def __init__(self, model_name: str, workers: int = DEFAULT_WORKERS, pipeline_options: Optional[dict] = None):
+        self.model_name = model_name
+        self.workers = workers
+        self.pipeline_options = pipeline_options or {}
+        self.processed = 0
+        self.failed = 0
+        self._write_lock = threading.Lock()
+
+    def process(self, article_id: str, text: str) -> dict:
+        from working import ConflictExtractor
+
+        try:
+            extractor = ConflictExtractor(None, self.model_name, article_text=text)
+            run = extractor.run_pipeline(**self.pipeline_options)
+        except Exception as e:
+            logger.error(f"Article {article_id} failed: {e}")
+            return {"id": article_id, "error": str(e)}
+        record = {"id": article_id, **run.artifacts(), "run_id": run.run_id}
+        if "error" in run.conflict:
+            record["error"] = run.conflict["error"]
+        return record
+
+    def run(self, input_path: str, output_path: str, retry_failed: bool = True, limit: Optional[int] = None):
+        skip = completed_ids(output_path, retry_failed)
+        if skip:
+            logger.info(f"Resuming: {len(skip)} articles already in {output_path}")
+
+        start = last_report = time.monotonic()
+        pending = set()
+        with open(output_path, "a", encoding="utf-8") as out, \
+                ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="batch") as pool:
+            try:
+                for article_id, text in read_articles(input_path):
+                    if article_id in skip:
+                        continue
+                    if limit is not None and self.processed + len(pending) >= limit:
+                        break
+                    if len(pending) >= 2 * self.workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    else:
+                        done = {future for future in pending if future.done()}
+                        pending -= done
+                    self._write_results(done, out)
+                    pending.add(pool.submit(self.process, article_id, text))
+                    if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                        self._report(start)
+                        last_report = time.monotonic()
+            except KeyboardInterrupt:
+                logger.warning("Interrupted; finishing the articles in flight, rerun to resume")
+            self._write_results(wait(pending).done, out)
+        self._report(start)
+
+    def _write_results(self, futures, out):
+        with self._write_lock:
+            for future in futures:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self.processed += 1
+                if record.get("error"):
+                    self.failed += 1
+            out.flush()
+
+    def _report(self, start: float):
+        elapsed = time.monotonic() - start
+        rate = self.processed / elapsed if elapsed > 0 else 0.0
+        logger.info(f"{self.processed} articles ({self.failed} failed) in {elapsed:.1f}s, {rate:.2f} items/sec")
+
+
+# ------------------- CLI -------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the conflict pipeline over a JSONL corpus of articles.")
+    parser.add_argument("input", help='JSONL with one {"id": ..., "text": ...} per line')
+    parser.add_argument("output", help="JSONL the results are appended to; also the resume checkpoint")
+    parser.add_argument("--model", default="openai/gpt-4.1-nano")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="articles processed in parallel")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many new articles")
+    parser.add_argument("--exa-max-results", type=int, default=10)
+    parser.add_argument("--exa-two-phase", action="store_true")
+    parser.add_argument("--classify-concurrency", type=int, default=None)
+    parser.add_argument("--classify-batch-token-budget", type=int, default=None)
+    parser.add_argument("--no-retry-failed", action="store_true", help="on resume, skip articles that errored before")
+    args = parser.parse_args(argv)
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+
+    options = {"exa_max_results": args.exa_max_results, "exa_two_phase": args.exa_two_phase,
+               "classify_batch_token_budget": args.classify_batch_token_budget}
+    if args.classify_concurrency is not None:
+        options["classify_concurrency"] = args.classify_concurrency
+    runner = BatchRunner(args.model, workers=args.workers, pipeline_options=options)
+    # run_pipeline pretty-prints every conflict to stdout; progress goes to the log instead
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        runner.run(args.input, args.output, retry_failed=not args.no_retry_failed, limit=args.limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+# ------------------- Imports ---------------------
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import itertools
+import json
+import logging
+import random
+import re
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Offline Benchmark -------------------
+# Runs the real pipeline and debate code against one local HTTP server that speaks both the
+# OpenAI chat-completions API and Exa's /search and /contents, so nothing costs money and
+# latency, jitter, failures and document sizes are under control.
+#
+#   python benchmark.py --urls 5,20 --article-chars 2000,20000 --concurrency 1,8
+#
+# One JSON line per scenario goes to --output for comparing runs.
+
+WORDS = ("policy", "rights", "security", "economy", "history", "claim", "evidence", "border",
+         "vote", "court", "report", "citizens", "water", "land", "peace", "minister", "media")
+
+
+@dataclass
+class StubConfig:
+    llm_latency: float = 0.2        # seconds before a chat answer (or its first token)
+    exa_latency: float = 0.3        # seconds per Exa request
+    jitter: float = 0.05            # +/- uniform noise added to every latency
+    error_rate: float = 0.0         # share of requests answered with HTTP 500
+    doc_chars: int = 6000           # length of every fake Exa document
+    completion_words: int = 80      # length of free-form answers (debate turns, summaries)
+    token_interval: float = 0.005   # seconds between streamed tokens
+
+
+def filler_text(chars: int, seed: str = "") -> str:
+    rng = random.Random(seed)
+    words, size = [], 0
+    while size < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + "."
+        words.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(words)[:chars]
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 refuses connections under high concurrency
+
+
+class StubServer:
+    """OpenAI-compatible and Exa-compatible HTTP stand-in, served from a background thread."""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.counts: Counter = Counter()
+        self._counts_lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._httpd = _StubHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "StubServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_counts(self) -> Dict[str, int]:
+        with self._counts_lock:
+            counts = dict(self.counts)
+            self.counts.clear()
+        return counts
+
+    def _count(self, name: str):
+        with self._counts_lock:
+            self.counts[name] += 1
+
+    def _delay(self, base: float):
+        time.sleep(max(0.0, base + self._rng.uniform(-self.config.jitter, self.config.jitter)))
+
+    def _fails(self) -> bool:
+        return self._rng.random() < self.config.error_rate
+
+    # ---- Fake answers ----
+
+    def chat_answer(self, prompt: str) -> str:
+        if "Respond ONLY with a JSON array" in prompt:
+            count = len(re.findall(r"^\s*Article \d+:", prompt, flags=re.MULTILINE))
+            return json.dumps([self._rng.choice(["Group A", "Group B"]) for _ in range(count)])
+        if 'Only respond with "Group A" or "Group B"' in prompt:
+            return self._rng.choice(["Group A", "Group B"])
+        if "Respond ONLY with a JSON object" in prompt:
+            # Each article gets its own conflict, so runs over different articles don't share a single-flight
+            tag = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:6]
+            return json.dumps({"side_a": "Residents", "side_b": "Developers",
+                               "idea": f"Who should control the land ({tag})",
+                               "search_query_a": f"residents oppose land development {tag}",
+                               "search_query_b": f"developers defend land development {tag}"})
+        return filler_text(self.config.completion_words * 7, seed=prompt[-64:])
+
+    def search_results(self, body: dict) -> list:
+        query = body.get("query", "")
+        tag = hashlib.sha1(query.encode("utf-8")).hexdigest()[:8]
+        contents = body.get("contents") or {}
+        # Every other hit is one any query finds, like a story both sides' searches turn up;
+        # per-side search leaves those for classification to decide
+        return [self._document(f"https://bench.local/{'shared' if i % 2 else tag}/{i}", contents)
+                for i in range(body.get("numResults", 10))]
+
+    def _document(self, url: str, contents: dict) -> dict:
+        result = {"url": url, "id": url, "title": url.rsplit("/", 1)[-1]}
+        text_option = contents.get("text")
+        if text_option:
+            text = filler_text(self.config.doc_chars, seed=url)
+            if isinstance(text_option, dict) and text_option.get("maxCharacters"):
+                text = text[:text_option["maxCharacters"]]
+            result["text"] = text
+        if contents.get("highlights"):
+            result["highlights"] = [filler_text(300, seed=url + str(i)) for i in range(3)]
+            result["highlightScores"] = [0.9, 0.8, 0.7]
+        return result
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                path = self.path.rstrip("/")
+                if path.endswith("/chat/completions"):
+                    self._chat(body)
+                elif path.endswith("/search"):
+                    self._exa("search", {"results": server.search_results(body)})
+                elif path.endswith("/contents"):
+                    contents = {k: v for k, v in body.items() if k in ("text", "highlights")}
+                    urls = body.get("urls") or body.get("ids") or []
+                    self._exa("contents", {"results": [server._document(url, contents) for url in urls]})
+                else:
+                    self._json(404, {"error": f"unknown path {self.path}"})
+
+            def _chat(self, body: dict):
+                stream = bool(body.get("stream"))
+                server._count("chat_stream" if stream else "chat")
+                server._delay(server.config.llm_latency)
+                if server._fails():
+                    server._count("errors")
+                    return self._json(500, {"error": {"message": "injected failure"}})
+                prompt = "\n".join(m.get("content", "") for m in body.get("messages", []))
+                answer = server.chat_answer(prompt)
+                usage = {"prompt_tokens": len(prompt) // 4 + 1, "completion_tokens": len(answer) // 4 + 1}
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                if stream:
+                    return self._stream(body.get("model", ""), answer)
+                self._json(200, {
+                    "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                    "model": body.get("model", ""),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": answer}}],
+                    "usage": usage,
+                })
+
+            def _stream(self, model: str, answer: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                for piece in re.findall(r"\S+\s*", answer):
+                    chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": model, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(server.config.token_interval)
+                self.wfile.write(b"data: [DONE]\n\n")
+
+            def _exa(self, name: str, payload: dict):
+                server._count(name)
+                server._delay(server.config.exa_latency)
+                if server._fails():
+                    server._count("errors")
+                    return self._json(500, {"error": "injected failure"})
+                self._json(200, payload)
+
+            def _json(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+# ------------------- Timing -------------------
+
+
+class StageTimer:
+    """Collects wall-clock durations per stage name, from any thread or coroutine."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.samples[stage].append(seconds)
+
+    def wrap(self, obj, method: str, stage: str):
+        """Replaces obj.method (sync or async) on the instance with a timed version."""
+        original = getattr(obj, method)
+        if asyncio.iscoroutinefunction(original):
+            async def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        else:
+            def timed(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return original(*args, **kwargs)
+                finally:
+                    self.record(stage, time.perf_counter() - start)
+        setattr(obj, method, timed)
+
+    def summary(self) -> Dict[str, dict]:
+        with self._lock:
+            return {stage: percentiles(values) for stage, values in self.samples.items()}
+
+
+def percentiles(values: List[float]) -> dict:
+    data = np.asarray(values, dtype=float)
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {"count": len(values), "mean": round(float(data.mean()), 4),
+            "p50": round(float(p50), 4), "p95": round(float(p95), 4), "p99": round(float(p99), 4)}
+
+
+# ------------------- Scenarios -------------------
+
+
+def _offline_extractor(server: StubServer, article_chars: int, seed: str = "article"):
+    """
+    A real ConflictExtractor whose clients and cache point at the stub instead of the network.
+    Extractors with the same seed get the same article, so concurrent runs of them share one computation.
+    """
+    from exa_py import Exa
+    from openai import OpenAI
+    from llm_cache import NullCache
+    from working import ConflictExtractor
+
+    extractor = ConflictExtractor(None, "bench/model", cache=NullCache(),
+                                  article_text=filler_text(article_chars, seed=seed))
+    extractor.client = OpenAI(base_url=f"{server.url}/v1", api_key="bench", max_retries=0)
+    extractor.exa = Exa(api_key="bench", base_url=server.url)
+    return extractor
+
+
+def _offline_simulator(server: StubServer, num_sources: int, context_turns: Optional[int]):
+    from openai import OpenAI
+    from debate_simulation import DebateSimulator
+    from llm_cache import NullCache
+
+    data = {
+        "claim": "Who should control the land",
+        "groups": {
+            "Group A": {"name": "Residents", "sources": [f"https://bench.local/a/{i}" for i in range(num_sources)]},
+            "Group B": {"name": "Developers", "sources": [f"https://bench.local/b/{i}" for i in range(num_sources)]},
+        },
+    }
+    simulator = DebateSimulator(data, model_name="bench/model", context_turns=context_turns)
+    client = OpenAI(base_url=f"{server.url}/v1", api_key="bench", max_retries=0)
+    for model in (simulator.model, simulator.summary_model):
+        if model is not None:
+            model.client = client
+            model.cache = NullCache()
+    return simulator
+
+
+def bench_pipeline(server: StubServer, urls: int, article_chars: int, concurrency: int,
+                   runs: int, mode: str, classify_concurrency: int,
+                   batch_token_budget: Optional[int]) -> dict:
+    """Runs `runs` pipelines over different articles, `concurrency` at a time, timing every stage."""
+    timer = StageTimer()
+    kwargs = {"exa_max_results": urls, "classify_concurrency": classify_concurrency,
+              "classify_batch_token_budget": batch_token_budget}
+
+    def prepare(run: int):
+        # One article per run: identical concurrent runs would coalesce into one single-flight
+        extractor = _offline_extractor(server, article_chars, seed=f"article-{run}")
+        timer.wrap(extractor, "extract_conflict", "extract_conflict")
+        timer.wrap(extractor, "search_conflict_urls", "search_conflict_urls")
+        timer.wrap(extractor, "_classify_entries", "classify")
+        timer.wrap(extractor, "extract_conflict_async", "extract_conflict")
+        timer.wrap(extractor, "search_conflict_urls_async", "search_conflict_urls")
+        timer.wrap(extractor, "_classify_entries_async", "classify")
+        return extractor
+
+    def run_sync(run: int):
+        extractor = prepare(run)
+        start = time.perf_counter()
+        extractor.run_pipeline(**kwargs)
+        timer.record("run_pipeline", time.perf_counter() - start)
+
+    async def run_async():
+        from exa_py import AsyncExa
+        from openai import AsyncOpenAI
+
+        # Async clients belong to this event loop, so they are built here and shared by all runs
+        async_client = AsyncOpenAI(base_url=f"{server.url}/v1", api_key="bench", max_retries=0)
+        async_exa = AsyncExa(api_key="bench", api_base=server.url)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(run: int):
+            async with semaphore:
+                extractor = prepare(run)
+                extractor.async_client, extractor.async_exa = async_client, async_exa
+                start = time.perf_counter()
+                await extractor.run_pipeline_async(**kwargs)
+                timer.record("run_pipeline", time.perf_counter() - start)
+
+        await asyncio.gather(*(one(run) for run in range(runs)))
+
+    start = time.perf_counter()
+    if mode == "async":
+        asyncio.run(run_async())
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run_sync, range(runs)))
+    wall = time.perf_counter() - start
+    return {"stages": timer.summary(), "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(runs / wall, 3)}
+
+
+def bench_debate(server: StubServer, urls: int, rounds: int, concurrency: int, runs: int,
+                 context_turns: Optional[int]) -> dict:
+    """Runs `runs` debates of `rounds` rounds plus the closing summary, `concurrency` at a time."""
+    timer = StageTimer()
+
+    def run_one(_):
+        simulator = _offline_simulator(server, urls, context_turns)
+        timer.wrap(simulator, "simulate_debate", "simulate_debate")
+        timer.wrap(simulator, "summarize_debate", "summarize_debate")
+        start = time.perf_counter()
+        for _ in range(rounds):
+            simulator.simulate_debate()
+        simulator.summarize_debate()
+        timer.record("debate", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_one, range(runs)))
+    wall = time.perf_counter() - start
+    return {"stages": timer.summary(), "wall_seconds": round(wall, 3),
+            "throughput_per_second": round(runs / wall, 3)}
+
+
+def measure(server: StubServer, scenario: dict, benchmark, trace_memory: bool, **kwargs) -> dict:
+    """Runs one scenario and adds request counts and peak traced memory to its result."""
+    import metrics
+    server.reset_counts()
+    metrics.registry.reset()
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the pipeline pretty-prints every run
+            result = benchmark(server, **kwargs)
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    result.update(scenario)
+    result["requests"] = server.reset_counts()
+    result["peak_memory_mb"] = round(peak / 2 ** 20, 2) if peak is not None else None
+    # The code's own counters: token usage per model/stage, cache lookups, API responses
+    result["metrics"] = metrics.registry.snapshot()["counters"]
+    return result
+
+
+# ------------------- CLI -------------------
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the conflict pipeline and debate simulator.")
+    parser.add_argument("--suite", choices=["pipeline", "debate", "all"], default="all")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="run_pipeline or run_pipeline_async")
+    parser.add_argument("--urls", type=_int_list, default=[10], help="Exa results per run (sweep, comma separated)")
+    parser.add_argument("--article-chars", type=_int_list, default=[4000], help="input article size (sweep)")
+    parser.add_argument("--debate-rounds", type=_int_list, default=[3], help="rounds per debate (sweep)")
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4], help="simultaneous runs (sweep)")
+    parser.add_argument("--runs", type=int, default=8, help="runs per scenario")
+    parser.add_argument("--classify-concurrency", type=int, default=5)
+    parser.add_argument("--batch-token-budget", type=int, default=None)
+    parser.add_argument("--context-turns", type=int, default=None)
+    parser.add_argument("--llm-latency", type=float, default=StubConfig.llm_latency)
+    parser.add_argument("--exa-latency", type=float, default=StubConfig.exa_latency)
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--doc-chars", type=int, default=StubConfig.doc_chars)
+    parser.add_argument("--completion-words", type=int, default=StubConfig.completion_words)
+    parser.add_argument("--no-trace-memory", action="store_true", help="skip tracemalloc, which slows Python down")
+    parser.add_argument("--output", default="benchmark_results.jsonl")
+    args = parser.parse_args(argv)
+
+    # Before working.py is imported, so its INFO-level basicConfig becomes a no-op
+    logging.basicConfig(level=logging.WARNING)
+    config = StubConfig(llm_latency=args.llm_latency, exa_latency=args.exa_latency, jitter=args.jitter,
+                        error_rate=args.error_rate, doc_chars=args.doc_chars,
+                        completion_words=args.completion_words)
+    server = StubServer(config).start()
+    trace_memory = not args.no_trace_memory
+    results = []
+    try:
+        if args.suite in ("pipeline", "all"):
+            for urls, article_chars, concurrency in itertools.product(args.urls, args.article_chars, args.concurrency):
+                scenario = {"suite": "pipeline", "mode": args.mode, "urls": urls, "article_chars": article_chars,
+                            "concurrency": concurrency, "runs": args.runs}
+                results.append(measure(
+                    server, scenario, bench_pipeline, trace_memory,
+                    urls=urls, article_chars=article_chars, concurrency=concurrency, runs=args.runs,
+                    mode=args.mode, classify_concurrency=args.classify_concurrency,
+                    batch_token_budget=args.batch_token_budget,
+                ))
+                _print_result(results[-1])
+        if args.suite in ("debate", "all"):
+            for urls, rounds, concurrency in itertools.product(args.urls, args.debate_rounds, args.concurrency):
+                scenario = {"suite": "debate", "urls": urls, "debate_rounds": rounds,
+                            "concurrency": concurrency, "runs": args.runs}
+                results.append(measure(
+                    server, scenario, bench_debate, trace_memory,
+                    urls=urls, rounds=rounds, concurrency=concurrency, runs=args.runs,
+                    context_turns=args.context_turns,
+                ))
+                _print_result(results[-1])
+    finally:
+        server.stop()
+
+    with open(args.output, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps({"stub": asdict(config), "timestamp": time.time(), **result}) + "\n")
+    print(f"Wrote {len(results)} scenario results to {args.output}")
+    return results
+
+
+def _print_result(result: dict):
+    label = ", ".join(f"{k}={result[k]}" for k in ("suite", "urls", "article_chars", "debate_rounds", "concurrency")
+                      if k in result)
+    print(f"\n[{label}] {result['throughput_per_second']} runs/s, "
+          f"peak {result['peak_memory_mb']} MB, requests {result['requests']}")
+    for stage, stats in result["stages"].items():
+        print(f"  {stage:<22} p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s  p99 {stats['p99']:.3f}s  (n={stats['count']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 
-import json
 import textwrap
 import asyncio
+from typing import Dict, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler,
@@ -10,6 +10,16 @@ from telegram.ext import (
 
 import working
 from debate_simulation import DebateSimulator
+from sessions import DebateSession, MessageRef, SessionManager
+from session_store import MemorySessionStore, SQLiteSessionStore
+from history_store import MemoryHistoryStore, SQLiteHistoryStore
+from telegram_stream import EditCoalescer
+from speculation import SpeculativePrefetcher
+import metrics
+import webhook
+from stance import StanceClassifier
+from topic_index import TopicIndex
+from request_context import Cancelled, DeadlineExceeded, RequestContext
 from my_secrets import OPENROUTER_API_KEY, OPENROUTER_API_BASE, BOT_KEY
 
 # Handler for /start command
@@ -34,28 +44,86 @@ async def help_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 ASK_CONTINUE = range(1)
-user_data_store = {}
-debate_simulator = None  # Global variable to hold the DebateSimulator instance
-counter = 0
-
-
-def func1(input_json):
-    global debate_simulator  # Use the global variable
-    global counter  # Use the global variable
-    # Initialize only if debate_simulator is None
-    if debate_simulator is None:
-        debate_simulator = DebateSimulator(input_json)
-    if input_json.get("text") == "continue":
-        result = debate_simulator.simulate_debate()
-        return result
-    elif input_json.get("text") == "finish":
-        result = debate_simulator.summarize_debate()
-        counter = 0  # Reset counter for next debate
-        debate_simulator = None
-        return result
-    else:
-        result = debate_simulator.simulate_debate()
-        return result
+MAX_ROUNDS = 4  # how many times the user can ask for another round
+PIPELINE_SINK = None  # e.g. artifacts.RunDirectorySink("runs") to keep a copy of every pipeline run
+
+# Webhook mode: set WEBHOOK_URL (the public https address Telegram posts to) to serve updates
+# from WEBHOOK_WORKERS processes, each chat always handled by the same one, instead of polling.
+# Each worker serves its metrics on METRICS_PORT + its index.
+WEBHOOK_URL = None  # e.g. "https://bot.example.com/telegram"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET = None  # checked against Telegram's secret token header when set
+WEBHOOK_WORKERS = 4
+# Debate turns are logged per chat in HISTORY_STORE, and per-chat session state (turn counter,
+# transcript, the message it is edited into) in SESSION_STORE. Use file or SQLite stores (e.g.
+# history_store.JsonlHistoryStore("debate_histories")) so a debate can be picked up again after
+# the bot restarts. Webhook workers need them, or a chat's debate is lost whenever its worker
+# restarts: with WEBHOOK_URL set both default to SQLite, and main() refuses in-process ones.
+HISTORY_STORE = SQLiteHistoryStore() if WEBHOOK_URL else MemoryHistoryStore()
+SESSION_STORE = SQLiteSessionStore() if WEBHOOK_URL else MemorySessionStore()
+# An evicted chat can only resume from stores other processes can read; an in-process history
+# store would otherwise keep every abandoned debate's turns forever
+def forget_evicted(chat_id: int):
+    if HISTORY_STORE.in_process:
+        HISTORY_STORE.delete(str(chat_id))
+
+# One debate per chat: simulator, turn counter and transcript live here instead of in globals
+sessions = SessionManager(store=SESSION_STORE, on_evict=forget_evicted)
+# Turns quoted verbatim in each debate prompt; older ones are carried by a rolling summary
+DEBATE_CONTEXT_TURNS = 4
+# Minimum seconds between two edits of a streaming debate message (Telegram allows ~1/s per chat)
+STREAM_EDIT_INTERVAL = 1.0
+# Opt-in: generate the next round while the Yes/No keyboard is shown, so "Yes" is served instantly
+SPECULATIVE_PREFETCH = False
+prefetcher = SpeculativePrefetcher(enabled=SPECULATIVE_PREFETCH, per_chat_limit=1, global_limit=10)
+# Local stance model (trained with `python stance.py runs/`) that labels clear-cut articles
+# without the LLM; None sends every article to the LLM
+STANCE_MODEL_PATH = None  # e.g. "stance_model.npz"
+STANCE_THRESHOLD = 0.9
+STANCE_AUDIT_RATE = working.DEFAULT_STANCE_AUDIT_RATE  # share of locally labeled articles also sent to the LLM to track agreement
+# Share of the articles labeled only by the search query that found them (no stance model to
+# check the tag) also sent to the LLM; 1.0 sends them all, trading the saved calls for accuracy
+SEARCH_TAG_AUDIT_RATE = working.DEFAULT_SEARCH_TAG_AUDIT_RATE
+stance_model = StanceClassifier.load(STANCE_MODEL_PATH, STANCE_THRESHOLD) if STANCE_MODEL_PATH else None
+# Completed runs, indexed by request text and claim: a /debate similar enough to one prepared
+# within TOPIC_TTL seconds goes straight to the debate. None runs the whole pipeline every time.
+# The file is shared by webhook workers.
+TOPIC_INDEX_PATH = None  # e.g. "topic_index.sqlite3"
+TOPIC_SIMILARITY_THRESHOLD = 0.8
+TOPIC_TTL = 24 * 3600
+topic_index = TopicIndex(TOPIC_INDEX_PATH, TOPIC_SIMILARITY_THRESHOLD, TOPIC_TTL) if TOPIC_INDEX_PATH else None
+# Stage latencies, token usage and cache/retry counters: served as Prometheus text on this port,
+# and/or appended as JSON lines every METRICS_DUMP_INTERVAL seconds (to the log if no path is set)
+METRICS_PORT = None  # e.g. 9100
+METRICS_DUMP_INTERVAL = None  # e.g. 60
+METRICS_DUMP_PATH = None  # e.g. "metrics.jsonl"
+# Updates are handled one at a time unless this is True or a number of updates at once;
+# per-chat order is kept by each session's lock. loadtest.py shows the difference.
+CONCURRENT_UPDATES = False
+# Deadlines (seconds) for preparing a debate and for generating one round or the summary; every
+# stage also keeps to its own budget in request_context.STAGE_BUDGETS. /cancel aborts either at once.
+PIPELINE_TIMEOUT = 120
+ROUND_TIMEOUT = 90
+# The request each chat is waiting on, so /cancel can abort it
+in_flight: Dict[int, RequestContext] = {}
+
+def begin_request(chat_id: int, timeout: float) -> RequestContext:
+    previous = in_flight.get(chat_id)
+    if previous is not None:
+        previous.cancel("replaced by a newer request")
+    ctx = in_flight[chat_id] = RequestContext(timeout)
+    return ctx
+
+def finish_request(chat_id: int, ctx: RequestContext):
+    if in_flight.get(chat_id) is ctx:
+        del in_flight[chat_id]
+
+def cancel_request(chat_id: int):
+    ctx = in_flight.pop(chat_id, None)
+    if ctx is not None:
+        ctx.cancel("cancelled by the user")
+        metrics.inc("requests_cancelled_total")
 
 # Format one zigzag block
 def format_zigzag_block(text: str, align: str = "left") -> str:
@@ -66,17 +134,77 @@ def format_zigzag_block(text: str, align: str = "left") -> str:
         lines.append("")
     return "\n".join(" " * indent + line for line in lines)
 
-# Show one zigzag block and append to single message
-async def print_zigzag_append(lines_json, prev_text, sent_message):
-    global counter  # Use the global variable
-    for i in range(2):
-        align = "left" if i % 2 == 0 else "right"
-        block = format_zigzag_block(lines_json[str(i + counter)], align)
-        prev_text += block + "\n\n"
-        await asyncio.sleep(0.4)
-        await sent_message.edit_text(prev_text)
-    counter += 2  # Increment the counter for the next round
-    return prev_text
+def render_zigzag(lines_json) -> str:
+    return "".join(
+        format_zigzag_block(lines_json[key], "left" if int(key) % 2 == 0 else "right") + "\n\n"
+        for key in sorted(lines_json, key=int)
+    )
+
+# Generate one round and stream it into the session's single message as the tokens arrive
+async def stream_debate_round(session: DebateSession, ctx: Optional[RequestContext] = None):
+    loop = asyncio.get_running_loop()
+    coalescer = EditCoalescer(session.message, min_interval=STREAM_EDIT_INTERVAL)
+    base_text = session.transcript
+    partial = {}
+
+    def show(turn_key, group_name, delta):
+        partial[turn_key] = partial.get(turn_key, f"{group_name}: ") + delta
+        coalescer.update(base_text + render_zigzag(partial))
+
+    def on_token(turn_key, group_name, delta):
+        # Called from the worker thread; hop back onto the event loop
+        loop.call_soon_threadsafe(show, turn_key, group_name, delta)
+
+    ctx = ctx or RequestContext()
+    try:
+        # The worker thread keeps to the deadline itself, so a round is recorded whole or not at
+        # all; cancelling stops the wait at once (and closes the stream the thread is reading)
+        result = await ctx.guard(asyncio.to_thread(session.simulator.simulate_debate, on_token, ctx), deadline=False)
+        # The final text is authoritative (stripped, or an error placeholder)
+        session.transcript = base_text + render_zigzag(result)
+        coalescer.update(session.transcript)
+    finally:
+        await coalescer.close()
+    session.turn += len(result)
+    sessions.save(session)
+    sessions.enforce_limits()
+    return session.transcript
+
+# Stream a round under a request /cancel can abort; False if it ran out of time
+async def generate_round(session: DebateSession) -> bool:
+    ctx = begin_request(session.chat_id, ROUND_TIMEOUT)
+    try:
+        await stream_debate_round(session, ctx)
+        return True
+    except DeadlineExceeded:
+        return False
+    finally:
+        finish_request(session.chat_id, ctx)
+
+# Show the round prefetched while the keyboard was up; False if there is none to serve. Waiting for
+# it is a request like any other: /cancel or a new /debate stops it, and it keeps to ROUND_TIMEOUT.
+async def serve_prefetched_round(session: DebateSession) -> bool:
+    chat_id = session.chat_id
+    ctx = begin_request(chat_id, ROUND_TIMEOUT)
+    try:
+        round_ = await prefetcher.take(chat_id, session.turn, ctx)
+    except DeadlineExceeded:
+        return False  # generate a fresh round instead
+    finally:
+        finish_request(chat_id, ctx)
+    if sessions.get(chat_id) is not session:
+        raise Cancelled(f"debate of chat {chat_id} ended while its round was generated")
+    if round_ is None:
+        return False
+    result = session.simulator.commit_round(round_)
+    if result is None:
+        return False
+    session.transcript += render_zigzag(result)
+    await session.message.edit_text(session.transcript)
+    session.turn += len(result)
+    sessions.save(session)
+    sessions.enforce_limits()
+    return True
 
 # Build yes/no inline keyboard
 def yes_no_keyboard():
@@ -88,44 +216,72 @@ def yes_no_keyboard():
 # /debate handler
 async def start_debate(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
-    user_data_store[chat_id] = {"counter": 0}
 
     await update.message.reply_text("💬 Starting debate...")
 
     user_input = " ".join(context.args)
-    user_input = {
-    "text": user_input
-    }   
-
-    # Specify the file path
-    json_file_path = "ExaInput.json"
-
-    # Write the structure to a JSON file
-    with open(json_file_path, 'w') as json_file:
-        json.dump(user_input, json_file, indent=4)
-    
-    input_json = "ExaInput.json"  # Placeholder for the actual input JSON
-    print(input_json)  
-    model_name = "openai/gpt-4.1-nano"  # Or any OpenRouter-supported model
-    extractor = working.ConflictExtractor(input_json, model_name)
-    extractor.run_pipeline()
 
-    with open('classified_bias_output.json', 'r') as file:
-        result1 = json.load(file)
+    model_name = "openai/gpt-4.1-nano"  # Or any OpenRouter-supported model
+    extractor = working.ConflictExtractor(None, model_name, article_text=user_input,
+                                          stance_model=stance_model, stance_audit_rate=STANCE_AUDIT_RATE,
+                                          search_tag_audit_rate=SEARCH_TAG_AUDIT_RATE,
+                                          topic_index=topic_index)
+    # Awaiting the async pipeline keeps the event loop free for every other chat;
+    # stage results stay in memory, so concurrent debates never share files
+    ctx = begin_request(chat_id, PIPELINE_TIMEOUT)
+    try:
+        run = await extractor.run_pipeline_async(sink=PIPELINE_SINK, ctx=ctx)
+    except DeadlineExceeded:
+        await update.message.reply_text("⏱️ Preparing that debate took too long. Please try again.")
+        return ConversationHandler.END
+    except Cancelled:
+        return ConversationHandler.END  # /cancel has already answered, or a newer /debate took over
+    finally:
+        finish_request(chat_id, ctx)
+    result1 = run.classified
+    if result1 is None:
+        await update.message.reply_text("⚠️ Couldn't find a conflict in that text. Try rephrasing it.")
+        return ConversationHandler.END
 
     print(result1)
 
-    result2 = func1(result1)
-
-    sent_msg = await update.message.reply_text("🧠 Generating...")
-    updated_text = await print_zigzag_append(result2, "", sent_msg)
-
-    context.user_data["message"] = sent_msg
-    context.user_data["text"] = updated_text
+    prefetcher.discard(chat_id)  # a new /debate replaces whatever this chat had going
+    simulator = DebateSimulator(result1, history_store=HISTORY_STORE, session_id=str(chat_id),
+                                context_turns=DEBATE_CONTEXT_TURNS)
+    session = sessions.start(chat_id, simulator)
+    try:
+        async with session.lock:
+            session.message = MessageRef.of(await update.message.reply_text("🧠 Generating..."))
+            finished = await generate_round(session)
+    except Cancelled:
+        return ConversationHandler.END
 
+    if not finished:
+        await update.message.reply_text("⏱️ The debaters took too long. Try again?", reply_markup=yes_no_keyboard())
+        return ASK_CONTINUE
     await update.message.reply_text("Do you want to continue?", reply_markup=yes_no_keyboard())
+    prefetcher.start(chat_id, session.simulator)
     return ASK_CONTINUE
 
+# Rebuild a chat's session from the stores (the session was evicted, or the bot or its worker restarted)
+async def resume_session(chat_id, message):
+    simulator = DebateSimulator.resume(HISTORY_STORE, str(chat_id), context_turns=DEBATE_CONTEXT_TURNS)
+    if simulator is None:
+        return None
+    state = sessions.load_state(chat_id)
+    if state is not None and state["turn"] == len(simulator.history):
+        # The stored transcript still matches the logged turns: keep editing the same message
+        return sessions.restore(state, simulator, bot=message.get_bot())
+    session = sessions.start(chat_id, simulator)
+    lines = simulator.labeled_history()
+    session.transcript = render_zigzag(lines)
+    session.turn = len(lines)
+    session.rounds = max(0, session.turn // 2 - 1)
+    # The original message object is gone, so the transcript continues in a new one
+    session.message = MessageRef.of(await message.reply_text(session.transcript or "🧠 Resuming debate..."))
+    sessions.save(session)
+    return session
+
 # Handle button presses
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -134,58 +290,120 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     user_input = query.data
     chat_id = query.message.chat.id
-    user_state = user_data_store.get(chat_id, {"counter": 0})
-    counter = user_state["counter"]
 
-    sent_msg = context.user_data["message"]
+    session = sessions.get(chat_id) or await resume_session(chat_id, query.message)
+    if session is None:
+        await query.message.reply_text("⌛ This debate has expired. Start a new one with /debate.")
+        return ConversationHandler.END
 
-    if user_input == "yes" and counter < 4:
-        user_state["counter"] += 1
-        result2 = func1({"text": "continue"})
-        updated_text = await print_zigzag_append(result2, context.user_data["text"], sent_msg)
-        context.user_data["text"] = updated_text
+    try:
+        async with session.lock:
+            return await continue_or_summarize(session, query, user_input == "yes")
+    except Cancelled:
+        return ConversationHandler.END  # /cancel has already answered
+
+# Another round on "yes" (while rounds are left), else the summary
+async def continue_or_summarize(session: DebateSession, query, another_round: bool):
+    chat_id = session.chat_id
+    if another_round and session.rounds < MAX_ROUNDS:
+        session.rounds += 1
+        if not await serve_prefetched_round(session) and not await generate_round(session):
+            session.rounds -= 1  # a round that ran out of time doesn't count
+            await query.message.reply_text("⏱️ The debaters took too long. Try again?", reply_markup=yes_no_keyboard())
+            return ASK_CONTINUE
         await query.message.reply_text("Continue again?", reply_markup=yes_no_keyboard())
+        if session.rounds < MAX_ROUNDS:
+            prefetcher.start(chat_id, session.simulator)
         return ASK_CONTINUE
     else:
-        result2 = func1({"text": "finish"})
+        prefetcher.discard(chat_id)
+        ctx = begin_request(chat_id, ROUND_TIMEOUT)
+        try:
+            result2 = await ctx.guard(asyncio.to_thread(session.simulator.summarize_debate, ctx), deadline=False)
+        finally:
+            finish_request(chat_id, ctx)
+        sessions.end(chat_id)
+        HISTORY_STORE.delete(str(chat_id))
         plain_text = ""
         # Since result2 has only one key ("Summary"), just extract and format that
         summary_text = result2.get("summary", "No summary found.")
         plain_text += summary_text + "\n\n"
         # Combine with previously saved content
-        full_text = context.user_data["text"] + plain_text
+        full_text = session.transcript + plain_text
         # Edit the original sent message with the full updated content
-        await sent_msg.edit_text(full_text)
+        await session.message.edit_text(full_text)
         # Remove the inline button message
         await query.message.delete()
         return ConversationHandler.END
 
 # Cancel
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Stops whatever the chat is waiting on: its pipeline run, round or summary, calls in flight included
+    cancel_request(update.effective_chat.id)
+    prefetcher.discard(update.effective_chat.id)
+    sessions.end(update.effective_chat.id)
+    HISTORY_STORE.delete(str(update.effective_chat.id))
     await update.message.reply_text("❌ Debate canceled.")
     return ConversationHandler.END
 
 #-----------------------------------------------------------------------------
 
 # Main bot setup
-def main():
-    token = BOT_KEY
-
-    app = ApplicationBuilder().token(token).build()
+def build_application(updater: bool = True, token: str = BOT_KEY, base_url: Optional[str] = None):
+    """
+    The bot with all its handlers; webhook workers build it without an updater and feed it updates.
+    base_url replaces Telegram's Bot API endpoint (loadtest.py points it at a fake one).
+    """
+    builder = ApplicationBuilder().token(token).concurrent_updates(CONCURRENT_UPDATES)
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    if not updater:
+        builder = builder.updater(None)
+    app = builder.build()
 
 
     app.add_handler(CommandHandler("start", start_handler))
     app.add_handler(CommandHandler("help", help_handler))
     #app.add_handler(CommandHandler("debate", debate_handler)) 
+    # The long handlers don't block the update queue, so /cancel is handled while they run (the
+    # WAITING state), as is a tap on a keyboard sent just before its handler returned; taps of
+    # one chat still take turns on the session lock. A /debate sent meanwhile cancels the running
+    # request (begin_request) and starts the new debate in its place.
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("debate", start_debate)],
-        states={ASK_CONTINUE: [CallbackQueryHandler(button_handler)]},
+        # Yes/No taps are entry points too, so a debate left mid-conversation by a restart can resume
+        entry_points=[CommandHandler("debate", start_debate, block=False),
+                      CallbackQueryHandler(button_handler, pattern="^(yes|no)$", block=False)],
+        states={ASK_CONTINUE: [CallbackQueryHandler(button_handler, block=False)],
+                ConversationHandler.WAITING: [CommandHandler("cancel", cancel),
+                                              CommandHandler("debate", start_debate, block=False),
+                                              CallbackQueryHandler(button_handler, pattern="^(yes|no)$", block=False)]},
         fallbacks=[CommandHandler("cancel", cancel)],
+        allow_reentry=True,
     )
 
     app.add_handler(conv_handler)
 
     app.add_handler(conv_handler)
+    return app
+
+def start_metrics(worker_index: int = 0):
+    if METRICS_PORT is not None:
+        metrics.serve_metrics(METRICS_PORT + worker_index)
+    if METRICS_DUMP_INTERVAL is not None:
+        metrics.start_periodic_dump(METRICS_DUMP_INTERVAL, METRICS_DUMP_PATH)
+
+def main():
+    if WEBHOOK_URL:
+        if HISTORY_STORE.in_process or SESSION_STORE.in_process:
+            raise SystemExit("Webhook workers need a file or SQLite HISTORY_STORE and SESSION_STORE, "
+                             "not in-process ones")
+        print(f"Bot is serving its webhook with {WEBHOOK_WORKERS} workers...")
+        webhook.serve_webhook(build_application, BOT_KEY, WEBHOOK_URL, WEBHOOK_PORT, WEBHOOK_WORKERS,
+                              path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET, worker_init=start_metrics)
+        return
+
+    app = build_application()
+    start_metrics()
 
     # Start the bot
     print("Bot is running...")
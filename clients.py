@@ -0,0 +1,197 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import importlib
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional, Tuple
+
+import metrics
+from my_secrets import OPENROUTER_API_KEY, OPENROUTER_API_BASE, EXA_API_KEY
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+# The openai and exa_py SDKs (and httpx under them) are imported on first use, not at
+# import time, so the bot is up and polling before any of them is loaded.
+
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("API_MAX_CONNECTIONS", "50"))
+DEFAULT_MAX_KEEPALIVE = int(os.getenv("API_MAX_KEEPALIVE", "20"))
+DEFAULT_KEEPALIVE_EXPIRY = float(os.getenv("API_KEEPALIVE_EXPIRY", "30"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("API_CONNECT_TIMEOUT", "10"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("API_READ_TIMEOUT", "120"))
+
+# ------------------- Client Registry -------------------
+
+
+class ClientRegistry:
+    """
+    Process-wide API clients with keep-alive connection pools, created on first use and
+    shared by every ConflictExtractor, LanguageModel and bot handler.
+
+    Sync clients are shared by all threads. Async clients are kept per event loop, since
+    an httpx connection pool can't be reused from another loop.
+    openai_base_url / exa_base_url, when set, point every client at another endpoint
+    (a proxy, or benchmark.StubServer) whatever base URL the caller asks for.
+    """
+
+    def __init__(self,
+                 max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive: int = DEFAULT_MAX_KEEPALIVE,
+                 keepalive_expiry: float = DEFAULT_KEEPALIVE_EXPIRY,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout: float = DEFAULT_READ_TIMEOUT,
+                 openai_base_url: Optional[str] = None,
+                 exa_base_url: Optional[str] = None):
+        self.max_connections = max_connections
+        self.max_keepalive = max_keepalive
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.openai_base_url = openai_base_url
+        self.exa_base_url = exa_base_url
+        self._lock = threading.Lock()
+        self._openai: Dict[Tuple[str, str], object] = {}
+        self._exa = None
+        # loop -> {key: client}; entries vanish with their loop
+        self._async: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+    def _limits(self, httpx=None):
+        httpx = httpx or importlib.import_module("httpx")
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+    def _timeout(self, httpx=None):
+        httpx = httpx or importlib.import_module("httpx")
+        return httpx.Timeout(self.read_timeout, connect=self.connect_timeout)
+
+    @staticmethod
+    def _httpx_of(client_class):
+        """
+        The httpx package an SDK's client class is built on. Some openai builds ship on a
+        renamed fork, whose pool and timeout settings must be its own types, not httpx's.
+        """
+        for base in client_class.__mro__[1:]:
+            package = base.__module__.split(".")[0]
+            if package.startswith("httpx"):
+                return importlib.import_module(package)
+        return importlib.import_module("httpx")
+
+    @staticmethod
+    def _response_hooks(provider: str, is_async: bool) -> dict:
+        """httpx event hooks counting every response (retries included) per provider and status."""
+        if is_async:
+            async def count(response):
+                metrics.count_http_response(provider, response.status_code)
+        else:
+            def count(response):
+                metrics.count_http_response(provider, response.status_code)
+        return {"response": [count]}
+
+    def openai(self, base_url: str = OPENROUTER_API_BASE, api_key: str = OPENROUTER_API_KEY):
+        """Shared OpenAI client for base_url/api_key."""
+        base_url = self.openai_base_url or base_url
+        key = (base_url, api_key)
+        with self._lock:
+            client = self._openai.get(key)
+            if client is None:
+                from openai import OpenAI, DefaultHttpxClient
+                httpx = self._httpx_of(DefaultHttpxClient)
+                client = OpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                    max_retries=0,  # the scheduler retries, with the shared rate limits in view
+                    http_client=DefaultHttpxClient(limits=self._limits(httpx), timeout=self._timeout(httpx),
+                                                   event_hooks=self._response_hooks("openai", False)),
+                )
+                self._openai[key] = client
+                logger.info(f"Created pooled OpenAI client for {base_url}")
+            return client
+
+    def async_openai(self, base_url: str = OPENROUTER_API_BASE, api_key: str = OPENROUTER_API_KEY):
+        """Shared AsyncOpenAI client for base_url/api_key on the running event loop."""
+        base_url = self.openai_base_url or base_url
+        key = ("openai", base_url, api_key)
+        with self._lock:
+            clients = self._async.setdefault(asyncio.get_running_loop(), {})
+            client = clients.get(key)
+            if client is None:
+                from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+                httpx = self._httpx_of(DefaultAsyncHttpxClient)
+                client = AsyncOpenAI(
+                    base_url=base_url,
+                    api_key=api_key,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=self._limits(httpx), timeout=self._timeout(httpx),
+                                                        event_hooks=self._response_hooks("openai", True)),
+                )
+                clients[key] = client
+            return client
+
+    def exa(self):
+        """
+        Shared Exa client. exa_py's sync client sends through module-level `requests` calls,
+        so sharing it saves the per-request setup but can't give it a pool of its own.
+        """
+        with self._lock:
+            if self._exa is None:
+                from exa_py import Exa
+                self._exa = Exa(api_key=EXA_API_KEY, **({"base_url": self.exa_base_url} if self.exa_base_url else {}))
+            return self._exa
+
+    def async_exa(self):
+        """Shared AsyncExa client on the running event loop, backed by a pooled httpx client."""
+        key = ("exa",)
+        with self._lock:
+            clients = self._async.setdefault(asyncio.get_running_loop(), {})
+            client = clients.get(key)
+            if client is None:
+                import httpx
+                from exa_py import AsyncExa
+                client = AsyncExa(api_key=EXA_API_KEY, **({"api_base": self.exa_base_url} if self.exa_base_url else {}))
+                # AsyncExa otherwise builds its own unpooled client lazily in the same attribute
+                client._client = httpx.AsyncClient(
+                    base_url=client.base_url,
+                    headers=client.headers,
+                    limits=self._limits(),
+                    timeout=self._timeout(),
+                    event_hooks=self._response_hooks("exa", True),
+                )
+                clients[key] = client
+            return client
+
+    def close(self):
+        """Closes the sync clients' pools; async ones go with their event loop."""
+        with self._lock:
+            for client in self._openai.values():
+                client.close()
+            self._openai.clear()
+            self._exa = None
+
+
+_registry: Optional[ClientRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def configure(**settings) -> ClientRegistry:
+    """
+    Replaces the process-wide registry, e.g. configure(max_connections=100, read_timeout=60).
+    Call it before the first request; clients already handed out keep their old pools.
+    """
+    global _registry
+    with _registry_lock:
+        _registry = ClientRegistry(**settings)
+        return _registry
+
+
+def registry() -> ClientRegistry:
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = ClientRegistry()
+        return _registry
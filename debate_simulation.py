@@ -1,38 +1,92 @@
 #imports
-import json
-import os
-from typing import List, Dict
-from openai import OpenAI
+import threading
+import time
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional
 import logging
 from my_secrets import OPENROUTER_API_KEY, OPENROUTER_API_BASE
+from llm_cache import LLMCache, cached_chat, cached_chat_stream, default_cache
+from history_store import HistoryStore, MemoryHistoryStore
+from passages import estimate_tokens
+import clients
+from metrics import timed_stage
+from request_context import RequestContext
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Running summaries are refreshed here, off the path of the next debate turn
+_summary_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="debate-summary")
+# How long a turn waits for the previous round's summary before it goes on with the older
+# summary and every turn that summary doesn't cover yet (the pool is shared by all chats)
+SUMMARY_WAIT_SECONDS = 2.0
+# Deadline of one running-summary call, so a stalled provider can't hold a pool thread
+SUMMARY_TIMEOUT_SECONDS = 60.0
+
+
+class RoundCancelled(Exception):
+    """Raised inside a speculative round's token stream once it has been cancelled."""
+
 class LanguageModel:
     def __init__(self,
                  model_name: str,
                  temperature: float = 0.7,
                  openrouter_api_key: str = OPENROUTER_API_KEY,
-                 openrouter_api_base: str = OPENROUTER_API_BASE):
-        self.client = OpenAI(base_url=openrouter_api_base, api_key=openrouter_api_key)
+                 openrouter_api_base: str = OPENROUTER_API_BASE,
+                 cache: Optional[LLMCache] = None,
+                 stage: str = "debate_turn"):
+        # Every model with the same endpoint and key shares one pooled client
+        self.client = clients.registry().openai(openrouter_api_base, openrouter_api_key)
         self.model_name = model_name
         self.temperature = temperature
+        self.cache = cache if cache is not None else default_cache()
+        # Label of this model's calls in the latency and token metrics
+        self.stage = stage
 
-    def ask(self, prompt: str) -> str:
-        response = self.client.chat.completions.create(
+    def ask(self, prompt: str, stage: Optional[str] = None, ctx: Optional[RequestContext] = None) -> str:
+        """:param ctx: Deadline and cancellation of the request this answer is for"""
+        return cached_chat(
+            self.client, self.cache,
             model=self.model_name,
             messages=[{"role": "user", "content": prompt}],
-            temperature=self.temperature
+            temperature=self.temperature,
+            stage=stage or self.stage,
+            ctx=ctx
+        )
+
+    def ask_stream(self, prompt: str, stage: Optional[str] = None, ctx: Optional[RequestContext] = None) -> Iterator[str]:
+        """Like ask, but yields the answer in pieces as the model streams it."""
+        return cached_chat_stream(
+            self.client, self.cache,
+            model=self.model_name,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=self.temperature,
+            stage=stage or self.stage,
+            ctx=ctx
         )
-        return response.choices[0].message.content
 
     def __call__(self, prompt: str) -> str:
         return self.ask(prompt)
 
 
 class DebateSimulator:
-    def __init__(self, data: dict, model_name: str = "openai/gpt-4.1-nano", history_file: str = "debate_history.json"):
+    def __init__(self,
+                 data: dict,
+                 model_name: str = "openai/gpt-4.1-nano",
+                 history_store: Optional[HistoryStore] = None,
+                 session_id: str = "default",
+                 resume: bool = False,
+                 context_turns: Optional[int] = None,
+                 context_token_budget: int = 800):
+        """
+        :param history_store: Where turns are logged; defaults to a private in-memory store
+        :param session_id: Key of this debate's log inside the store
+        :param resume: Continue the turns already logged for session_id instead of starting over
+        :param context_turns: If set, prompts carry only the last K turns verbatim plus a rolling
+            neutral summary of the debate, instead of the whole transcript
+        :param context_token_budget: Token cap for that summary + recent turns in each prompt
+        """
         self.claim = data["claim"]
         self.groups = {
             "group1": {
@@ -46,39 +100,117 @@ class DebateSimulator:
         }
 
         self.model = LanguageModel(model_name)
-        self.history_file = history_file
+        self.context_turns = context_turns
+        self.context_token_budget = context_token_budget
+        self.summary_model = LanguageModel(model_name, temperature=0.0, stage="running_summary") if context_turns is not None else None
+        # Neutral summary (with a verdict so far) of the first summarized_upto turns
+        self.running_summary = ""
+        self.summarized_upto = 0
+        self._summary_future: Optional[Future] = None
+        self._summary_lock = threading.Lock()  # one update at a time, even if a round outpaces the last one
+        self.history_store = history_store if history_store is not None else MemoryHistoryStore()
+        self.session_id = session_id
 
-        # Reset the history file at initialization
-        with open(self.history_file, 'w') as f:
-            json.dump({}, f, indent=4)
+        # Turns are kept in memory too, so building a prompt never re-reads the store
+        log = self.history_store.load(session_id) if resume else None
+        if log is None:
+            self.history_store.start(session_id, data)
+            self.history: Dict[str, str] = {}
+        else:
+            self.history = log["turns"]
+
+    @classmethod
+    def resume(cls, history_store: HistoryStore, session_id: str, model_name: str = "openai/gpt-4.1-nano", **kwargs):
+        """Rebuilds a debate from its logged setup and turns, e.g. after a bot restart. None if nothing is logged."""
+        log = history_store.load(session_id)
+        if log is None or not log["setup"]:
+            return None
+        return cls(log["setup"], model_name, history_store=history_store, session_id=session_id, resume=True, **kwargs)
 
     def format_sources(self, sources: List[str]) -> str:
         return "\n".join(f"- {source}" for source in sources)
 
     def read_history(self) -> Dict[str, str]:
-        """Reads the history from the JSON file."""
-        if os.path.exists(self.history_file):
-            with open(self.history_file, 'r') as f:
-                return json.load(f)
-        else:
-            return {}
+        """Returns a copy of the turns so far."""
+        return dict(self.history)
 
-    def write_history(self, history: Dict[str, str]):
-        """Writes the updated history back to the JSON file."""
-        with open(self.history_file, 'w') as f:
-            json.dump(history, f, indent=4)
+    def append_turn(self, turn_key: str, text: str):
+        """Records one turn in memory and appends it to the history store."""
+        self.history[turn_key] = text
+        self.history_store.append(self.session_id, turn_key, text)
 
-    def simulate_debate(self) -> Dict[str, str]:
+    def labeled_history(self) -> Dict[str, str]:
+        """All turns so far, in the same "Group Name: <argument>" form simulate_debate returns."""
+        return {
+            i: f"{self.groups['group1' if int(i) % 2 == 0 else 'group2']['name']}: {v}"
+            for i, v in self.history.items()
+        }
+
+    @timed_stage("simulate_debate")
+    def simulate_debate(self, on_token: Optional[Callable[[str, str, str], None]] = None,
+                        ctx: Optional[RequestContext] = None) -> Dict[str, str]:
         """
-        Simulates a 2-sentence back-and-forth debate (3 turns per group), appends it to the history,
-        and writes back to the JSON file.
+        Simulates a 2-sentence back-and-forth debate (one turn per group) and appends
+        each turn to the history store.
+        :param on_token: If given, turns are streamed and on_token(turn_key, group_name, delta)
+            is called for every piece of text as it arrives
+        :param ctx: Each turn gets ctx's "debate_turn" budget and shows the error placeholder if it
+            runs out. If ctx itself is cancelled or out of time, Cancelled/DeadlineExceeded is
+            raised and nothing is recorded.
         :return: A dictionary with keys "i" (as strings) and values "Group Name: <argument>"
         """
-        # Read current history
-        history = self.read_history()
-        full_session = {}
+        round_ = self._generate_round(on_token, ctx=ctx)
+        if ctx is not None:
+            ctx.check()
+        return self.commit_round(round_)
+
+    @timed_stage("speculate_round")
+    def speculate_round(self, cancel_event: Optional[threading.Event] = None) -> Optional[dict]:
+        """
+        Generates the next round without recording it, so it can be committed later with
+        commit_round or thrown away. Setting cancel_event stops generation mid-stream.
+        :return: The uncommitted round; round["cancelled"] is True if it was stopped early
+        """
+        def on_token(turn_key, group_name, delta):
+            if cancel_event.is_set():
+                raise RoundCancelled()
+
+        round_ = self._generate_round(on_token if cancel_event is not None else None, cancel_event)
+        round_["cancelled"] = cancel_event is not None and cancel_event.is_set()
+        return round_
+
+    def commit_round(self, round_: dict) -> Optional[Dict[str, str]]:
+        """
+        Records a generated round in the history.
+        :return: The same dictionary simulate_debate returns, or None if the round is stale
+            (the debate moved on since it was generated)
+        """
+        if round_["base_turn"] != len(self.history):
+            return None
+        for turn_key, text in round_["turns"].items():
+            self.append_turn(turn_key, text)
+
+        if self.context_turns is not None:
+            # Fold this round into the running summary while the user reads it
+            self._summary_future = _summary_pool.submit(self._update_running_summary)
+
+        return round_["labeled"]
+
+    def _generate_round(self, on_token=None, cancel_event: Optional[threading.Event] = None,
+                        ctx: Optional[RequestContext] = None) -> dict:
+        # Works on a copy of the history; nothing is recorded until commit_round
+        history = dict(self.history)
+        base_turn = len(history)
+        turns, full_session, tokens = {}, {}, 0
+        # Speculative rounds yield to turns a user is actually waiting for
+        stage = "speculative_turn" if cancel_event is not None else None
 
         for _ in range(2):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if ctx is not None:
+                ctx.check()
+            turn_ctx = ctx.stage("debate_turn") if ctx is not None else None
             turn = len(history)  # current turn number
             turn_key = str(turn)
 
@@ -89,12 +221,8 @@ class DebateSimulator:
             sources = self.format_sources(current_group["sources"])
 
             # Build debate history string
-            debate_history = "\n".join(
-                f"{i}: {self.groups['group1' if int(i) % 2 == 0 else 'group2']['name']}: {v}"
-                for i, v in history.items()
-            )
+            debate_history = self._debate_context(history, turn_ctx)
 
-            # Build the prompt
             # Build the prompt
             prompt = (
                 f"You’re part of a friendly, structured chat about the claim:\n"
@@ -109,29 +237,121 @@ class DebateSimulator:
                 f"Format it like this:\n"
                 f"<your sentence> (Source: <source> only the link)"
                 )
+            parts = []
             try:
-                response = self.model.ask(prompt)
+                if on_token is None:
+                    response = self.model.ask(prompt, stage=stage, ctx=turn_ctx)
+                else:
+                    # closing() ends the stream (and frees its connection) even when on_token raises
+                    with closing(self.model.ask_stream(prompt, stage=stage, ctx=turn_ctx)) as stream:
+                        for delta in stream:
+                            parts.append(delta)
+                            on_token(turn_key, group_name, delta)
+                    response = "".join(parts)
                 print(response)
+            except RoundCancelled:
+                tokens += estimate_tokens(prompt) + estimate_tokens("".join(parts))
+                break
             except Exception as e:
+                if ctx is not None:
+                    ctx.check()  # the request is over, not just this turn
                 print(f"[ERROR] Error generating response: {e}")
                 response = "[ERROR generating response]"
 
-            # Add to history
             history[turn_key] = response.strip()
-            self.write_history(history)
-
-            # Append to result dict
+            turns[turn_key] = response.strip()
             full_session[turn_key] = f"{group_name}: {response.strip()}"
+            tokens += estimate_tokens(prompt) + estimate_tokens(response)
+
+        return {"base_turn": base_turn, "turns": turns, "labeled": full_session, "tokens": tokens}
+
+    def _debate_context(self, history: Dict[str, str], ctx: Optional[RequestContext] = None) -> str:
+        """The "what's been said so far" part of a turn prompt."""
+        lines = [
+            f"{i}: {self.groups['group1' if int(i) % 2 == 0 else 'group2']['name']}: {v}"
+            for i, v in history.items()
+        ]
+        if self.context_turns is None:
+            return "\n".join(lines)
+
+        self._wait_for_summary(ctx)
+        running_summary, summarized_upto = self.running_summary, self.summarized_upto
+        summary = f"Summary of the debate so far:\n{running_summary}\n\n" if running_summary else ""
+        # Newest turns first, as many as fit next to the summary. If the summary is behind, the
+        # turns it doesn't cover yet are all candidates, not just the last context_turns.
+        count = max(self.context_turns, len(lines) - summarized_upto)
+        budget = self.context_token_budget - estimate_tokens(summary)
+        recent = []
+        for line in reversed(lines[-count:] if count else []):
+            cost = estimate_tokens(line)
+            if recent and cost > budget:
+                break
+            recent.append(line)
+            budget -= cost
+        return summary + "Most recent turns:\n" + "\n".join(reversed(recent))
 
-        return full_session
+    def _wait_for_summary(self, ctx: Optional[RequestContext] = None, timeout: float = SUMMARY_WAIT_SECONDS):
+        """
+        Waits up to `timeout` for the pending running-summary update, or less if ctx ends first
+        (which raises Cancelled/DeadlineExceeded). The update keeps going if it isn't done by then.
+        """
+        future = self._summary_future
+        if future is None:
+            return
+        if ctx is None:
+            wait([future], timeout=timeout)
+        else:
+            ctx.check()
+            give_up = time.monotonic() + timeout
+            while not future.done() and time.monotonic() < give_up:
+                wait([future], timeout=min(ctx.poll_timeout(), max(0.0, give_up - time.monotonic())))
+                ctx.check()
+        if not future.done():
+            logger.info("Running summary not ready; using the previous one plus the newer turns")
+        elif future.exception() is not None:
+            logger.error(f"Running summary update failed: {future.exception()}")
+
+    def _update_running_summary(self):
+        """Folds every turn not yet summarized into the running neutral summary (one model call)."""
+        with self._summary_lock:
+            self._fold_new_turns()
+
+    def _fold_new_turns(self):
+        keys = sorted(self.history, key=int)[self.summarized_upto:]
+        if not keys:
+            return
+        new_turns = "\n".join(
+            f"{self.groups['group1' if int(i) % 2 == 0 else 'group2']['name']}: {self.history[i]}"
+            for i in keys
+        )
+        max_words = max(30, self.context_token_budget // 2 * 3 // 4)
+        prompt = (
+            f"You are a neutral observer keeping a running summary of a debate.\n"
+            f"Claim: {self.claim}\n\n"
+            f"Summary so far:\n{self.running_summary or '(nothing yet)'}\n\n"
+            f"New turns:\n{new_turns}\n\n"
+            f"Rewrite the summary so it also covers the new turns, in at most {max_words} words, without taking sides.\n"
+            f"Then, on a new line, offer a very very short non-biased verdict so far, based only on the arguments provided."
+        )
+        ctx = RequestContext(timeout=SUMMARY_TIMEOUT_SECONDS, name="running_summary")
+        summary = self.summary_model.ask(prompt, ctx=ctx)
+        if summary and summary.strip():
+            self.running_summary, self.summarized_upto = summary.strip(), self.summarized_upto + len(keys)
 
-    def summarize_debate(self) -> Dict[str, str]:
+    @timed_stage("summarize_debate")
+    def summarize_debate(self, ctx: Optional[RequestContext] = None) -> Dict[str, str]:
         """
         Summarizes the full debate from a non-biased perspective and optionally gives a verdict.
+        :param ctx: If it is cancelled while the summary is generated, Cancelled is raised
         :return: A dictionary with key "summary" and a summary + verdict as value
         """
-        # Read full debate history
-        history = self.read_history()
+        if self.context_turns is not None:
+            # The running summary is usually already up to date, which makes this instant
+            self._wait_for_summary(ctx)
+            if self.running_summary and self.summarized_upto == len(self.history):
+                return {"summary": self.running_summary}
+
+        history = self.history
 
         # Reconstruct debate history in human-readable format
         debate_text = "\n".join(
@@ -150,9 +370,11 @@ class DebateSimulator:
 
         try:
             print("\n[Summary Requesting from model...]")
-            summary_response = self.model.ask(prompt)
+            summary_response = self.model.ask(prompt, stage="summarize_debate", ctx=ctx)
             print(summary_response)
         except Exception as e:
+            if ctx is not None:
+                ctx.raise_if_cancelled()
             print(f"[ERROR] Error generating summary: {e}")
             summary_response = "[ERROR generating summary]"
 
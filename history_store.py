@@ -0,0 +1,163 @@
+# ------------------- Imports ---------------------
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# ------------------- History Stores -------------------
+# A debate is a setup (claim + groups) followed by numbered turns. Stores keep one log per
+# session id and only ever append a turn, so each turn costs O(1) I/O.
+
+
+class HistoryStore:
+    """Base class for debate history backends."""
+
+    in_process = False  # True if logs live in this process's memory, so nothing else can resume them
+
+    def start(self, session_id: str, setup: dict):
+        """Begins a new log for session_id, discarding any previous one."""
+        raise NotImplementedError
+
+    def append(self, session_id: str, turn_key: str, text: str):
+        raise NotImplementedError
+
+    def load(self, session_id: str) -> Optional[dict]:
+        """
+        :return: {"setup": <dict>, "turns": {"0": ..., "1": ...}} or None if the session is unknown
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id: str):
+        raise NotImplementedError
+
+
+class MemoryHistoryStore(HistoryStore):
+    """Keeps logs in process memory; the default, lost on restart."""
+
+    in_process = True
+
+    def __init__(self):
+        self._logs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id: str, setup: dict):
+        with self._lock:
+            self._logs[session_id] = {"setup": setup, "turns": {}}
+
+    def append(self, session_id: str, turn_key: str, text: str):
+        with self._lock:
+            self._logs.setdefault(session_id, {"setup": {}, "turns": {}})["turns"][turn_key] = text
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            log = self._logs.get(session_id)
+            return None if log is None else {"setup": log["setup"], "turns": dict(log["turns"])}
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._logs.pop(session_id, None)
+
+
+class JsonlHistoryStore(HistoryStore):
+    """
+    One append-only JSONL file per session under base_dir.
+    The first line holds the setup, every following line one turn.
+    """
+
+    def __init__(self, base_dir: str = "debate_histories"):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _path(self, session_id: str) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", session_id)
+        return os.path.join(self.base_dir, f"{safe_id}.jsonl")
+
+    def _write_line(self, session_id: str, record: dict, mode: str):
+        with open(self._path(session_id), mode, encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def start(self, session_id: str, setup: dict):
+        self._write_line(session_id, {"setup": setup}, "w")
+
+    def append(self, session_id: str, turn_key: str, text: str):
+        self._write_line(session_id, {"turn": turn_key, "text": text}, "a")
+
+    def load(self, session_id: str) -> Optional[dict]:
+        path = self._path(session_id)
+        if not os.path.exists(path):
+            return None
+        log = {"setup": {}, "turns": {}}
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a torn last line; everything before it is intact
+                    logger.warning(f"Skipping unreadable line in {path}")
+                    continue
+                if "setup" in record:
+                    log["setup"] = record["setup"]
+                else:
+                    log["turns"][record["turn"]] = record["text"]
+        return log
+
+    def delete(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteHistoryStore(HistoryStore):
+    """All sessions in one SQLite file, one row per turn."""
+
+    def __init__(self, path: str = "debate_history.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS setups (session_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "session_id TEXT NOT NULL, turn INTEGER NOT NULL, text TEXT NOT NULL, PRIMARY KEY (session_id, turn))"
+        )
+        self._conn.commit()
+
+    def start(self, session_id: str, setup: dict):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO setups (session_id, data) VALUES (?, ?)",
+                (session_id, json.dumps(setup, ensure_ascii=False)),
+            )
+            self._conn.commit()
+
+    def append(self, session_id: str, turn_key: str, text: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO turns (session_id, turn, text) VALUES (?, ?, ?)",
+                (session_id, int(turn_key), text),
+            )
+            self._conn.commit()
+
+    def load(self, session_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM setups WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            turns = self._conn.execute(
+                "SELECT turn, text FROM turns WHERE session_id = ? ORDER BY turn", (session_id,)
+            ).fetchall()
+        return {"setup": json.loads(row[0]), "turns": {str(turn): text for turn, text in turns}}
+
+    def delete(self, session_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM setups WHERE session_id = ?", (session_id,))
+            self._conn.commit()
@@ -0,0 +1,372 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional
+
+import metrics
+import scheduler
+from passages import estimate_tokens
+from request_context import RequestContext
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", ".llm_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = 50_000
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+# Completion tokens reserved against the rate limits when a call sets no max_tokens
+DEFAULT_COMPLETION_ESTIMATE = 256
+
+# ------------------- Cache Backends -------------------
+
+
+def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int]) -> str:
+    """Content address of a chat request: sha256 over a canonical JSON of everything that shapes the answer."""
+    payload = json.dumps(
+        {"model": model, "messages": messages, "temperature": temperature, "max_tokens": max_tokens},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Base class for chat-completion response caches.
+    Subclasses implement _get/_set; this class handles hit/miss counting and the temperature bypass.
+    """
+
+    # get/set do blocking I/O, so async callers run them in a worker thread
+    blocking = False
+
+    def __init__(self, ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS, cache_nonzero_temperature: bool = False):
+        self.ttl_seconds = ttl_seconds
+        self.cache_nonzero_temperature = cache_nonzero_temperature
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self._stats_lock = threading.Lock()
+
+    def should_cache(self, temperature: float) -> bool:
+        # Sampling at temperature > 0 is meant to vary, so only reuse it when asked to
+        return temperature == 0 or self.cache_nonzero_temperature
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._get(key)
+        with self._stats_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.inc("llm_cache_lookups_total", result="miss" if value is None else "hit")
+        return value
+
+    def set(self, key: str, value: str):
+        if value:
+            self._set(key, value)
+
+    def record_bypass(self):
+        with self._stats_lock:
+            self.bypasses += 1
+        metrics.inc("llm_cache_lookups_total", result="bypass")
+
+    def stats(self) -> Dict[str, int]:
+        with self._stats_lock:
+            return {"hits": self.hits, "misses": self.misses, "bypasses": self.bypasses}
+
+    def _expired(self, created_at: float) -> bool:
+        return self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+
+    def _get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def _set(self, key: str, value: str):
+        raise NotImplementedError
+
+
+class NullCache(LLMCache):
+    """Never stores anything; use it to switch caching off."""
+
+    def should_cache(self, temperature: float) -> bool:
+        return False
+
+    def _get(self, key: str) -> Optional[str]:
+        return None
+
+    def _set(self, key: str, value: str):
+        pass
+
+
+class MemoryCache(LLMCache):
+    """In-process LRU cache, bounded by entry count and TTL."""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, created_at = entry
+            if self._expired(created_at):
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = (value, time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache(LLMCache):
+    """
+    On-disk cache shared across runs and processes. Entries expire after ttl_seconds;
+    past max_entries the least recently used ones are evicted.
+    """
+
+    blocking = True
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self._conn.commit()
+
+    def _get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self._expired(created_at):
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return value
+
+    def _set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            if self.ttl_seconds is not None:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_default_cache: Optional[LLMCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def default_cache() -> LLMCache:
+    """
+    Process-wide cache used when a caller doesn't pass its own.
+    Set LLM_CACHE=off to disable, or LLM_CACHE=memory to keep it in-process.
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            mode = os.getenv("LLM_CACHE", "sqlite").lower()
+            if mode == "off":
+                _default_cache = NullCache()
+            elif mode == "memory":
+                _default_cache = MemoryCache()
+            else:
+                _default_cache = SQLiteCache()
+        return _default_cache
+
+
+# ------------------- Cached Calls -------------------
+
+
+def cached_chat(client, cache: LLMCache, model: str, messages: List[Dict[str, str]],
+                temperature: float, max_tokens: Optional[int] = None, stage: str = "other",
+                ctx: Optional[RequestContext] = None) -> str:
+    """
+    Runs client.chat.completions.create through the cache and returns the message content.
+    `stage` labels the call's latency and token usage in the metrics. With ctx, the request
+    times out at ctx's deadline and isn't sent or retried once ctx is cancelled.
+    """
+    if not cache.should_cache(temperature):
+        cache.record_bypass()
+        return _create(client, model, messages, temperature, max_tokens, stage, ctx)
+
+    key = make_key(model, messages, temperature, max_tokens)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    content = _create(client, model, messages, temperature, max_tokens, stage, ctx)
+    cache.set(key, content)
+    return content
+
+
+async def cached_chat_async(client, cache: LLMCache, model: str, messages: List[Dict[str, str]],
+                            temperature: float, max_tokens: Optional[int] = None, stage: str = "other",
+                            ctx: Optional[RequestContext] = None) -> str:
+    """Async twin of cached_chat for AsyncOpenAI clients; cancelling ctx aborts the request in flight."""
+    if not cache.should_cache(temperature):
+        cache.record_bypass()
+        return await _create_async(client, model, messages, temperature, max_tokens, stage, ctx)
+
+    key = make_key(model, messages, temperature, max_tokens)
+    cached = await asyncio.to_thread(cache.get, key) if cache.blocking else cache.get(key)
+    if cached is not None:
+        return cached
+    content = await _create_async(client, model, messages, temperature, max_tokens, stage, ctx)
+    if cache.blocking:
+        await asyncio.to_thread(cache.set, key, content)
+    else:
+        cache.set(key, content)
+    return content
+
+
+def cached_chat_stream(client, cache: LLMCache, model: str, messages: List[Dict[str, str]],
+                       temperature: float, max_tokens: Optional[int] = None, stage: str = "other",
+                       ctx: Optional[RequestContext] = None) -> Iterator[str]:
+    """
+    Streaming twin of cached_chat: yields content deltas as the model produces them.
+    A cache hit is yielded as one chunk; a fully streamed answer is stored afterwards.
+    Cancelling ctx closes the stream from whichever thread cancels it; the generator then
+    raises Cancelled, and nothing is cached. Callers that stop reading early must close()
+    the generator, which closes the stream and frees its connection.
+    """
+    use_cache = cache.should_cache(temperature)
+    if use_cache:
+        key = make_key(model, messages, temperature, max_tokens)
+        cached = cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    else:
+        cache.record_bypass()
+
+    parts = []
+    provider, tokens = scheduler.provider_of(client), _token_estimate(messages, max_tokens)
+    # Times the request until the stream opens; the stage span covers the rest
+    with metrics.span("llm_call", model=model, stage=stage, stream="true"):
+        stream = scheduler.scheduler().call(
+            lambda: client.chat.completions.create(
+                stream=True, stream_options={"include_usage": True},
+                **_request_kwargs(model, messages, temperature, max_tokens, ctx)
+            ),
+            provider, model, tokens, scheduler.priority_for(stage), ctx,
+        )
+    remove = ctx.on_cancel(stream.close) if ctx is not None else None
+    try:
+        for chunk in stream:
+            if ctx is not None:
+                ctx.check()
+            # With include_usage the last chunk has no choices, only the usage
+            usage = getattr(chunk, "usage", None)
+            if usage is not None:
+                metrics.record_usage(model, stage, usage)
+                _settle(provider, model, tokens, usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+    except Exception:
+        if ctx is not None:
+            ctx.raise_if_cancelled()  # the read failed because the stream was closed under it
+        raise
+    finally:
+        if remove is not None:
+            remove()
+        # Also when the caller stops reading early (close() or a raise in its loop): an open
+        # stream holds its pooled connection until it is garbage collected
+        stream.close()
+    if ctx is not None:
+        ctx.raise_if_cancelled()  # a closed stream may also just end early
+    if use_cache:
+        cache.set(key, "".join(parts))
+
+
+def _request_kwargs(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: Optional[int],
+                    ctx: Optional[RequestContext] = None) -> dict:
+    kwargs = {"model": model, "messages": messages, "temperature": temperature}
+    if max_tokens is not None:
+        kwargs["max_tokens"] = max_tokens
+    if ctx is not None and ctx.deadline is not None:
+        # Evaluated per attempt, so a retry only gets the time that is left
+        kwargs["timeout"] = ctx.call_timeout()
+    return kwargs
+
+
+def _token_estimate(messages: List[Dict[str, str]], max_tokens: Optional[int]) -> int:
+    prompt = sum(estimate_tokens(m.get("content") or "") for m in messages)
+    return prompt + (max_tokens if max_tokens is not None else DEFAULT_COMPLETION_ESTIMATE)
+
+
+def _settle(provider, model, tokens, usage):
+    scheduler.scheduler().settle(provider, model, tokens, getattr(usage, "total_tokens", None))
+
+
+def _create(client, model, messages, temperature, max_tokens, stage, ctx=None) -> str:
+    # Rate limits, priorities and retries are the scheduler's job
+    provider, tokens = scheduler.provider_of(client), _token_estimate(messages, max_tokens)
+    with metrics.span("llm_call", model=model, stage=stage, stream="false"):
+        response = scheduler.scheduler().call(
+            lambda: client.chat.completions.create(**_request_kwargs(model, messages, temperature, max_tokens, ctx)),
+            provider, model, tokens, scheduler.priority_for(stage), ctx,
+        )
+    usage = getattr(response, "usage", None)
+    metrics.record_usage(model, stage, usage)
+    _settle(provider, model, tokens, usage)
+    return response.choices[0].message.content
+
+
+async def _create_async(client, model, messages, temperature, max_tokens, stage, ctx=None) -> str:
+    provider, tokens = scheduler.provider_of(client), _token_estimate(messages, max_tokens)
+    with metrics.span("llm_call", model=model, stage=stage, stream="false"):
+        response = await scheduler.scheduler().call_async(
+            lambda: client.chat.completions.create(**_request_kwargs(model, messages, temperature, max_tokens, ctx)),
+            provider, model, tokens, scheduler.priority_for(stage), ctx,
+        )
+    usage = getattr(response, "usage", None)
+    metrics.record_usage(model, stage, usage)
+    _settle(provider, model, tokens, usage)
+    return response.choices[0].message.content
@@ -0,0 +1,465 @@
+# ------------------- Imports ---------------------
+
+import argparse
+import asyncio
+import contextlib
+import gc
+import io
+import itertools
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from benchmark import StubConfig, StubServer, percentiles
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Load Test -------------------
+# Replays scripted conversations (/debate, a few "Yes" taps, then "No") for N chats at once
+# through the real handlers and ConversationHandler of bot.build_application. Telegram is
+# replaced by an in-process fake Bot API, and the model and Exa by benchmark.StubServer,
+# so the bot's own code (pipeline, streaming, edit coalescing, sessions) is what's measured.
+#
+#   python loadtest.py --chats 1,10,50 --rounds 2
+#
+# One JSON line per concurrency level goes to --output.
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Debatify", "username": "debatify_bot"}
+LAG_INTERVAL = 0.05  # seconds between event-loop lag probes
+
+
+class _FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # the default backlog of 5 refuses connections when many chats burst
+
+
+@dataclass
+class _Event:
+    at: float
+    method: str
+    message_id: Optional[int] = None
+    text: str = ""
+    keyboard: bool = False
+
+
+class FakeBotAPI:
+    """
+    Answers the Bot API methods the bot uses, records every call per chat and hands it to
+    `listener` (called from the server thread). With flood_interval set, a chat's edits closer
+    together than that are refused with 429 and retry_after, like Telegram's flood control.
+    """
+
+    def __init__(self, flood_interval: Optional[float] = None):
+        self.flood_interval = flood_interval
+        self.listener: Optional[Callable[[int, _Event], None]] = None
+        self.counts: Counter = Counter()
+        self.errors: Counter = Counter()
+        self.messages: Dict[tuple, dict] = {}
+        self._message_ids = itertools.count(1)
+        self._last_edit: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._httpd = _FakeServer(("127.0.0.1", 0), self._handler_class())
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/bot"
+
+    def start(self) -> "FakeBotAPI":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def reset_counts(self) -> dict:
+        with self._lock:
+            counts = {"calls": dict(self.counts), "errors": dict(self.errors)}
+            self.counts.clear()
+            self.errors.clear()
+        return counts
+
+    def message(self, chat_id: int, text: str, keyboard: Optional[dict] = None) -> dict:
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "from": BOT_USER,
+                   "chat": {"id": chat_id, "type": "private"}, "text": text}
+        if keyboard:
+            message["reply_markup"] = keyboard
+        with self._lock:
+            self.messages[(chat_id, message["message_id"])] = message
+        return message
+
+    def call(self, method: str, params: dict):
+        """(status, result or error description) for one Bot API call."""
+        with self._lock:
+            self.counts[method] += 1
+        if method == "getMe":
+            return 200, BOT_USER
+        if method in ("answerCallbackQuery", "deleteWebhook", "setMyCommands"):
+            return 200, True
+
+        chat_id = int(params.get("chat_id", 0))
+        now = time.monotonic()
+        if method == "sendMessage":
+            keyboard = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+            message = self.message(chat_id, params.get("text", ""), keyboard)
+            self._notify(chat_id, _Event(now, method, message["message_id"], message["text"], keyboard is not None))
+            return 200, message
+        if method == "editMessageText":
+            message_id = int(params.get("message_id", 0))
+            with self._lock:
+                message = self.messages.get((chat_id, message_id))
+                if message is None:
+                    return 400, "Bad Request: message to edit not found"
+                if self.flood_interval and now - self._last_edit.get(chat_id, -1e9) < self.flood_interval:
+                    return 429, "Too Many Requests: retry after 1"
+                self._last_edit[chat_id] = now
+                message["text"] = params.get("text", "")
+            self._notify(chat_id, _Event(now, method, message_id, message["text"]))
+            return 200, dict(message, edit_date=int(time.time()))
+        if method == "deleteMessage":
+            message_id = int(params.get("message_id", 0))
+            with self._lock:
+                self.messages.pop((chat_id, message_id), None)
+            self._notify(chat_id, _Event(now, method, message_id))
+            return 200, True
+        return 400, f"Bad Request: method {method} is not faked"
+
+    def _notify(self, chat_id: int, event: _Event):
+        if self.listener is not None:
+            self.listener(chat_id, event)
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                method = self.path.rsplit("/", 1)[-1]
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                # python-telegram-bot posts form fields, with non-string values JSON-encoded
+                status, result = api.call(method, dict(parse_qsl(body)))
+                if status == 200:
+                    payload = {"ok": True, "result": result}
+                else:
+                    with api._lock:
+                        api.errors[f"{method}:{status}"] += 1
+                    payload = {"ok": False, "error_code": status, "description": result}
+                    if status == 429:
+                        payload["parameters"] = {"retry_after": 1}
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+# ------------------- Simulated Chats -------------------
+
+
+@dataclass
+class ChatResult:
+    chat_id: int
+    completed: bool = False
+    error: Optional[str] = None
+    first_message: Optional[float] = None   # /debate -> the bot's first reply
+    first_token: Optional[float] = None     # /debate -> the first streamed edit of the debate message
+    rounds: List[float] = field(default_factory=list)  # input -> next Yes/No keyboard
+    summary: Optional[float] = None         # "No" -> keyboard removed
+    edits: int = 0
+
+
+class SimulatedChat:
+    """One user: sends /debate, taps "Yes" `rounds` times, then "No", timing each step."""
+
+    def __init__(self, chat_id: int, api: FakeBotAPI, feed: Callable, rounds: int, timeout: float):
+        self.chat_id = chat_id
+        self.api = api
+        self.feed = feed
+        self.rounds = rounds
+        self.timeout = timeout
+        self.events: "asyncio.Queue[_Event]" = asyncio.Queue()
+        self.result = ChatResult(chat_id)
+        self._user = {"id": chat_id, "is_bot": False, "first_name": f"Load {chat_id}"}
+        self._started = 0.0
+
+    async def run(self) -> ChatResult:
+        try:
+            start = self._started = time.monotonic()
+            text = f"/debate Residents and developers disagree about land use in district {self.chat_id}"
+            await self.feed({"message": {
+                "message_id": 0, "date": int(time.time()), "from": self._user,
+                "chat": {"id": self.chat_id, "type": "private"}, "text": text,
+                "entities": [{"type": "bot_command", "offset": 0, "length": len("/debate")}],
+            }})
+            keyboard = await self._until_keyboard(start)
+            for _ in range(self.rounds):
+                start = time.monotonic()
+                await self._tap(keyboard, "yes")
+                keyboard = await self._until_keyboard(start)
+            start = time.monotonic()
+            await self._tap(keyboard, "no")
+            await self._next(lambda e: e.method == "deleteMessage" and e.message_id == keyboard["message_id"])
+            self.result.summary = time.monotonic() - start
+            self.result.completed = True
+        except asyncio.TimeoutError:
+            self.result.error = "timeout"
+        return self.result
+
+    async def _tap(self, keyboard: dict, data: str):
+        await self.feed({"callback_query": {
+            "id": f"{self.chat_id}-{keyboard['message_id']}-{data}", "from": self._user,
+            "chat_instance": str(self.chat_id), "data": data, "message": keyboard,
+        }})
+
+    async def _until_keyboard(self, start: float) -> dict:
+        event = await self._next(lambda e: e.keyboard)
+        self.result.rounds.append(event.at - start)
+        return self._api_message(event)
+
+    async def _next(self, predicate) -> _Event:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            event = await asyncio.wait_for(self.events.get(), max(0.0, deadline - time.monotonic()))
+            self._observe(event)
+            if predicate(event):
+                return event
+
+    def _observe(self, event: _Event):
+        if event.method == "sendMessage" and self.result.first_message is None:
+            self.result.first_message = event.at - self._started
+        if event.method == "editMessageText":
+            self.result.edits += 1
+            if self.result.first_token is None:
+                self.result.first_token = event.at - self._started
+
+    def _api_message(self, event: _Event) -> dict:
+        return self.api.messages[(self.chat_id, event.message_id)]
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes a LAG_INTERVAL sleep: time it spent blocked."""
+
+    def __init__(self):
+        self.samples: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            self.samples.append(max(0.0, loop.time() - start - LAG_INTERVAL))
+
+# ------------------- Scenario -------------------
+
+
+async def run_level(app, api: FakeBotAPI, chats: int, rounds: int, timeout: float, first_chat_id: int) -> dict:
+    """Runs `chats` scripted conversations at once through the started Application."""
+    import bot
+    from telegram import Update
+
+    loop = asyncio.get_running_loop()
+    update_ids = itertools.count(first_chat_id * 1000)
+    handler_errors: Counter = Counter()
+    simulated: Dict[int, SimulatedChat] = {}
+
+    async def feed(data: dict):
+        await app.update_queue.put(Update.de_json({"update_id": next(update_ids), **data}, app.bot))
+
+    async def on_error(update, context):
+        handler_errors[type(context.error).__name__] += 1
+        logger.debug(f"Handler error: {context.error!r}")
+
+    def listener(chat_id: int, event: _Event):
+        chat = simulated.get(chat_id)
+        if chat is not None:
+            loop.call_soon_threadsafe(chat.events.put_nowait, event)
+
+    app.add_error_handler(on_error)
+    api.listener = listener
+    for chat_id in range(first_chat_id, first_chat_id + chats):
+        simulated[chat_id] = SimulatedChat(chat_id, api, feed, rounds, timeout)
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    start = time.monotonic()
+    try:
+        results = await asyncio.gather(*(chat.run() for chat in simulated.values()))
+    finally:
+        wall = time.monotonic() - start
+        await monitor.stop()
+        api.listener = None
+        app.remove_error_handler(on_error)
+
+    rounds_flat = [latency for result in results for latency in result.rounds[1:]]
+    edits = sum(result.edits for result in results)
+    return {
+        "chats": chats,
+        "completed": sum(result.completed for result in results),
+        "timeouts": sum(result.error == "timeout" for result in results),
+        "handler_errors": dict(handler_errors),
+        "wall_seconds": round(wall, 3),
+        "time_to_first_message": _stats([r.first_message for r in results]),
+        "time_to_first_token": _stats([r.first_token for r in results]),
+        "first_round": _stats([r.rounds[0] for r in results if r.rounds]),
+        "round_latency": _stats(rounds_flat),
+        "summary_latency": _stats([r.summary for r in results]),
+        "edits": edits,
+        "edits_per_second": round(edits / wall, 2) if wall else None,
+        "loop_lag": dict(_stats(monitor.samples) or {}, max=round(max(monitor.samples, default=0.0), 4)),
+        "sessions_left": len(bot.sessions),
+    }
+
+
+def _stats(values: List[Optional[float]]) -> Optional[dict]:
+    values = [value for value in values if value is not None]
+    return percentiles(values) if values else None
+
+
+async def run_sweep(levels: List[int], rounds: int, timeout: float, server: StubServer, api: FakeBotAPI,
+                    trace_memory: bool, warmup: bool = True) -> List[dict]:
+    import bot
+    import clients
+
+    # Every client the bot creates goes to the stub; Telegram calls go to the fake API
+    clients.configure(openai_base_url=f"{server.url}/v1", exa_base_url=server.url)
+    app = bot.build_application(updater=False, token="0:loadtest", base_url=api.base_url)
+    results = []
+    async with app:
+        await app.start()
+        try:
+            if warmup:
+                # The SDKs are imported and the client pools opened on the first conversation
+                await run_level(app, api, 1, 0, timeout, first_chat_id=1)
+            for index, chats in enumerate(levels):
+                server.reset_counts()
+                api.reset_counts()
+                gc.collect()
+                memory_before = tracemalloc.get_traced_memory()[0] if trace_memory else None
+                result = await run_level(app, api, chats, rounds, timeout, first_chat_id=(index + 1) * 100_000)
+                gc.collect()
+                if trace_memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    result["memory_growth_mb"] = round((current - memory_before) / 2 ** 20, 2)
+                    result["peak_memory_mb"] = round(peak / 2 ** 20, 2)
+                    tracemalloc.reset_peak()
+                result["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+                result["backend_requests"] = server.reset_counts()
+                result["bot_api"] = api.reset_counts()
+                results.append(result)
+                _print_result(result)
+        finally:
+            await app.stop()
+    return results
+
+# ------------------- CLI -------------------
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the bot's handlers with simulated concurrent chats.")
+    parser.add_argument("--chats", type=_int_list, default=[1, 10, 50], help="simultaneous chats (sweep)")
+    parser.add_argument("--rounds", type=int, default=2, help='"Yes" taps per chat before "No"')
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds a chat waits for each bot reply")
+    parser.add_argument("--edit-interval", type=float, default=None, help="override bot.STREAM_EDIT_INTERVAL")
+    parser.add_argument("--concurrent-updates", type=int, default=None,
+                        help="override bot.CONCURRENT_UPDATES (0 = one update at a time)")
+    parser.add_argument("--no-warmup", action="store_true",
+                        help="don't run one untimed conversation first, so the first level includes cold start")
+    parser.add_argument("--flood-interval", type=float, default=None,
+                        help="refuse a chat's edits closer together than this with 429, like Telegram")
+    parser.add_argument("--llm-latency", type=float, default=StubConfig.llm_latency)
+    parser.add_argument("--exa-latency", type=float, default=StubConfig.exa_latency)
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    parser.add_argument("--completion-words", type=int, default=StubConfig.completion_words)
+    parser.add_argument("--token-interval", type=float, default=StubConfig.token_interval)
+    parser.add_argument("--no-trace-memory", action="store_true", help="skip tracemalloc, which slows Python down")
+    parser.add_argument("--output", default="loadtest_results.jsonl")
+    args = parser.parse_args(argv)
+
+    # Before bot/working are imported: quiet logs, and no cached answers between chats
+    logging.basicConfig(level=logging.WARNING)
+    os.environ.setdefault("LLM_CACHE", "off")
+    import bot
+    if args.edit_interval is not None:
+        bot.STREAM_EDIT_INTERVAL = args.edit_interval
+    if args.concurrent_updates is not None:
+        bot.CONCURRENT_UPDATES = args.concurrent_updates or False
+
+    config = StubConfig(llm_latency=args.llm_latency, exa_latency=args.exa_latency, jitter=args.jitter,
+                        error_rate=args.error_rate, completion_words=args.completion_words,
+                        token_interval=args.token_interval)
+    server = StubServer(config).start()
+    api = FakeBotAPI(flood_interval=args.flood_interval).start()
+    trace_memory = not args.no_trace_memory
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):  # the pipeline and handlers print as they go
+            results = asyncio.run(run_sweep(args.chats, args.rounds, args.timeout, server, api, trace_memory,
+                                            warmup=not args.no_warmup))
+    finally:
+        api.stop()
+        server.stop()
+        if trace_memory:
+            tracemalloc.stop()
+
+    settings = {"rounds": args.rounds, "edit_interval": bot.STREAM_EDIT_INTERVAL,
+                "concurrent_updates": bot.CONCURRENT_UPDATES, "warmup": not args.no_warmup,
+                "flood_interval": args.flood_interval, "stub": asdict(config)}
+    with open(args.output, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps({"timestamp": time.time(), **settings, **result}) + "\n")
+    print(f"Wrote {len(results)} load levels to {args.output}")
+    return results
+
+
+def _print_result(result: dict):
+    def p(name):
+        stats = result[name]
+        return "n/a" if stats is None else f"p50 {stats['p50']:.2f}s p95 {stats['p95']:.2f}s"
+
+    lines = [
+        f"[chats={result['chats']}] {result['completed']} completed, {result['timeouts']} timed out, "
+        f"errors {result['handler_errors'] or 0}, bot API errors {result['bot_api']['errors'] or 0}",
+        f"  first message {p('time_to_first_message')} | first token {p('time_to_first_token')}",
+        f"  first round {p('first_round')} | later rounds {p('round_latency')} | summary {p('summary_latency')}",
+        f"  {result['edits']} edits ({result['edits_per_second']}/s) | loop lag p95 "
+        f"{(result['loop_lag'].get('p95') or 0):.3f}s max {result['loop_lag']['max']:.3f}s",
+        f"  memory growth {result.get('memory_growth_mb')} MB, max RSS {result['max_rss_mb']} MB, "
+        f"sessions left {result['sessions_left']}",
+    ]
+    # stdout is redirected while the sweep runs
+    print("\n".join(lines), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
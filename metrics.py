@@ -0,0 +1,222 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import bisect
+import functools
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+# Upper bounds (seconds) of the latency histogram buckets; +Inf is implied
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# ------------------- Registry -------------------
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, object]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Process-wide counters and latency histograms, keyed by metric name and labels.
+    Rendered as Prometheus text by render() or as a JSON-friendly dict by snapshot().
+    """
+
+    def __init__(self):
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = _Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: [{"labels": dict(key), "count": h.count, "sum": round(h.sum, 6)} for key, h in series.items()]
+                for name, series in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def render(self) -> str:
+        """Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                lines.append(f"# TYPE {name} histogram")
+                for key, h in series.items():
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {h.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+def _format_labels(key: LabelKey) -> str:
+    if not key:
+        return ""
+    escaped = (f'{k}="{v}"'.replace("\n", " ") for k, v in key)
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = MetricsRegistry()
+inc = registry.inc
+observe = registry.observe
+
+# ------------------- Spans -------------------
+
+
+@contextmanager
+def span(name: str, **labels):
+    """
+    Times the enclosed block into the `<name>_seconds` histogram and counts failures in
+    `<name>_errors_total`. Works around awaits too, so async stages use it unchanged.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        inc(f"{name}_errors_total", error=type(e).__name__, **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(f"{name}_seconds", elapsed, **labels)
+        logger.debug(f"{name} {labels} took {elapsed:.3f}s")
+
+
+def timed_stage(stage: str):
+    """Decorator: wraps a (sync or async) pipeline stage in span("stage", stage=stage)."""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span("stage", stage=stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span("stage", stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(model: str, stage: str, usage):
+    """Adds a chat response's usage (object or dict, may be None) to the token counters."""
+    if usage is None:
+        return
+    get = usage.get if isinstance(usage, dict) else lambda field: getattr(usage, field, None)
+    prompt_tokens, completion_tokens = get("prompt_tokens"), get("completion_tokens")
+    if prompt_tokens:
+        inc("llm_prompt_tokens_total", prompt_tokens, model=model, stage=stage)
+    if completion_tokens:
+        inc("llm_completion_tokens_total", completion_tokens, model=model, stage=stage)
+
+
+def count_http_response(provider: str, status_code: int):
+    # Imported here: the scheduler, which owns the retry policy, imports this module
+    from scheduler import RETRYABLE_STATUSES
+
+    inc("api_responses_total", provider=provider, status=status_code)
+    if status_code in RETRYABLE_STATUSES or status_code >= 500:
+        inc("api_retryable_responses_total", provider=provider, status=status_code)
+
+# ------------------- Export -------------------
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Serves registry.render() at http://host:port/metrics from a daemon thread."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+def start_periodic_dump(interval: float, path: Optional[str] = None) -> threading.Event:
+    """
+    Every `interval` seconds appends registry.snapshot() as one JSON line to `path`,
+    or logs it if no path is given. Set the returned event to stop.
+    """
+    stop = threading.Event()
+
+    def dump():
+        while not stop.wait(interval):
+            line = json.dumps({"timestamp": time.time(), **registry.snapshot()})
+            if path is None:
+                logger.info(f"metrics {line}")
+            else:
+                with open(path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+
+    threading.Thread(target=dump, daemon=True, name="metrics-dump").start()
+    return stop
@@ -0,0 +1,123 @@
+# ------------------- Imports ---------------------
+
+import logging
+import re
+import zlib
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+NUM_PERM = 128
+SHINGLE_WORDS = 5
+DEFAULT_THRESHOLD = 0.8   # estimated Jaccard similarity of shingle sets above which two texts are one source
+MIN_SHINGLES = 3          # texts shorter than this are only matched by URL
+
+_WORD = re.compile(r"\w+")
+
+# ------------------- MinHash / LSH -------------------
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> np.ndarray:
+    """32-bit hashes of every `size`-word window, so reflowed or re-punctuated copies still match."""
+    words = _WORD.findall((text or "").casefold())
+    if len(words) < size:
+        return np.array([zlib.crc32(" ".join(words).encode("utf-8"))] if words else [], dtype=np.uint64)
+    windows = {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+    return np.fromiter((zlib.crc32(w.encode("utf-8")) for w in windows), dtype=np.uint64, count=len(windows))
+
+
+def _lsh_shape(num_perm: int, threshold: float) -> Tuple[int, int]:
+    """(bands, rows) whose S-curve (1/bands)^(1/rows) sits closest to the threshold."""
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        error = abs((1 / bands) ** (1 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class NearDuplicateIndex:
+    """
+    Streaming near-duplicate detector. add() a text, and get back the key of an earlier text
+    it near-duplicates (estimated Jaccard >= threshold over word shingles), or None if it is new.
+    MinHash signatures use multiply-shift hashing in NumPy; LSH banding keeps each lookup
+    to the few candidates that share a band, so the cost doesn't grow with the index.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = NUM_PERM, seed: int = 1):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)  # odd multipliers
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = _lsh_shape(num_perm, threshold)
+        self._buckets: List[Dict[bytes, List[str]]] = [{} for _ in range(self.bands)]
+        self._signatures: Dict[str, np.ndarray] = {}
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        hashes = shingles(text)
+        if len(hashes) < MIN_SHINGLES:
+            return None
+        with np.errstate(over="ignore"):  # multiply-shift relies on wrapping mod 2**64
+            permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1)
+
+    def add(self, key: str, text: str) -> Optional[str]:
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        bands = [signature[i * self.rows:(i + 1) * self.rows].tobytes() for i in range(self.bands)]
+        candidates = []
+        for band, bucket in zip(bands, self._buckets):
+            for other in bucket.get(band, ()):
+                if other not in candidates:
+                    candidates.append(other)
+        for other in candidates:
+            # Banding only proposes; the signature agreement estimates the actual Jaccard
+            if np.mean(self._signatures[other] == signature) >= self.threshold:
+                return other
+        self._signatures[key] = signature
+        for band, bucket in zip(bands, self._buckets):
+            bucket.setdefault(band, []).append(key)
+        return None
+
+
+def collapse_near_duplicates(entries: List[dict], threshold: float = DEFAULT_THRESHOLD,
+                             normalize: Callable[[str], str] = lambda url: url) -> List[dict]:
+    """
+    Keeps the first of every group of search results that share a normalized URL or
+    near-duplicate texts; the kept entry lists the dropped URLs under "mirrors".
+    Entries without text (e.g. search errors) pass through untouched.
+    """
+    index = NearDuplicateIndex(threshold)
+    kept: List[dict] = []
+    by_url: Dict[str, dict] = {}
+    by_key: Dict[str, dict] = {}
+    for entry in entries:
+        url, text = entry.get("url"), entry.get("text")
+        if not url or not text:
+            kept.append(entry)
+            continue
+        normalized = normalize(url)
+        canonical = by_url.get(normalized)
+        if canonical is None:
+            match = index.add(normalized, text)
+            canonical = by_key.get(match) if match is not None else None
+        if canonical is not None:
+            canonical.setdefault("mirrors", []).append(url)
+            if canonical.get("side") != entry.get("side"):
+                canonical.pop("side", None)  # both sides' searches found it; let classification decide
+            continue
+        entry = dict(entry)
+        kept.append(entry)
+        by_url[normalized] = by_key[normalized] = entry
+    if len(kept) < len(entries):
+        logger.info(f"Collapsed {len(entries) - len(kept)} near-duplicate sources")
+    return kept
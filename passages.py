@@ -0,0 +1,111 @@
+# ------------------- Imports ---------------------
+
+import re
+from typing import List, Optional, Set
+
+import numpy as np
+
+# ------------------- Settings -------------------
+
+# BM25 parameters (the usual defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Lines shorter than this with no sentence punctuation are treated as menu/navigation junk
+MIN_LINE_WORDS = 4
+
+STOPWORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "from", "has", "have",
+    "in", "is", "it", "its", "of", "on", "or", "that", "the", "their", "this", "to",
+    "was", "were", "which", "with", "versus", "vs",
+}
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+# ------------------- Helpers -------------------
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token), good enough for budgeting prompts."""
+    return len(text) // 4 + 1
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def dedupe_lines(text: str, seen: Optional[Set[str]] = None) -> str:
+    """
+    Drops repeated lines and short navigation-style lines.
+    Pass the same `seen` set for several documents to also drop lines they share (site chrome, footers).
+    """
+    seen = set() if seen is None else seen
+    kept = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            continue
+        key = " ".join(stripped.lower().split())
+        if key in seen:
+            continue
+        seen.add(key)
+        if len(stripped.split()) < MIN_LINE_WORDS and not stripped.endswith((".", "!", "?")):
+            continue
+        kept.append(stripped)
+    return "\n".join(kept)
+
+
+def split_sentences(text: str) -> List[str]:
+    return [s.strip() for s in _SENTENCE_SPLIT.split(text) if s and s.strip()]
+
+
+def bm25_scores(sentences: List[str], query: str) -> np.ndarray:
+    """BM25 score of every sentence against the query, treating each sentence as a document."""
+    sentence_tokens = [tokenize(s) for s in sentences]
+    query_tokens = tokenize(query)
+    if not sentences or not query_tokens:
+        return np.zeros(len(sentences))
+
+    vocab = {term: i for i, term in enumerate(dict.fromkeys(query_tokens))}
+    query_weights = np.zeros(len(vocab))
+    np.add.at(query_weights, [vocab[t] for t in query_tokens], 1)
+
+    rows = [row for row, tokens in enumerate(sentence_tokens) for t in tokens if t in vocab]
+    cols = [vocab[t] for tokens in sentence_tokens for t in tokens if t in vocab]
+    tf = np.zeros((len(sentences), len(vocab)))
+    np.add.at(tf, (rows, cols), 1)
+
+    lengths = np.array([len(tokens) for tokens in sentence_tokens], dtype=float)
+    avg_length = lengths.mean() or 1.0
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(sentences) - df + 0.5) / (df + 0.5))
+
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / avg_length)
+    saturated = tf * (BM25_K1 + 1) / (tf + norm[:, None])
+    return saturated @ (idf * query_weights)
+
+
+def select_passages(text: str, query: Optional[str], token_budget: int, seen: Optional[Set[str]] = None) -> str:
+    """
+    Keeps the sentences of `text` that best match `query` while staying within token_budget,
+    in their original order. Without a query the document scores against its own vocabulary,
+    which favours its most central sentences.
+    """
+    cleaned = dedupe_lines(text, seen)
+    if estimate_tokens(cleaned) <= token_budget:
+        return cleaned
+
+    sentences = split_sentences(cleaned)
+    scores = bm25_scores(sentences, query or cleaned)
+    # Stable sort: ties keep document order, so the opening sentences win
+    ranked = np.argsort(-scores, kind="stable")
+
+    chosen, used = [], 0
+    for index in ranked:
+        cost = estimate_tokens(sentences[index])
+        if used + cost > token_budget:
+            continue
+        chosen.append(index)
+        used += cost
+    return " ".join(sentences[i] for i in sorted(chosen))
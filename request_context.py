@@ -0,0 +1,232 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import concurrent.futures
+import itertools
+import logging
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ------------------- Settings -------------------
+
+# Seconds each stage of a request may take. A stage that runs out degrades instead of failing:
+# search keeps what the finished searches found, classify keeps the finished articles, and a
+# debate turn that times out shows the error placeholder. None: the stage only has the request's deadline.
+STAGE_BUDGETS: Dict[str, Optional[float]] = {
+    "extract_conflict": 30.0,
+    "search": 30.0,
+    "classify": 45.0,
+    "debate_turn": 30.0,
+}
+POLL_INTERVAL = 0.1  # how often blocking waits re-check for cancellation
+
+# ------------------- Errors -------------------
+
+
+class Cancelled(Exception):
+    """Raised by a request's work once the request has been cancelled (e.g. by /cancel)."""
+
+
+class DeadlineExceeded(Cancelled):
+    """Raised by a request's work once the request, or the stage it is in, has run out of time."""
+
+# ------------------- Request Context -------------------
+
+
+class RequestContext:
+    """
+    Deadline and cancellation token of one user request, handed down through every stage
+    to the network calls it makes. cancel() may be called from any thread: blocking waits
+    notice within POLL_INTERVAL, streams are closed and awaited calls are abandoned at once.
+    Stages run in child contexts (stage()) with their own, shorter deadline; cancelling a
+    context cancels its children.
+    """
+
+    def __init__(self, timeout: Optional[float] = None, deadline: Optional[float] = None,
+                 budgets: Optional[Dict[str, Optional[float]]] = None, name: str = "request"):
+        """
+        :param timeout: Seconds from now until the deadline
+        :param deadline: time.monotonic() value of the deadline; the earlier one wins if both are given
+        :param budgets: Per-stage seconds, defaulting to STAGE_BUDGETS
+        """
+        if timeout is not None:
+            expires = time.monotonic() + timeout
+            deadline = expires if deadline is None else min(deadline, expires)
+        self.deadline = deadline
+        self.budgets = dict(STAGE_BUDGETS if budgets is None else budgets)
+        self.name = name
+        self.reason: Optional[str] = None
+        self.partial = False  # some stage under this context ran out of time and kept what it had
+        self._parent: Optional["RequestContext"] = None
+        self._cancelled = threading.Event()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._callback_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline (never negative), or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancels the request and everything started under it; later calls do nothing."""
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug(f"Cancel callback of {self.name} failed: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Runs callback (on the cancelling thread) when the context is cancelled, or right away
+        if it already is.
+        :return: A function that unregisters the callback
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                callback_id = next(self._callback_ids)
+                self._callbacks[callback_id] = callback
+                return lambda: self._callbacks.pop(callback_id, None)
+        callback()
+        return lambda: None
+
+    def check(self):
+        """Raises Cancelled or DeadlineExceeded if the work should stop."""
+        self.raise_if_cancelled()
+        if self.expired:
+            raise DeadlineExceeded(f"{self.name} ran out of time")
+
+    def raise_if_cancelled(self):
+        if self._cancelled.is_set():
+            raise Cancelled(f"{self.name} {self.reason}")
+
+    def child(self, timeout: Optional[float] = None, name: Optional[str] = None) -> "RequestContext":
+        """A context that ends at the earlier of this deadline and `timeout` from now, and is cancelled with this one."""
+        child = RequestContext(timeout, self.deadline, self.budgets, name or self.name)
+        child._parent = self
+        self.on_cancel(lambda: child.cancel(self.reason or "cancelled"))
+        return child
+
+    def mark_partial(self):
+        """Records that the work under this context (and so every parent's) returned partial results."""
+        self.partial = True
+        if self._parent is not None:
+            self._parent.mark_partial()
+
+    def stage(self, name: str) -> "RequestContext":
+        """The child context a stage runs in, with that stage's budget."""
+        return self.child(self.budgets.get(name), name)
+
+    def wait(self, seconds: float) -> bool:
+        """Sleeps up to `seconds` (or the deadline); returns True early if the context gets cancelled."""
+        remaining = self.remaining()
+        return self._cancelled.wait(seconds if remaining is None else min(seconds, remaining))
+
+    def wait_for(self, event: threading.Event, deadline: bool = True):
+        """
+        Blocks until `event` is set, raising Cancelled (or, with deadline=True,
+        DeadlineExceeded) if this context ends first.
+        """
+        while not event.wait(self.poll_timeout() if deadline else POLL_INTERVAL):
+            if deadline:
+                self.check()
+            else:
+                self.raise_if_cancelled()
+
+    def call_timeout(self) -> Optional[float]:
+        """Timeout for one network call: the time left, so a stalled provider can't outlive the request."""
+        self.check()
+        return self.remaining()
+
+    async def guard(self, awaitable: Awaitable[T], deadline: bool = True) -> T:
+        """
+        Awaits `awaitable`, abandoning it - and the request it is making - the moment this
+        context is cancelled (or, with deadline=True, runs out of time).
+        """
+        try:
+            if deadline:
+                self.check()
+            else:
+                self.raise_if_cancelled()
+        except Cancelled:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()  # never started; don't leave it to warn about
+            raise
+        task = asyncio.ensure_future(awaitable)
+        loop = asyncio.get_running_loop()
+        remove = self.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await asyncio.wait_for(task, self.remaining() if deadline else None)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(f"{self.name} ran out of time") from None
+        except asyncio.CancelledError:
+            if self.cancelled:
+                raise Cancelled(f"{self.name} {self.reason}") from None
+            raise
+        finally:
+            remove()
+
+    def poll_timeout(self) -> float:
+        remaining = self.remaining()
+        return POLL_INTERVAL if remaining is None else max(0.0, min(POLL_INTERVAL, remaining))
+
+# ------------------- Partial Results -------------------
+
+
+def map_within(ctx: RequestContext, pool: concurrent.futures.Executor, fn: Callable[..., T],
+               items: Iterable) -> List[Optional[T]]:
+    """
+    Like pool.map, but stops waiting when ctx runs out of time or is cancelled. Items whose
+    call hadn't finished by then get None; calls not yet started are dropped.
+    """
+    futures = [pool.submit(fn, item) for item in items]
+    pending = set(futures)
+    while pending and not (ctx.cancelled or ctx.expired):
+        _, pending = concurrent.futures.wait(pending, timeout=ctx.poll_timeout())
+    for future in pending:
+        future.cancel()
+    return [None if future in pending else future.result() for future in futures]
+
+
+async def gather_within(ctx: RequestContext, awaitables: Iterable[Awaitable[T]]) -> List[Optional[T]]:
+    """Async twin of map_within: unfinished awaitables are cancelled (aborting their requests) and give None."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    if not tasks:
+        return []
+    try:
+        await ctx.guard(asyncio.wait(tasks))
+    except DeadlineExceeded:
+        pass
+    except Cancelled:
+        for task in tasks:
+            task.cancel()
+        raise
+    results = []
+    for task in tasks:
+        if task.done() and not task.cancelled():
+            results.append(task.result())
+        else:
+            task.cancel()
+            results.append(None)
+    return results
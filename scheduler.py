@@ -0,0 +1,352 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from urllib.parse import urlsplit
+
+import metrics
+from request_context import DeadlineExceeded, RequestContext
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ------------------- Settings -------------------
+
+# Priority classes: lower runs first when a provider's budget is short
+INTERACTIVE, NORMAL, BACKGROUND = 0, 1, 2
+
+# Which class each call stage belongs to; unknown stages are NORMAL. The running summary
+# has the priority of the debate turn that waits for it: queued behind background work it
+# would miss that turn and leave it with a stale summary.
+STAGE_PRIORITIES = {
+    "debate_turn": INTERACTIVE,
+    "summarize_debate": INTERACTIVE,
+    "running_summary": INTERACTIVE,
+    "extract_conflict": NORMAL,
+    "search": NORMAL,
+    "classify": BACKGROUND,
+    "speculative_turn": BACKGROUND,
+}
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.5       # seconds; attempt n waits up to BACKOFF_BASE * 2**n (full jitter)
+BACKOFF_CAP = 30.0
+RETRYABLE_STATUSES = {408, 409, 429}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError", "ConnectError", "ConnectTimeout",
+                    "ReadTimeout", "ReadError", "RemoteProtocolError", "ConnectionError", "Timeout"}
+ASYNC_POLL = 0.05        # how often an async waiter re-checks its place in line
+
+
+@dataclass
+class RateLimits:
+    requests_per_minute: Optional[float] = None
+    tokens_per_minute: Optional[float] = None
+    # Tighter limits for individual models of the provider
+    models: Dict[str, "RateLimits"] = field(default_factory=dict)
+
+
+# Conservative defaults; raise them to your account's quotas with configure()
+DEFAULT_LIMITS = {
+    "openrouter": RateLimits(requests_per_minute=600, tokens_per_minute=1_000_000),
+    "exa": RateLimits(requests_per_minute=300),
+}
+
+# ------------------- Token Buckets -------------------
+
+
+class TokenBucket:
+    """Refills at per_minute / 60 per second up to a minute's worth. Not locked; the gate holds the lock."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        amount = min(amount, self.capacity)  # an oversized request waits for a full bucket, not forever
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def give_back(self, amount: float):
+        self.level = min(self.capacity, self.level + amount)
+
+
+class _Budget:
+    def __init__(self, limits: RateLimits):
+        self.requests = TokenBucket(limits.requests_per_minute) if limits.requests_per_minute else None
+        self.tokens = TokenBucket(limits.tokens_per_minute) if limits.tokens_per_minute else None
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None and tokens:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens: int):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None and tokens:
+            self.tokens.take(tokens)
+
+
+class _Gate:
+    """One provider's budgets plus its line of waiters, ordered by (priority, arrival)."""
+
+    def __init__(self, limits: RateLimits):
+        self.cond = threading.Condition()
+        self.waiters = []
+        self.blocked_until = 0.0
+        self.budget = _Budget(limits)
+        self.model_budgets = {model: _Budget(model_limits) for model, model_limits in limits.models.items()}
+
+    def _budgets(self, model: Optional[str]):
+        model_budget = self.model_budgets.get(model)
+        return [self.budget] if model_budget is None else [self.budget, model_budget]
+
+    def try_acquire(self, ticket, model: Optional[str], tokens: int) -> Optional[float]:
+        """Call with cond held. Returns 0 when the ticket got through, else seconds to wait (None: not first in line)."""
+        if self.waiters[0] != ticket:
+            return None
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        budgets = self._budgets(model)
+        wait = max(budget.wait_time(tokens, now) for budget in budgets)
+        if wait > 0:
+            return wait
+        for budget in budgets:
+            budget.take(tokens)
+        heapq.heappop(self.waiters)
+        self.cond.notify_all()
+        return 0.0
+
+    def leave(self, ticket):
+        """Call with cond held: drops an abandoned ticket from the line."""
+        if ticket in self.waiters:
+            self.waiters.remove(ticket)
+            heapq.heapify(self.waiters)
+            self.cond.notify_all()
+
+# ------------------- Scheduler -------------------
+
+
+class RequestScheduler:
+    """
+    Every LLM and Exa request goes through here. A request waits for its provider's (and
+    model's) request and token buckets, with interactive work first in line, and failures
+    that are worth retrying (429, 5xx, timeouts, dropped connections) are retried with
+    exponential backoff and full jitter, never sooner than the provider's Retry-After.
+    A 429 also pauses the provider's whole line for that long.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, RateLimits]] = None, max_attempts: int = MAX_ATTEMPTS):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.max_attempts = max_attempts
+        self._gates: Dict[str, _Gate] = {}
+        self._gates_lock = threading.Lock()
+        self._arrivals = itertools.count()
+
+    def _gate(self, provider: str) -> _Gate:
+        with self._gates_lock:
+            gate = self._gates.get(provider)
+            if gate is None:
+                gate = self._gates[provider] = _Gate(self.limits.get(provider, RateLimits()))
+            return gate
+
+    # ---- Admission ----
+
+    def acquire(self, provider: str, model: Optional[str] = None, tokens: int = 0, priority: int = NORMAL,
+                ctx: Optional[RequestContext] = None):
+        gate = self._gate(provider)
+        ticket = (priority, next(self._arrivals))
+        start = time.monotonic()
+        with gate.cond:
+            heapq.heappush(gate.waiters, ticket)
+            try:
+                while True:
+                    wait = gate.try_acquire(ticket, model, tokens)
+                    if wait == 0:
+                        break
+                    timeout = wait if wait is not None else 1.0
+                    if ctx is not None:
+                        # A cancelled or expired request gives up its place in line
+                        ctx.check()
+                        timeout = min(timeout, ctx.poll_timeout())
+                    # Whoever gets through notifies; the timeout covers budgets refilling
+                    gate.cond.wait(timeout=timeout)
+            except BaseException:
+                gate.leave(ticket)
+                raise
+        self._record_wait(provider, priority, start)
+
+    async def acquire_async(self, provider: str, model: Optional[str] = None, tokens: int = 0,
+                            priority: int = NORMAL):
+        gate = self._gate(provider)
+        ticket = (priority, next(self._arrivals))
+        start = time.monotonic()
+        with gate.cond:
+            heapq.heappush(gate.waiters, ticket)
+        try:
+            while True:
+                with gate.cond:
+                    wait = gate.try_acquire(ticket, model, tokens)
+                if wait == 0:
+                    break
+                await asyncio.sleep(ASYNC_POLL if wait is None else min(wait, ASYNC_POLL * 10))
+        except BaseException:
+            with gate.cond:
+                gate.leave(ticket)
+            raise
+        self._record_wait(provider, priority, start)
+
+    def settle(self, provider: str, model: Optional[str], estimated: int, actual: Optional[int]):
+        """Returns the unused part of a token estimate (or charges the overrun) once usage is known."""
+        if actual is None or actual == estimated:
+            return
+        gate = self._gate(provider)
+        with gate.cond:
+            for budget in gate._budgets(model):
+                if budget.tokens is not None:
+                    budget.tokens.give_back(estimated - actual)
+            gate.cond.notify_all()
+
+    def _record_wait(self, provider: str, priority: int, start: float):
+        metrics.observe("scheduler_wait_seconds", time.monotonic() - start, provider=provider, priority=priority)
+
+    # ---- Calls with retries ----
+
+    def call(self, fn: Callable[[], T], provider: str, model: Optional[str] = None,
+             tokens: int = 0, priority: int = NORMAL, ctx: Optional[RequestContext] = None) -> T:
+        """
+        Runs fn() once admitted, retrying retryable failures; the last failure is raised.
+        With ctx, nothing is sent (or retried) once the request is cancelled or out of time.
+        """
+        for attempt in range(self.max_attempts):
+            if ctx is not None:
+                ctx.check()
+            self.acquire(provider, model, tokens, priority, ctx)
+            try:
+                return fn()
+            except Exception as e:
+                if ctx is not None:
+                    ctx.raise_if_cancelled()
+                delay = self._retry_delay(e, attempt, provider)
+                if delay is None:
+                    raise
+                if ctx is not None:
+                    remaining = ctx.remaining()
+                    if remaining is not None and remaining <= delay:
+                        raise DeadlineExceeded(f"{ctx.name} ran out of time") from e
+            if ctx is None:
+                time.sleep(delay)
+            elif ctx.wait(delay):
+                ctx.raise_if_cancelled()
+
+    async def call_async(self, fn: Callable[[], Awaitable[T]], provider: str, model: Optional[str] = None,
+                         tokens: int = 0, priority: int = NORMAL, ctx: Optional[RequestContext] = None) -> T:
+        """
+        Async twin of call; fn() must return a fresh awaitable on every attempt. With ctx, the
+        whole call - queueing, request and retries - is abandoned when it is cancelled or out of time.
+        """
+        if ctx is not None:
+            return await ctx.guard(self.call_async(fn, provider, model, tokens, priority))
+        for attempt in range(self.max_attempts):
+            await self.acquire_async(provider, model, tokens, priority)
+            try:
+                return await fn()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, provider)
+                if delay is None:
+                    raise
+            await asyncio.sleep(delay)
+
+    def _retry_delay(self, error: Exception, attempt: int, provider: str) -> Optional[float]:
+        """Seconds to wait before retrying `error`, or None to give up."""
+        status = status_of(error)
+        retryable = (status in RETRYABLE_STATUSES or (status is not None and status >= 500)
+                     or type(error).__name__ in RETRYABLE_ERRORS)
+        if not retryable or attempt + 1 >= self.max_attempts:
+            return None
+        retry_after = retry_after_of(error)
+        if status == 429 and retry_after:
+            gate = self._gate(provider)
+            with gate.cond:
+                gate.blocked_until = max(gate.blocked_until, time.monotonic() + retry_after)
+        delay = max(retry_after or 0.0, random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+        reason = status if status is not None else type(error).__name__
+        metrics.inc("api_retries_total", provider=provider, reason=reason)
+        logger.warning(f"{provider} request failed ({reason}), retry {attempt + 1} in {delay:.2f}s")
+        return delay
+
+
+def status_of(error: Exception) -> Optional[int]:
+    """HTTP status behind an SDK error: openai's status_code, an httpx/requests response, or Exa's message."""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        response = getattr(error, "response", None)
+        status = getattr(response, "status_code", None)
+    if status is None:
+        match = re.search(r"status code (\d{3})", str(error))
+        status = int(match.group(1)) if match else None
+    return status
+
+
+def retry_after_of(error: Exception) -> Optional[float]:
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        pass  # an HTTP-date Retry-After; fall back to backoff
+    return None
+
+
+def provider_of(client) -> str:
+    """Name of the provider behind an OpenAI-compatible client, from its base URL."""
+    host = urlsplit(str(getattr(client, "base_url", ""))).hostname or "default"
+    return "openrouter" if "openrouter" in host else host
+
+
+def priority_for(stage: str) -> int:
+    return STAGE_PRIORITIES.get(stage, NORMAL)
+
+
+_scheduler: Optional[RequestScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def configure(**settings) -> RequestScheduler:
+    """Replaces the process-wide scheduler, e.g. configure(limits={"openrouter": RateLimits(...)})."""
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = RequestScheduler(**settings)
+        return _scheduler
+
+
+def scheduler() -> RequestScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
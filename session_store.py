@@ -0,0 +1,129 @@
+# ------------------- Imports ---------------------
+
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Session Stores -------------------
+# A chat's debate session (turn counter, rounds, rendered transcript, which message it is
+# edited into, rolling summary) as a JSON-safe dict; see DebateSession.to_state(). The
+# debate turns themselves live in the history store. With a file or SQLite backend shared
+# by all webhook workers, a debate carries on after its worker restarts.
+
+
+class SessionStore:
+    """Base class for session state backends."""
+
+    in_process = False  # True if states live in this process's memory, so nothing else can resume them
+
+    def save(self, chat_id: int, state: dict):
+        """Replaces the chat's stored state."""
+        raise NotImplementedError
+
+    def load(self, chat_id: int) -> Optional[dict]:
+        """
+        :return: The state last saved for chat_id, or None if there is none
+        """
+        raise NotImplementedError
+
+    def delete(self, chat_id: int):
+        raise NotImplementedError
+
+
+class MemorySessionStore(SessionStore):
+    """Keeps states in process memory; the default, lost on restart."""
+
+    in_process = True
+
+    def __init__(self):
+        self._states: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def save(self, chat_id: int, state: dict):
+        # Stored serialized, so the backends behave alike and a caller can't mutate a saved state
+        with self._lock:
+            self._states[chat_id] = json.dumps(state, ensure_ascii=False)
+
+    def load(self, chat_id: int) -> Optional[dict]:
+        with self._lock:
+            data = self._states.get(chat_id)
+        return None if data is None else json.loads(data)
+
+    def delete(self, chat_id: int):
+        with self._lock:
+            self._states.pop(chat_id, None)
+
+
+class FileSessionStore(SessionStore):
+    """One JSON file per chat under base_dir, replaced atomically on every save."""
+
+    def __init__(self, base_dir: str = "debate_sessions"):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def _path(self, chat_id: int) -> str:
+        safe_id = re.sub(r"[^A-Za-z0-9_.-]", "_", str(chat_id))
+        return os.path.join(self.base_dir, f"{safe_id}.json")
+
+    def save(self, chat_id: int, state: dict):
+        path = self._path(chat_id)
+        # Write then rename, so a crash never leaves a half-written state behind
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, chat_id: int) -> Optional[dict]:
+        try:
+            with open(self._path(chat_id), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except json.JSONDecodeError:
+            logger.warning(f"Ignoring unreadable session state of chat {chat_id}")
+            return None
+
+    def delete(self, chat_id: int):
+        try:
+            os.remove(self._path(chat_id))
+        except FileNotFoundError:
+            pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """All chats in one SQLite file; safe to share between worker processes."""
+
+    def __init__(self, path: str = "debate_sessions.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def save(self, chat_id: int, state: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (chat_id, data, updated) VALUES (?, ?, ?)",
+                (chat_id, json.dumps(state, ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def load(self, chat_id: int) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM sessions WHERE chat_id = ?", (chat_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def delete(self, chat_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+            self._conn.commit()
@@ -0,0 +1,184 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from debate_simulation import DebateSimulator
+from session_store import MemorySessionStore, SessionStore
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+DEFAULT_IDLE_TIMEOUT = 30 * 60      # seconds a debate may sit untouched before it is dropped
+DEFAULT_MAX_SESSIONS = 1000
+DEFAULT_MAX_TOTAL_CHARS = 20_000_000  # rough memory cap over all rendered transcripts
+
+# ------------------- Sessions -------------------
+
+
+@dataclass
+class MessageRef:
+    """
+    A sent Telegram message, kept as the ids needed to edit it instead of the live Message
+    object, so a session can be stored and picked up again by another worker process.
+    """
+    chat_id: int
+    message_id: int
+    text: str = ""
+    bot: Any = field(default=None, repr=False, compare=False)
+
+    @classmethod
+    def of(cls, message) -> "MessageRef":
+        return cls(message.chat_id, message.message_id, message.text or "", message.get_bot())
+
+    async def edit_text(self, text: str):
+        await self.bot.edit_message_text(text, chat_id=self.chat_id, message_id=self.message_id)
+        self.text = text
+
+
+@dataclass
+class DebateSession:
+    """Everything one chat's debate needs between Telegram updates."""
+    chat_id: int
+    simulator: DebateSimulator
+    turn: int = 0          # index of the next debate turn to render
+    rounds: int = 0        # how many times the user pressed "Yes"
+    transcript: str = ""   # the zigzag text shown so far
+    message: Optional[MessageRef] = None  # the Telegram message the transcript is edited into
+    last_active: float = field(default_factory=time.monotonic)
+    # Serializes handlers of the same chat, e.g. a double tap on "Yes"
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def approx_size(self) -> int:
+        return len(self.transcript) + 1024
+
+    def to_state(self) -> dict:
+        """JSON-safe snapshot for a SessionStore; the simulator's turns are in its history store."""
+        return {
+            "chat_id": self.chat_id,
+            "turn": self.turn,
+            "rounds": self.rounds,
+            "transcript": self.transcript,
+            "message": None if self.message is None else {
+                "chat_id": self.message.chat_id, "message_id": self.message.message_id, "text": self.message.text
+            },
+            "running_summary": self.simulator.running_summary,
+            "summarized_upto": self.simulator.summarized_upto,
+        }
+
+
+class SessionManager:
+    """
+    Keeps one DebateSession per chat_id.
+    Sessions idle longer than idle_timeout are dropped, and past max_sessions or
+    max_total_chars the least recently used ones are evicted first.
+    Every saved session is also written to `store`, where restore() finds it again after
+    an eviction or a restart; only end() removes it from there, unless the store is
+    in-process, where an evicted session's state is dropped along with it.
+    """
+
+    def __init__(self,
+                 idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+                 max_sessions: int = DEFAULT_MAX_SESSIONS,
+                 max_total_chars: int = DEFAULT_MAX_TOTAL_CHARS,
+                 store: Optional[SessionStore] = None,
+                 on_evict: Optional[Callable[[int], None]] = None):
+        """
+        :param on_evict: Called with the chat_id of every evicted (not ended) session, e.g. to
+            free what an in-process history store holds for it
+        """
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_total_chars = max_total_chars
+        self.store = store if store is not None else MemorySessionStore()
+        self.on_evict = on_evict
+        self._sessions: "OrderedDict[int, DebateSession]" = OrderedDict()
+        self._lock = threading.RLock()
+
+    def start(self, chat_id: int, simulator: DebateSimulator) -> DebateSession:
+        """Creates a fresh session for the chat, replacing any previous debate there."""
+        with self._lock:
+            self._sessions.pop(chat_id, None)
+            session = DebateSession(chat_id=chat_id, simulator=simulator)
+            self._sessions[chat_id] = session
+            self.enforce_limits()
+        self.save(session)
+        return session
+
+    def save(self, session: DebateSession):
+        """Writes the session's current state to the store; call it after every change."""
+        self.store.save(session.chat_id, session.to_state())
+
+    def load_state(self, chat_id: int) -> Optional[dict]:
+        return self.store.load(chat_id)
+
+    def restore(self, state: dict, simulator: DebateSimulator, bot=None) -> DebateSession:
+        """Rebuilds a stored session around its resumed simulator; `bot` edits the stored message."""
+        if state["summarized_upto"] <= len(simulator.history):
+            simulator.running_summary = state["running_summary"]
+            simulator.summarized_upto = state["summarized_upto"]
+        message = state.get("message")
+        session = DebateSession(
+            chat_id=state["chat_id"], simulator=simulator, turn=state["turn"], rounds=state["rounds"],
+            transcript=state["transcript"], message=None if message is None else MessageRef(bot=bot, **message),
+        )
+        with self._lock:
+            self._sessions[session.chat_id] = session
+            self.enforce_limits()
+        return session
+
+    def get(self, chat_id: int) -> Optional[DebateSession]:
+        with self._lock:
+            self.evict_idle()
+            session = self._sessions.get(chat_id)
+            if session is not None:
+                session.touch()
+                self._sessions.move_to_end(chat_id)
+            return session
+
+    def end(self, chat_id: int) -> Optional[DebateSession]:
+        self.store.delete(chat_id)
+        with self._lock:
+            return self._sessions.pop(chat_id, None)
+
+    def evict_idle(self) -> int:
+        now = time.monotonic()
+        with self._lock:
+            expired = [chat_id for chat_id, session in self._sessions.items()
+                       if now - session.last_active > self.idle_timeout]
+            for chat_id in expired:
+                del self._sessions[chat_id]
+                self._evicted(chat_id)
+            if expired:
+                logger.info(f"Evicted {len(expired)} idle debate sessions")
+            return len(expired)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def enforce_limits(self):
+        """Evicts idle, then least recently used sessions until the caps hold again."""
+        with self._lock:
+            self.evict_idle()
+            total = sum(session.approx_size() for session in self._sessions.values())
+            # Oldest first; the most recently used session always survives
+            while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or total > self.max_total_chars):
+                chat_id, session = self._sessions.popitem(last=False)
+                total -= session.approx_size()
+                self._evicted(chat_id)
+                logger.info(f"Evicted debate session of chat {chat_id} to stay under the session limits")
+
+    def _evicted(self, chat_id: int):
+        if self.store.in_process:
+            self.store.delete(chat_id)  # otherwise every abandoned transcript stays in memory
+        if self.on_evict is not None:
+            self.on_evict(chat_id)
@@ -0,0 +1,161 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import copy
+import logging
+import threading
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+import metrics
+from request_context import RequestContext
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# ------------------- Single Flight -------------------
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.flight = _FlightContext()
+
+
+class _FlightContext:
+    """
+    The context a shared computation runs under. Its deadline is the latest of its callers',
+    and it is only cancelled once every caller has been cancelled or stopped waiting, so one
+    chat's /cancel never stops a computation another chat is still waiting for.
+    """
+
+    def __init__(self):
+        self.context = RequestContext(deadline=None)
+        self._bounded = True  # False once a caller without a deadline joins
+        self._callers = 0
+        self._left = 0
+        self._lock = threading.Lock()
+
+    def join(self, ctx: Optional[RequestContext]) -> Callable[[], None]:
+        """Registers a caller; returns the function to call once it stops waiting."""
+        with self._lock:
+            self._callers += 1
+            if ctx is None or ctx.deadline is None:
+                self._bounded = False
+                self.context.deadline = None
+            elif self._bounded:
+                self.context.deadline = max(self.context.deadline or ctx.deadline, ctx.deadline)
+            if ctx is not None:
+                self.context.budgets = ctx.budgets
+        if ctx is None:
+            return lambda: None  # this caller can't give up, so the computation always runs to the end
+        gone = []
+
+        def leave():
+            with self._lock:
+                if gone:
+                    return
+                gone.append(True)
+                self._left += 1
+                everyone = self._left == self._callers
+            if everyone:
+                self.context.cancel("cancelled by every caller")
+
+        remove = ctx.on_cancel(leave)
+
+        def stop_waiting():
+            remove()
+            leave()
+        return stop_waiting
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent work: while a computation for a key is in flight, callers
+    with the same key wait for it instead of starting their own, and each gets a deep copy of
+    the result (or the exception). Nothing is remembered once the computation finishes.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._tasks: Dict[Hashable, tuple] = {}  # key -> (task, _FlightContext)
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[[RequestContext], T], ctx: Optional[RequestContext] = None) -> T:
+        """
+        Blocking version, for callers on worker threads. fn gets the shared computation's
+        context (see _FlightContext); ctx is this caller's deadline and cancellation token.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            leave = call.flight.join(ctx)
+        self._count(leader)
+
+        try:
+            if leader:
+                try:
+                    call.result = fn(call.flight.context)
+                except BaseException as e:
+                    call.error = e
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+            elif ctx is None:
+                call.done.wait()
+            else:
+                # The computation keeps to the callers' deadlines itself, so only cancellation stops the wait
+                ctx.wait_for(call.done, deadline=False)
+        finally:
+            leave()
+        if ctx is not None:
+            ctx.raise_if_cancelled()
+        if call.error is not None:
+            raise call.error
+        # Everyone, the leader included, gets a private copy to mutate
+        return copy.deepcopy(call.result)
+
+    async def do_async(self, key: Hashable, fn: Callable[[RequestContext], Awaitable[T]],
+                       ctx: Optional[RequestContext] = None) -> T:
+        """
+        Awaitable version. The shared computation runs as its own task, so a caller that is
+        cancelled stops waiting without cancelling it for everyone else; only when all of
+        them are cancelled is the computation's context cancelled too.
+        """
+        entry = self._tasks.get(key)
+        leader = entry is None
+        if leader:
+            flight = _FlightContext()
+            leave = flight.join(ctx)
+            task = asyncio.ensure_future(fn(flight.context))
+            entry = self._tasks[key] = (task, flight)
+
+            def forget(done):
+                if self._tasks.get(key) is entry:
+                    del self._tasks[key]
+                if not done.cancelled():
+                    done.exception()  # retrieved even if every caller has stopped waiting
+            task.add_done_callback(forget)
+        else:
+            task, flight = entry
+            leave = flight.join(ctx)
+        self._count(leader)
+        try:
+            shared = asyncio.shield(task)
+            return copy.deepcopy(await (shared if ctx is None else ctx.guard(shared, deadline=False)))
+        finally:
+            leave()
+
+    def in_flight(self) -> int:
+        return len(self._calls) + len(self._tasks)
+
+    def _count(self, leader: bool):
+        metrics.inc("singleflight_calls_total", group=self.name, role="leader" if leader else "follower")
+        if not leader:
+            logger.info(f"Joined an in-flight {self.name} computation")
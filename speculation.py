@@ -0,0 +1,142 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from debate_simulation import DebateSimulator
+from request_context import Cancelled, RequestContext
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Speculative Prefetch -------------------
+
+
+class _Speculation:
+    def __init__(self, cancel_event: threading.Event):
+        self.cancel_event = cancel_event
+        self.future: Optional["asyncio.Future"] = None
+        self.tokens: Optional[int] = None  # set once the worker is done
+
+
+class SpeculativePrefetcher:
+    """
+    Generates a chat's next debate round in the background while the Yes/No keyboard is up.
+    take() serves it on "Yes"; discard() cancels it on "No" or /cancel.
+
+    A discarded round keeps its worker busy until its current model call returns, so the
+    in-flight caps count workers, not pending requests: per_chat_limit per chat and
+    global_limit across the bot.
+    """
+
+    def __init__(self, enabled: bool = False, per_chat_limit: int = 1, global_limit: int = 10):
+        self.enabled = enabled
+        self.per_chat_limit = per_chat_limit
+        self.global_limit = global_limit
+        self._pending: Dict[int, _Speculation] = {}
+        self._inflight_per_chat: Dict[int, int] = {}
+        self._inflight_total = 0
+        self._pool = ThreadPoolExecutor(max_workers=global_limit, thread_name_prefix="speculation")
+        # Metrics
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.used_tokens = 0
+        self.wasted_tokens = 0
+
+    def start(self, chat_id: int, simulator: DebateSimulator) -> bool:
+        """Begins generating the chat's next round, unless disabled or a cap is reached."""
+        if not self.enabled:
+            return False
+        self.discard(chat_id)
+        if (self._inflight_per_chat.get(chat_id, 0) >= self.per_chat_limit
+                or self._inflight_total >= self.global_limit):
+            self.skipped += 1
+            return False
+
+        loop = asyncio.get_running_loop()
+        speculation = _Speculation(threading.Event())
+        worker = self._pool.submit(simulator.speculate_round, speculation.cancel_event)
+        self._inflight_per_chat[chat_id] = self._inflight_per_chat.get(chat_id, 0) + 1
+        self._inflight_total += 1
+        worker.add_done_callback(
+            lambda done: loop.call_soon_threadsafe(self._worker_finished, chat_id, done, speculation)
+        )
+        speculation.future = asyncio.wrap_future(worker, loop=loop)
+        self._pending[chat_id] = speculation
+        self.started += 1
+        return True
+
+    async def take(self, chat_id: int, next_turn: int, ctx: Optional[RequestContext] = None) -> Optional[dict]:
+        """
+        Hands over the chat's speculative round, waiting for it if it is still being generated.
+        :param next_turn: The turn the debate is at now; a round generated from another point is stale
+        :param ctx: The request waiting for the round; if it is cancelled or runs out of time,
+            the round is discarded and Cancelled (or DeadlineExceeded) raised
+        :return: The uncommitted round, or None if there is none (or it failed or is stale)
+        """
+        speculation = self._pending.pop(chat_id, None)
+        if speculation is None:
+            return None
+        ctx = ctx or RequestContext()
+        stop_worker = ctx.on_cancel(speculation.cancel_event.set)
+        try:
+            round_ = await ctx.guard(speculation.future)
+        except Cancelled:
+            self._abandon(chat_id, speculation)
+            raise
+        except Exception as e:
+            logger.error(f"Speculative round for chat {chat_id} failed: {e}")
+            return None
+        finally:
+            stop_worker()
+        if round_["cancelled"] or round_["base_turn"] != next_turn:
+            self.misses += 1
+            self.wasted_tokens += round_["tokens"]
+            return None
+        self.hits += 1
+        self.used_tokens += round_["tokens"]
+        return round_
+
+    def discard(self, chat_id: int):
+        """Cancels the chat's speculative round; its tokens are counted as wasted once it stops."""
+        speculation = self._pending.pop(chat_id, None)
+        if speculation is not None:
+            self._abandon(chat_id, speculation)
+
+    def _abandon(self, chat_id: int, speculation: _Speculation):
+        speculation.cancel_event.set()
+        # Nobody awaits it any more; retrieve the outcome so errors aren't reported as unhandled
+        speculation.future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        if speculation.tokens is not None:
+            # Already finished; otherwise _worker_finished counts it when it stops
+            self.wasted_tokens += speculation.tokens
+        self.misses += 1
+        logger.info(f"Discarded speculative round for chat {chat_id}; {self.stats()}")
+
+    def stats(self) -> dict:
+        resolved = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": round(self.hits / resolved, 3) if resolved else 0.0,
+            "used_tokens": self.used_tokens,
+            "wasted_tokens": self.wasted_tokens,
+            "in_flight": self._inflight_total,
+        }
+
+    def _worker_finished(self, chat_id: int, done, speculation: _Speculation):
+        self._inflight_total -= 1
+        remaining = self._inflight_per_chat.get(chat_id, 1) - 1
+        if remaining > 0:
+            self._inflight_per_chat[chat_id] = remaining
+        else:
+            self._inflight_per_chat.pop(chat_id, None)
+        speculation.tokens = 0 if done.cancelled() or done.exception() is not None else done.result()["tokens"]
+        if speculation.cancel_event.is_set():
+            self.wasted_tokens += speculation.tokens
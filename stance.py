@@ -0,0 +1,239 @@
+# ------------------- Imports ---------------------
+
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+HASH_BITS = 18
+MAX_TEXT_TOKENS = 1500       # longer articles are featurized from their start
+DEFAULT_THRESHOLD = 0.9      # probability a local label needs before the LLM is skipped
+DEFAULT_MODEL_PATH = "stance_model.npz"
+
+# ------------------- Features -------------------
+# Sides change from claim to claim, so the model can't learn "Group A words". It reads the
+# words around each mention of a side instead ("condemn <side>", "<side> was right"): an
+# article's features are the contexts of side A's mentions minus those of side B's. Swapping
+# the sides flips the sign of every feature, so P(A) and P(B) stay consistent, and what is
+# learned carries over to claims with sides it has never seen. An article that mentions
+# neither side scores 0.5 and goes to the LLM.
+
+_TOKEN = re.compile(r"\w+")
+CONTEXT_WINDOW = 3
+DENSE_FEATURES = 3
+
+
+def _tokens(text: str) -> List[str]:
+    return _TOKEN.findall((text or "").casefold())
+
+
+def _hash(feature: str, dim: int) -> int:
+    # crc32 rather than hash(): the same index in every process, so saved models stay valid
+    return zlib.crc32(feature.encode("utf-8")) % dim
+
+
+def _mention_features(tokens: List[str], side_tokens: set, dim: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Hashed, L2-normalized context words of every mention; also returns the mention count."""
+    hashed, mentions = [], 0
+    for position, token in enumerate(tokens):
+        if token not in side_tokens:
+            continue
+        mentions += 1
+        for offset in range(-CONTEXT_WINDOW, CONTEXT_WINDOW + 1):
+            neighbour = position + offset
+            if offset == 0 or not 0 <= neighbour < len(tokens) or tokens[neighbour] in side_tokens:
+                continue
+            word = tokens[neighbour]
+            hashed.append(_hash(f"ctx:{word}", dim))
+            # Direction matters: "<side> attacked" and "attacked <side>" lean opposite ways
+            hashed.append(_hash(f"{'before' if offset < 0 else 'after'}:{word}", dim))
+    indices, counts = np.unique(np.array(hashed, dtype=np.int64), return_counts=True)
+    norm = np.linalg.norm(counts)
+    return indices, (counts / norm if norm else counts.astype(float)), mentions
+
+
+def featurize(text: str, side_a: str, side_b: str, hash_bits: int = HASH_BITS) -> Tuple[np.ndarray, np.ndarray]:
+    """Sparse feature vector as (indices, values); the dense features sit after the hashed ones."""
+    dim = 1 << hash_bits
+    tokens = _tokens(text)[:MAX_TEXT_TOKENS]
+    a_tokens, b_tokens = set(_tokens(side_a)), set(_tokens(side_b))
+    # Words both names share ("party", "the") say nothing about which side is meant
+    a_tokens, b_tokens = a_tokens - b_tokens, b_tokens - a_tokens
+    a_indices, a_values, a_mentions = _mention_features(tokens, a_tokens, dim)
+    b_indices, b_values, b_mentions = _mention_features(tokens, b_tokens, dim)
+
+    total = max(1, len(tokens))
+    dense = np.array([
+        (a_mentions - b_mentions) / total * 100,
+        np.sign(a_mentions - b_mentions),
+        np.log1p(a_mentions) - np.log1p(b_mentions),
+    ])
+
+    indices = np.concatenate([a_indices, b_indices, dim + np.arange(DENSE_FEATURES)])
+    values = np.concatenate([a_values, -b_values, dense])
+    unique, inverse = np.unique(indices, return_inverse=True)
+    return unique, np.bincount(inverse, weights=values)
+
+
+def _sigmoid(score):
+    return 1.0 / (1.0 + np.exp(-np.clip(score, -30, 30)))
+
+# ------------------- Model -------------------
+
+
+class StanceClassifier:
+    """
+    Logistic regression over featurize() vectors, trained with plain NumPy gradient descent.
+    predict() gives P(text leans toward side A); callers label locally only when that
+    probability (or its complement) reaches `threshold`.
+    """
+
+    def __init__(self, hash_bits: int = HASH_BITS, threshold: float = DEFAULT_THRESHOLD,
+                 weights: Optional[np.ndarray] = None):
+        self.hash_bits = hash_bits
+        self.threshold = threshold
+        size = (1 << hash_bits) + DENSE_FEATURES
+        self.weights = weights if weights is not None else np.zeros(size, dtype=np.float32)
+
+    def predict(self, text: str, side_a: str, side_b: str) -> float:
+        indices, values = featurize(text, side_a, side_b, self.hash_bits)
+        return float(_sigmoid(values @ self.weights[indices]))
+
+    def classify(self, text: str, side_a: str, side_b: str) -> Optional[str]:
+        """ "Group A"/"Group B" if the model is confident enough, else None (ask the LLM)."""
+        p = self.predict(text, side_a, side_b)
+        if p >= self.threshold:
+            return "Group A"
+        if 1 - p >= self.threshold:
+            return "Group B"
+        return None
+
+    def fit(self, examples: List[Tuple[str, str, str, int]], epochs: int = 20, learning_rate: float = 0.5,
+            l2: float = 1e-4, batch_size: int = 32, seed: int = 0) -> "StanceClassifier":
+        """examples: (text, side_a, side_b, label) with label 1 for Group A and 0 for Group B."""
+        if not examples:
+            raise ValueError("No training examples")
+        features = [featurize(text, a, b, self.hash_bits) for text, a, b, _ in examples]
+        y = np.array([label for *_, label in examples], dtype=float)
+        rng = np.random.default_rng(seed)
+        w = np.zeros_like(self.weights, dtype=float)
+        for _ in range(epochs):
+            order = rng.permutation(len(y))
+            for start in range(0, len(y), batch_size):
+                batch = order[start:start + batch_size]
+                errors = [_sigmoid(features[i][1] @ w[features[i][0]]) - y[i] for i in batch]
+                w *= 1 - learning_rate * l2
+                for i, error in zip(batch, errors):
+                    indices, values = features[i]
+                    w[indices] -= learning_rate * error * values / len(batch)
+        self.weights = w.astype(np.float32)
+        return self
+
+    def evaluate(self, examples: List[Tuple[str, str, str, int]]) -> dict:
+        """Agreement with the stored (LLM) labels, overall and on the confident share the model would keep."""
+        confident = agree = agree_all = 0
+        for text, a, b, label in examples:
+            p = self.predict(text, a, b)
+            agree_all += int((p >= 0.5) == bool(label))
+            if max(p, 1 - p) >= self.threshold:
+                confident += 1
+                agree += int((p >= 0.5) == bool(label))
+        n = len(examples)
+        return {
+            "examples": n,
+            "agreement": round(agree_all / n, 3) if n else None,
+            "coverage": round(confident / n, 3) if n else None,
+            "confident_agreement": round(agree / confident, 3) if confident else None,
+        }
+
+    def save(self, path: str = DEFAULT_MODEL_PATH):
+        # Only the non-zero weights; a hashed model is mostly empty
+        nonzero = np.flatnonzero(self.weights)
+        np.savez_compressed(path, hash_bits=self.hash_bits, threshold=self.threshold,
+                            indices=nonzero, values=self.weights[nonzero])
+
+    @classmethod
+    def load(cls, path: str = DEFAULT_MODEL_PATH, threshold: Optional[float] = None) -> "StanceClassifier":
+        data = np.load(path)
+        hash_bits = int(data["hash_bits"])
+        weights = np.zeros((1 << hash_bits) + DENSE_FEATURES, dtype=np.float32)
+        weights[data["indices"]] = data["values"]
+        return cls(hash_bits, float(data["threshold"]) if threshold is None else threshold, weights)
+
+# ------------------- Training Data -------------------
+
+
+def _read_run_records(path: str) -> Iterator[dict]:
+    """Yields {"exa_output", "classified_bias_output"} records from a runs/ directory, one run, or a JSONL file."""
+    if os.path.isdir(path):
+        if os.path.exists(os.path.join(path, "classified_bias_output.json")):
+            record = {}
+            for name in ("exa_output", "classified_bias_output"):
+                with open(os.path.join(path, f"{name}.json"), "r", encoding="utf-8") as f:
+                    record[name] = json.load(f)
+            yield record
+        else:
+            for entry in sorted(os.listdir(path)):
+                if os.path.isdir(os.path.join(path, entry)):
+                    yield from _read_run_records(os.path.join(path, entry))
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+def load_examples(paths: List[str]) -> List[Tuple[str, str, str, int]]:
+    """Joins every stored run's article texts with the groups the LLM put their URLs in."""
+    examples = []
+    for path in paths:
+        for record in _read_run_records(path):
+            classified = record.get("classified_bias_output") or {}
+            groups = classified.get("groups") or {}
+            if "Group A" not in groups or "Group B" not in groups:
+                continue
+            side_a, side_b = groups["Group A"]["name"], groups["Group B"]["name"]
+            labels = {url: 1 for url in groups["Group A"]["sources"]}
+            labels.update({url: 0 for url in groups["Group B"]["sources"]})
+            for entry in record.get("exa_output") or []:
+                url, text = entry.get("url"), entry.get("text")
+                if text and url in labels:
+                    examples.append((text, side_a, side_b, labels[url]))
+    return examples
+
+# ------------------- CLI -------------------
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Train the local stance classifier from stored pipeline runs.")
+    parser.add_argument("paths", nargs="+", help="runs/ directories, single run directories or JSONL run records")
+    parser.add_argument("--model", default=DEFAULT_MODEL_PATH)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of examples kept back to measure agreement")
+    parser.add_argument("--epochs", type=int, default=20)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    examples = load_examples(args.paths)
+    random.Random(0).shuffle(examples)
+    split = int(len(examples) * (1 - args.holdout))
+    train, test = examples[:split], examples[split:]
+    model = StanceClassifier(threshold=args.threshold).fit(train, epochs=args.epochs)
+    model.save(args.model)
+    print(json.dumps({"train": len(train), "holdout": model.evaluate(test) if test else None}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
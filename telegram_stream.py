@@ -0,0 +1,120 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import logging
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Settings -------------------
+
+# Telegram allows roughly one edit per second in a chat and ~30 API calls per second overall
+DEFAULT_EDIT_INTERVAL = 1.0
+DEFAULT_GLOBAL_EDITS_PER_SECOND = 25
+
+# ------------------- Rate Limiting -------------------
+
+
+class RateLimiter:
+    """Async token bucket: at most `rate` acquisitions per second, with bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+# Shared by every chat's coalescer, so a burst of streams can't exceed the bot-wide limit
+global_edit_limiter = RateLimiter(DEFAULT_GLOBAL_EDITS_PER_SECOND)
+
+
+def share_global_edit_rate(processes: int):
+    """
+    Gives this process its 1/processes share of the bot-wide edit rate. Telegram's limit is
+    per bot, so with webhook workers each one may only use its part of it.
+    """
+    global_edit_limiter.rate = DEFAULT_GLOBAL_EDITS_PER_SECOND / processes
+    global_edit_limiter.capacity = global_edit_limiter.rate
+    global_edit_limiter.tokens = min(global_edit_limiter.tokens, global_edit_limiter.capacity)
+
+# ------------------- Edit Coalescing -------------------
+
+
+class EditCoalescer:
+    """
+    Mirrors an ever-growing text into one Telegram message.
+    update() is cheap and can be called per token; the latest text is pushed with
+    edit_text at most once per min_interval, and unchanged text is never re-sent.
+    """
+
+    def __init__(self, message, min_interval: float = DEFAULT_EDIT_INTERVAL,
+                 limiter: Optional[RateLimiter] = global_edit_limiter):
+        self.message = message
+        self.min_interval = min_interval
+        self.limiter = limiter
+        self.edits = 0
+        self._latest = ""
+        self._sent = getattr(message, "text", "") or ""
+        self._last_edit = 0.0
+        self._changed = asyncio.Event()
+        self._closed = False
+        self._task = asyncio.create_task(self._run())
+
+    def update(self, text: str):
+        self._latest = text
+        self._changed.set()
+
+    async def close(self):
+        """Sends whatever hasn't been sent yet and stops the background task."""
+        self._closed = True
+        self._changed.set()
+        await self._task
+
+    async def _run(self):
+        while True:
+            await self._changed.wait()
+            self._changed.clear()
+            wait = self._last_edit + self.min_interval - time.monotonic()
+            if wait > 0 and not self._closed:
+                await asyncio.sleep(wait)
+            await self._send(self._latest)
+            # A flood-control retry sets the event again; otherwise the last text is out
+            if self._closed and not self._changed.is_set():
+                return
+
+    async def _send(self, text: str):
+        if not text or text == self._sent:
+            return
+        if self.limiter is not None:
+            await self.limiter.acquire()
+        try:
+            await self.message.edit_text(text)
+            self._sent = text
+            self.edits += 1
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is None:
+                logger.error(f"Failed to edit streamed message: {e}")
+                self._sent = text  # don't retry the same text forever
+            else:
+                # Flood control: back off as told and try again with the newest text
+                delay = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+                logger.warning(f"Telegram asked to slow down edits for {delay}s")
+                await asyncio.sleep(delay)
+                self._changed.set()
+        finally:
+            self._last_edit = time.monotonic()
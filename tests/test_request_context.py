@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from request_context import Cancelled, DeadlineExceeded, RequestContext, gather_within, map_within
+
+WAIT = 5.0
+
+# ------------------- Contexts -------------------
+
+
+def test_child_is_cancelled_with_its_parent_and_marks_it_partial():
+    parent = RequestContext(timeout=60)
+    child = parent.stage("search")
+    assert child.deadline <= parent.deadline
+    child.mark_partial()
+    assert parent.partial
+    parent.cancel("stop")
+    assert child.cancelled and child.reason == "stop"
+    with pytest.raises(Cancelled):
+        child.check()
+
+
+def test_expired_context_raises_deadline_exceeded():
+    ctx = RequestContext(timeout=0)
+    with pytest.raises(DeadlineExceeded):
+        ctx.check()
+
+# ------------------- guard -------------------
+
+
+def test_guard_at_an_expired_deadline_never_starts_the_coroutine():
+    async def main():
+        started = []
+
+        async def work():
+            started.append(True)
+        coro = work()
+        with pytest.raises(DeadlineExceeded):
+            await RequestContext(timeout=0).guard(coro)
+        assert not started
+        assert coro.cr_frame is None  # closed, so it won't warn about never being awaited
+    asyncio.run(main())
+
+
+def test_guard_with_deadline_false_ignores_the_deadline_but_not_cancellation():
+    async def main():
+        ctx = RequestContext(timeout=0)
+        assert await ctx.guard(asyncio.sleep(0, "done"), deadline=False) == "done"
+        ctx.cancel()
+        with pytest.raises(Cancelled):
+            await ctx.guard(asyncio.sleep(0), deadline=False)
+    asyncio.run(main())
+
+
+def test_guard_abandons_the_awaitable_when_the_deadline_passes():
+    async def main():
+        task = asyncio.ensure_future(asyncio.sleep(WAIT))
+        with pytest.raises(DeadlineExceeded):
+            await RequestContext(timeout=0.05).guard(task)
+        assert task.cancelled()
+    asyncio.run(main())
+
+
+def test_guard_cancellation_from_another_thread_reaches_the_task():
+    async def main():
+        ctx = RequestContext()
+        task = asyncio.ensure_future(asyncio.sleep(WAIT))
+        threading.Timer(0.05, ctx.cancel).start()
+        start = time.monotonic()
+        with pytest.raises(Cancelled):
+            await ctx.guard(task)
+        assert time.monotonic() - start < WAIT / 2
+        assert task.cancelled()
+    asyncio.run(main())
+
+# ------------------- gather_within -------------------
+
+
+def test_gather_within_keeps_finished_results_and_cancels_the_rest():
+    async def main():
+        ctx = RequestContext(timeout=0.1)
+        slow = asyncio.ensure_future(asyncio.sleep(WAIT, "slow"))
+        results = await gather_within(ctx, [asyncio.sleep(0, "fast"), slow])
+        assert results == ["fast", None]
+        await asyncio.sleep(0)
+        assert slow.cancelled()
+    asyncio.run(main())
+
+
+def test_gather_within_at_an_expired_deadline_cancels_every_child_task():
+    async def main():
+        children = [asyncio.ensure_future(asyncio.sleep(WAIT)) for _ in range(2)]
+        assert await gather_within(RequestContext(timeout=0), children) == [None, None]
+        await asyncio.sleep(0)
+        assert all(child.cancelled() for child in children)
+    asyncio.run(main())
+
+
+def test_gather_within_cancellation_reaches_every_child_task():
+    async def main():
+        ctx = RequestContext()
+        children = [asyncio.ensure_future(asyncio.sleep(WAIT)) for _ in range(3)]
+        threading.Timer(0.05, ctx.cancel).start()
+        with pytest.raises(Cancelled):
+            await gather_within(ctx, children)
+        await asyncio.sleep(0)
+        assert all(child.cancelled() for child in children)
+    asyncio.run(main())
+
+
+def test_gather_within_returns_everything_in_time():
+    async def main():
+        results = await gather_within(RequestContext(timeout=WAIT), [asyncio.sleep(0, i) for i in range(3)])
+        assert results == [0, 1, 2]
+        assert await gather_within(RequestContext(timeout=0), []) == []
+    asyncio.run(main())
+
+# ------------------- map_within -------------------
+
+
+def test_map_within_gives_none_for_calls_past_the_deadline():
+    release = threading.Event()
+
+    def work(item):
+        if item == "slow":
+            release.wait(WAIT)
+        return item.upper()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        try:
+            results = map_within(RequestContext(timeout=0.1), pool, work, ["fast", "slow"])
+        finally:
+            release.set()
+    assert results == ["FAST", None]
+
+
+def test_map_within_drops_calls_that_never_started():
+    release, calls = threading.Event(), []
+
+    def work(item):
+        calls.append(item)
+        release.wait(WAIT)
+        return item
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        try:
+            results = map_within(RequestContext(timeout=0.1), pool, work, [1, 2, 3])
+        finally:
+            release.set()
+    assert results == [None, None, None]
+    assert calls == [1]
+
+
+def test_map_within_stops_waiting_when_cancelled():
+    ctx, release = RequestContext(), threading.Event()
+    threading.Timer(0.05, ctx.cancel).start()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        start = time.monotonic()
+        try:
+            results = map_within(ctx, pool, lambda item: release.wait(WAIT), [1])
+        finally:
+            release.set()
+    assert results == [None]
+    assert time.monotonic() - start < WAIT / 2
@@ -0,0 +1,224 @@
+import asyncio
+import heapq
+import types
+
+import pytest
+
+import scheduler
+from request_context import DeadlineExceeded, RequestContext
+from scheduler import BACKGROUND, INTERACTIVE, NORMAL, RateLimits, RequestScheduler
+
+
+class FakeClock:
+    """Stands in for time.monotonic and time.sleep: sleeping only moves the clock forward."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(scheduler.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(scheduler.time, "sleep", clock.sleep)
+    monkeypatch.setattr(scheduler.random, "uniform", lambda low, high: high)  # no jitter
+    return clock
+
+
+class StatusError(Exception):
+    """What the SDKs raise for an HTTP error: a status code and the response headers."""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"Error code: {status}")
+        self.status_code = status
+        self.response = types.SimpleNamespace(status_code=status, headers=headers or {})
+
+
+class APITimeoutError(Exception):
+    pass
+
+
+class FakeProvider:
+    """Fails with the queued errors, in order, then answers."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+# ------------------- Retry classification -------------------
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (StatusError(429), True),
+    (StatusError(408), True),
+    (StatusError(409), True),
+    (StatusError(500), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(401), False),
+    (StatusError(404), False),
+    (APITimeoutError(), True),
+    (Exception("upstream returned status code 502"), True),
+    (ValueError("bad json"), False),
+])
+def test_retry_classification(clock, error, retryable):
+    delay = RequestScheduler(limits={})._retry_delay(error, 0, "p")
+    assert (delay is not None) == retryable
+
+
+def test_no_retry_after_the_last_attempt(clock):
+    sched = RequestScheduler(limits={}, max_attempts=3)
+    assert sched._retry_delay(StatusError(503), 1, "p") is not None
+    assert sched._retry_delay(StatusError(503), 2, "p") is None
+
+
+def test_backoff_doubles_and_is_capped(clock):
+    sched = RequestScheduler(limits={}, max_attempts=20)
+    delays = [sched._retry_delay(StatusError(503), attempt, "p") for attempt in range(10)]
+    assert delays[:3] == [scheduler.BACKOFF_BASE, scheduler.BACKOFF_BASE * 2, scheduler.BACKOFF_BASE * 4]
+    assert max(delays) == scheduler.BACKOFF_CAP
+
+
+def test_retry_after_headers():
+    assert scheduler.retry_after_of(StatusError(429, {"retry-after-ms": "1500"})) == 1.5
+    assert scheduler.retry_after_of(StatusError(429, {"retry-after": "3"})) == 3.0
+    assert scheduler.retry_after_of(StatusError(429, {"retry-after": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+
+# ------------------- 429 pause -------------------
+
+
+def test_429_pauses_the_whole_provider_for_retry_after(clock):
+    sched = RequestScheduler(limits={"p": RateLimits()})
+    delay = sched._retry_delay(StatusError(429, {"retry-after": "7"}), 0, "p")
+    assert delay == 7.0
+    gate = sched._gate("p")
+    ticket = (INTERACTIVE, 0)
+    with gate.cond:
+        heapq.heappush(gate.waiters, ticket)
+        assert gate.try_acquire(ticket, None, 0) == pytest.approx(7.0)
+        clock.now += 7.0
+        assert gate.try_acquire(ticket, None, 0) == 0.0
+    # Other providers are not paused
+    sched.acquire("other")
+
+
+def test_call_retries_a_429_no_sooner_than_retry_after(clock):
+    provider = FakeProvider(StatusError(429, {"retry-after": "2"}), StatusError(503))
+    sched = RequestScheduler(limits={"p": RateLimits()})
+    assert sched.call(provider, "p") == "ok"
+    assert provider.calls == 3
+    assert clock.sleeps == [2.0, scheduler.BACKOFF_BASE * 2]
+
+
+def test_call_raises_non_retryable_errors_at_once(clock):
+    provider = FakeProvider(StatusError(400))
+    with pytest.raises(StatusError):
+        RequestScheduler(limits={}).call(provider, "p")
+    assert provider.calls == 1 and clock.sleeps == []
+
+
+def test_call_gives_up_after_max_attempts(clock):
+    provider = FakeProvider(*[StatusError(503) for _ in range(5)])
+    with pytest.raises(StatusError):
+        RequestScheduler(limits={}, max_attempts=3).call(provider, "p")
+    assert provider.calls == 3
+
+
+def test_call_does_not_retry_past_the_deadline(clock):
+    provider = FakeProvider(StatusError(429, {"retry-after": "30"}))
+    ctx = RequestContext(deadline=clock.now + 10)
+    with pytest.raises(DeadlineExceeded):
+        RequestScheduler(limits={}).call(provider, "p", ctx=ctx)
+    assert provider.calls == 1
+
+
+def test_call_async_retries(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+    monkeypatch.setattr(scheduler.asyncio, "sleep", fake_sleep)
+    provider = FakeProvider(APITimeoutError())
+
+    async def fn():
+        return provider()
+    assert asyncio.run(RequestScheduler(limits={}).call_async(fn, "p")) == "ok"
+    assert provider.calls == 2 and slept == [scheduler.BACKOFF_BASE]
+
+# ------------------- Priority ordering -------------------
+
+
+def test_waiters_are_served_by_priority_then_arrival(clock):
+    sched = RequestScheduler(limits={"p": RateLimits(requests_per_minute=60)})
+    gate = sched._gate("p")
+    gate.budget.requests.level = 0  # budget spent: everyone has to line up
+    tickets = [(BACKGROUND, 0), (NORMAL, 1), (INTERACTIVE, 2), (INTERACTIVE, 3)]
+    served = []
+    with gate.cond:
+        for ticket in tickets:
+            heapq.heappush(gate.waiters, ticket)
+        while gate.waiters:
+            clock.now += 1.0  # one request refills per second
+            for ticket in tickets:
+                if ticket not in served and gate.try_acquire(ticket, None, 0) == 0.0:
+                    served.append(ticket)
+                    break
+    assert served == [(INTERACTIVE, 2), (INTERACTIVE, 3), (NORMAL, 1), (BACKGROUND, 0)]
+
+
+def test_only_the_first_in_line_learns_its_wait(clock):
+    sched = RequestScheduler(limits={"p": RateLimits(requests_per_minute=60)})
+    gate = sched._gate("p")
+    gate.budget.requests.level = 0
+    with gate.cond:
+        heapq.heappush(gate.waiters, (BACKGROUND, 0))
+        heapq.heappush(gate.waiters, (INTERACTIVE, 1))
+        assert gate.try_acquire((BACKGROUND, 0), None, 0) is None
+        assert gate.try_acquire((INTERACTIVE, 1), None, 0) == pytest.approx(1.0)
+        gate.leave((INTERACTIVE, 1))
+        assert gate.try_acquire((BACKGROUND, 0), None, 0) == pytest.approx(1.0)
+
+
+def test_stage_priorities():
+    assert scheduler.priority_for("debate_turn") == INTERACTIVE
+    assert scheduler.priority_for("running_summary") == INTERACTIVE
+    assert scheduler.priority_for("speculative_turn") == BACKGROUND
+    assert scheduler.priority_for("unknown stage") == NORMAL
+
+# ------------------- Token settlement -------------------
+
+
+def test_settle_gives_back_unused_tokens_and_charges_overruns(clock):
+    sched = RequestScheduler(limits={"p": RateLimits(tokens_per_minute=1000,
+                                                     models={"m": RateLimits(tokens_per_minute=600)})})
+    sched.acquire("p", "m", tokens=500)
+    gate = sched._gate("p")
+    assert gate.budget.tokens.level == 500 and gate.model_budgets["m"].tokens.level == 100
+    sched.settle("p", "m", estimated=500, actual=100)
+    assert gate.budget.tokens.level == 900 and gate.model_budgets["m"].tokens.level == 500
+    sched.settle("p", "m", estimated=100, actual=400)
+    assert gate.budget.tokens.level == 600 and gate.model_budgets["m"].tokens.level == 200
+    sched.settle("p", "m", estimated=100, actual=None)  # usage unknown: the estimate stands
+    assert gate.budget.tokens.level == 600
+
+
+def test_settle_never_overfills_the_bucket(clock):
+    sched = RequestScheduler(limits={"p": RateLimits(tokens_per_minute=1000)})
+    sched.acquire("p", tokens=100)
+    sched.settle("p", None, estimated=100, actual=0)
+    sched.settle("p", None, estimated=100, actual=0)
+    assert sched._gate("p").budget.tokens.level == 1000
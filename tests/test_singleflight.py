@@ -0,0 +1,192 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from request_context import Cancelled, RequestContext
+from singleflight import SingleFlight
+
+WAIT = 5.0  # generous bound for events the tests wait on
+
+
+def _blocking_fn(started: threading.Event, release: threading.Event, seen: list):
+    """A computation that runs until released or until its flight context is cancelled."""
+    def fn(flight):
+        seen.append(flight)
+        started.set()
+        while not release.wait(0.01):
+            if flight.cancelled:
+                raise Cancelled("flight cancelled")
+        return {"value": 42}
+    return fn
+
+
+def _start(target, *args):
+    result = {}
+
+    def run():
+        try:
+            result["value"] = target(*args)
+        except BaseException as e:
+            result["error"] = e
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread, result
+
+# ------------------- Sync -------------------
+
+
+def test_sync_leader_cancel_without_followers_cancels_the_computation():
+    group, started, release, seen = SingleFlight("test"), threading.Event(), threading.Event(), []
+    ctx = RequestContext()
+    thread, result = _start(group.do, "k", _blocking_fn(started, release, seen), ctx)
+    assert started.wait(WAIT)
+    ctx.cancel()
+    thread.join(WAIT)
+    assert not thread.is_alive()
+    assert isinstance(result["error"], Cancelled)
+    assert seen[0].cancelled
+    assert group.in_flight() == 0
+
+
+def test_sync_leader_cancel_with_a_follower_keeps_the_computation_running():
+    group, started, release, seen = SingleFlight("test"), threading.Event(), threading.Event(), []
+    leader_ctx, follower_ctx = RequestContext(), RequestContext()
+    leader, leader_result = _start(group.do, "k", _blocking_fn(started, release, seen), leader_ctx)
+    assert started.wait(WAIT)
+    follower, follower_result = _start(group.do, "k", lambda flight: pytest.fail("ran twice"), follower_ctx)
+    time.sleep(0.1)  # let the follower join
+    leader_ctx.cancel()
+    time.sleep(0.1)
+    assert not seen[0].cancelled
+    release.set()
+    leader.join(WAIT)
+    follower.join(WAIT)
+    assert isinstance(leader_result["error"], Cancelled)
+    assert follower_result["value"] == {"value": 42}
+
+
+def test_sync_follower_leaving_does_not_stop_the_leader():
+    group, started, release, seen = SingleFlight("test"), threading.Event(), threading.Event(), []
+    follower_ctx = RequestContext()
+    leader, leader_result = _start(group.do, "k", _blocking_fn(started, release, seen), RequestContext())
+    assert started.wait(WAIT)
+    follower, follower_result = _start(group.do, "k", lambda flight: pytest.fail("ran twice"), follower_ctx)
+    time.sleep(0.1)
+    follower_ctx.cancel()
+    follower.join(WAIT)
+    assert not follower.is_alive()
+    assert isinstance(follower_result["error"], Cancelled)
+    assert not seen[0].cancelled
+    release.set()
+    leader.join(WAIT)
+    assert leader_result["value"] == {"value": 42}
+
+
+def test_sync_callers_get_private_copies_and_errors_are_shared():
+    group, started, release, seen = SingleFlight("test"), threading.Event(), threading.Event(), []
+    leader, leader_result = _start(group.do, "k", _blocking_fn(started, release, seen), None)
+    assert started.wait(WAIT)
+    follower, follower_result = _start(group.do, "k", lambda flight: pytest.fail("ran twice"), None)
+    time.sleep(0.1)
+    release.set()
+    leader.join(WAIT)
+    follower.join(WAIT)
+    assert leader_result["value"] == follower_result["value"]
+    assert leader_result["value"] is not follower_result["value"]
+
+    def fail(flight):
+        raise ValueError("boom")
+    with pytest.raises(ValueError):
+        group.do("k", fail)
+
+
+def test_sync_flight_deadline_is_the_latest_callers():
+    group, started, release, seen = SingleFlight("test"), threading.Event(), threading.Event(), []
+    short, long = RequestContext(timeout=10), RequestContext(timeout=60)
+    leader, _ = _start(group.do, "k", _blocking_fn(started, release, seen), short)
+    assert started.wait(WAIT)
+    follower, _ = _start(group.do, "k", lambda flight: None, long)
+    time.sleep(0.1)
+    assert seen[0].deadline == long.deadline
+    release.set()
+    leader.join(WAIT)
+    follower.join(WAIT)
+
+# ------------------- Async -------------------
+
+
+def _async_fn(started: asyncio.Event, release: asyncio.Event, seen: list):
+    async def fn(flight):
+        seen.append(flight)
+        started.set()
+        await release.wait()
+        return {"value": 42}
+    return fn
+
+
+def test_async_leader_cancel_without_followers_cancels_the_computation():
+    async def main():
+        group, started, release, seen = SingleFlight("test"), asyncio.Event(), asyncio.Event(), []
+        ctx = RequestContext()
+        leader = asyncio.ensure_future(group.do_async("k", _async_fn(started, release, seen), ctx))
+        await asyncio.wait_for(started.wait(), WAIT)
+        ctx.cancel()
+        with pytest.raises(Cancelled):
+            await asyncio.wait_for(leader, WAIT)
+        assert seen[0].cancelled
+        release.set()
+    asyncio.run(main())
+
+
+def test_async_leader_cancel_with_a_follower_keeps_the_computation_running():
+    async def main():
+        group, started, release, seen = SingleFlight("test"), asyncio.Event(), asyncio.Event(), []
+        leader_ctx = RequestContext()
+        leader = asyncio.ensure_future(group.do_async("k", _async_fn(started, release, seen), leader_ctx))
+        await asyncio.wait_for(started.wait(), WAIT)
+        follower = asyncio.ensure_future(group.do_async("k", lambda flight: pytest.fail("ran twice"), RequestContext()))
+        await asyncio.sleep(0)
+        leader_ctx.cancel()
+        with pytest.raises(Cancelled):
+            await asyncio.wait_for(leader, WAIT)
+        assert not seen[0].cancelled
+        release.set()
+        assert await asyncio.wait_for(follower, WAIT) == {"value": 42}
+        await asyncio.sleep(0)
+        assert group.in_flight() == 0
+    asyncio.run(main())
+
+
+def test_async_follower_joins_and_leaves_without_stopping_the_leader():
+    async def main():
+        group, started, release, seen = SingleFlight("test"), asyncio.Event(), asyncio.Event(), []
+        leader = asyncio.ensure_future(group.do_async("k", _async_fn(started, release, seen), RequestContext()))
+        await asyncio.wait_for(started.wait(), WAIT)
+        follower_ctx = RequestContext()
+        follower = asyncio.ensure_future(group.do_async("k", lambda flight: pytest.fail("ran twice"), follower_ctx))
+        await asyncio.sleep(0)
+        assert group.in_flight() == 1
+        follower_ctx.cancel()
+        with pytest.raises(Cancelled):
+            await asyncio.wait_for(follower, WAIT)
+        assert not seen[0].cancelled
+        release.set()
+        first = await asyncio.wait_for(leader, WAIT)
+        assert first == {"value": 42}
+    asyncio.run(main())
+
+
+def test_async_callers_without_ctx_share_one_run_and_get_copies():
+    async def main():
+        group, started, release, seen = SingleFlight("test"), asyncio.Event(), asyncio.Event(), []
+        fn = _async_fn(started, release, seen)
+        calls = [asyncio.ensure_future(group.do_async("k", fn)) for _ in range(3)]
+        await asyncio.wait_for(started.wait(), WAIT)
+        release.set()
+        results = await asyncio.gather(*calls)
+        assert len(seen) == 1
+        assert results[0] == results[1] == results[2]
+        assert results[0] is not results[1]
+    asyncio.run(main())
@@ -0,0 +1,199 @@
+# ------------------- Imports ---------------------
+
+import json
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# ------------------- Settings -------------------
+
+DEFAULT_PATH = "topic_index.sqlite3"
+DEFAULT_THRESHOLD = 0.8              # cosine similarity a stored topic needs to be reused
+DEFAULT_TTL_SECONDS = 24 * 3600      # older results are stale: the news has moved on
+NGRAM_RANGE = (3, 5)
+MAX_TEXT_CHARS = 5000                # long articles are indexed by their start
+FIELDS = ("request", "claim")
+
+_WORD = re.compile(r"\w+")
+
+# ------------------- Features -------------------
+# Character n-grams of the casefolded words, so rewordings, typos, plurals and word order
+# changes still land close together. N-grams are hashed with crc32 (the same in every
+# process) and vectors stay sparse: (sorted hashes, weights). A lookup scores every stored
+# topic with one pass of NumPy over all their n-grams.
+
+
+def normalize(text: str) -> str:
+    return " ".join(_WORD.findall((text or "").casefold()))[:MAX_TEXT_CHARS]
+
+
+def char_ngrams(text: str, ngram_range: Tuple[int, int] = NGRAM_RANGE) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted unique n-gram hashes of the normalized text and their sublinear term frequencies."""
+    padded = f" {normalize(text)} "
+    hashes = [
+        zlib.crc32(padded[i:i + n].encode("utf-8"))
+        for n in range(ngram_range[0], ngram_range[1] + 1)
+        for i in range(len(padded) - n + 1)
+    ]
+    indices, counts = np.unique(np.array(hashes, dtype=np.int64), return_counts=True)
+    return indices, 1.0 + np.log(counts)
+
+
+class _Matrix:
+    """
+    TF-IDF rows of one field, L2-normalized and kept as posting lists sorted by n-gram, so a
+    lookup only touches the entries of the n-grams the query has.
+    """
+
+    def __init__(self, rows: List[Tuple[np.ndarray, np.ndarray]]):
+        self.count = len(rows)
+        lengths = np.array([len(indices) for indices, _ in rows], dtype=np.int64)
+        indices = np.concatenate([indices for indices, _ in rows]) if rows else np.zeros(0, dtype=np.int64)
+        tf = np.concatenate([weights for _, weights in rows]) if rows else np.zeros(0)
+        # Each row's hashes are unique, so counting them across rows gives the document frequency
+        _, inverse, df = np.unique(indices, return_inverse=True, return_counts=True)
+        values = tf * self._idf(df)[inverse]
+        row_of = np.repeat(np.arange(self.count), lengths)
+        norms = np.bincount(row_of, weights=values ** 2, minlength=self.count)
+        values /= np.sqrt(norms)[row_of]
+        order = np.argsort(indices, kind="stable")
+        self.indices, self.rows, self.values = indices[order], row_of[order], values[order]
+
+    def _idf(self, df: np.ndarray) -> np.ndarray:
+        return np.log((1 + self.count) / (1 + df)) + 1
+
+    def scores(self, indices: np.ndarray, tf: np.ndarray) -> np.ndarray:
+        """Cosine similarity of the query (char_ngrams output) with every row."""
+        if not self.count or not len(indices):
+            return np.zeros(self.count)
+        starts = np.searchsorted(self.indices, indices, "left")
+        counts = np.searchsorted(self.indices, indices, "right") - starts
+        # N-grams no stored topic has get the highest idf; they only make the query less similar
+        query = tf * self._idf(counts)
+        query /= np.linalg.norm(query)
+        # Positions of every posting of every query n-gram, and the query weight each one meets
+        ends = np.cumsum(counts)
+        postings = np.repeat(starts - (ends - counts), counts) + np.arange(ends[-1])
+        weights = np.repeat(query, counts)
+        return np.bincount(self.rows[postings], weights=self.values[postings] * weights, minlength=self.count)
+
+# ------------------- Topic Index -------------------
+
+
+@dataclass
+class TopicMatch:
+    """A stored pipeline result reused for a new request."""
+    run_id: str
+    field: str               # "request" or "claim": what matched
+    similarity: float
+    created: float           # time.time() when the result was stored
+    conflict: dict
+    classified: dict         # same shape as classified_bias_output.json
+
+
+@dataclass
+class _Topic:
+    id: int
+    run_id: str
+    created: float
+    result: str              # {"conflict": ..., "classified": ...} as JSON, so every match gets its own copy
+    vectors: Dict[str, Tuple[np.ndarray, np.ndarray]]
+
+
+class TopicIndex:
+    """
+    Completed pipeline results, indexed by the request text they were made for and by the
+    extracted claim (idea + sides), kept in SQLite so they outlive the process and are
+    shared by webhook workers. lookup() returns the most similar fresh result above the
+    threshold, or None. Vectors are rebuilt in memory when topics are added or expire.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, threshold: float = DEFAULT_THRESHOLD,
+                 ttl_seconds: Optional[float] = DEFAULT_TTL_SECONDS):
+        """
+        :param path: SQLite file, or ":memory:" for an index private to this process
+        :param ttl_seconds: Results older than this are never reused (None: kept forever)
+        """
+        self.path = path
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS topics (id INTEGER PRIMARY KEY AUTOINCREMENT, run_id TEXT NOT NULL, "
+            "request TEXT NOT NULL, claim TEXT NOT NULL, result TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._topics: List[_Topic] = []
+        self._last_id = 0
+        self._matrices: Dict[str, _Matrix] = {}
+
+    def add(self, run_id: str, request: str, claim: str, conflict: dict, classified: dict):
+        """Stores a finished run; request is the text the user sent, claim the extracted idea and sides."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO topics (run_id, request, claim, result, created) VALUES (?, ?, ?, ?, ?)",
+                (run_id, request, claim, json.dumps({"conflict": conflict, "classified": classified},
+                                                    ensure_ascii=False), time.time()),
+            )
+            self._conn.commit()
+
+    def lookup(self, text: str, field: str = "request") -> Optional[TopicMatch]:
+        """
+        The fresh stored result whose `field` text is most similar to `text`, if that similarity
+        reaches the threshold.
+        """
+        if field not in FIELDS:
+            raise ValueError(f"Unknown topic field {field!r}; expected one of {FIELDS}")
+        indices, tf = char_ngrams(text)
+        with self._lock:
+            self._refresh()
+            matrix = self._matrices.get(field)
+            if matrix is None:
+                matrix = self._matrices[field] = _Matrix([topic.vectors[field] for topic in self._topics])
+            scores = matrix.scores(indices, tf)
+            if not len(scores):
+                return None
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                return None
+            topic = self._topics[best]
+        result = json.loads(topic.result)
+        return TopicMatch(topic.run_id, field, float(scores[best]), topic.created, result["conflict"], result["classified"])
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._topics)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _refresh(self):
+        """Call with the lock held: drops expired topics and loads the ones added since (by any process)."""
+        cutoff = time.time() - self.ttl_seconds if self.ttl_seconds is not None else None
+        changed = False
+        if cutoff is not None and (not self._last_id or (self._topics and self._topics[0].created < cutoff)):
+            self._topics = [topic for topic in self._topics if topic.created >= cutoff]
+            self._conn.execute("DELETE FROM topics WHERE created < ?", (cutoff,))
+            self._conn.commit()
+            changed = True
+        rows = self._conn.execute(
+            "SELECT id, run_id, request, claim, result, created FROM topics WHERE id > ? AND created >= ? ORDER BY id",
+            (self._last_id, cutoff if cutoff is not None else float("-inf")),
+        ).fetchall()
+        for topic_id, run_id, request, claim, result, created in rows:
+            vectors = {"request": char_ngrams(request), "claim": char_ngrams(claim)}
+            self._topics.append(_Topic(topic_id, run_id, created, result, vectors))
+            self._last_id = topic_id
+            changed = True
+        if changed:
+            self._matrices.clear()
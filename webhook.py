@@ -0,0 +1,191 @@
+# ------------------- Imports ---------------------
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, List, Optional
+
+import metrics
+import telegram_stream
+
+logger = logging.getLogger(__name__)
+
+# ------------------- Webhook Mode -------------------
+# Telegram POSTs every update to one front process, which only parses it and hands it to one
+# of `workers` bot processes, picked by chat_id. Each worker runs its own Application, so the
+# debates of different chats are served on different cores, while all updates of one chat go
+# through the same worker's queue in the order they came in. The front restarts workers that
+# die; their queued updates wait for the replacement.
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+SUPERVISE_INTERVAL = 1.0  # seconds between checks that every worker is alive
+
+
+def chat_id_of(update: dict) -> int:
+    """The chat an update belongs to (the sender for chat-less updates such as inline queries), or 0."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = value.get("from") or value.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+    return 0
+
+
+def shard_of(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+# ------------------- Workers -------------------
+
+
+def run_worker(index: int, updates, build_application: Callable, worker_init: Optional[Callable] = None,
+               workers: int = 1):
+    """
+    Process entry point: feeds the updates from the front into a webhook-less Application.
+    The bot-wide edit rate is split evenly between the `workers` processes.
+    """
+    logging.basicConfig(format=f'%(asctime)s - worker {index} - %(levelname)s - %(message)s', level=logging.INFO)
+    telegram_stream.share_global_edit_rate(workers)
+    if worker_init is not None:
+        worker_init(index)
+    asyncio.run(_serve_worker(index, updates, build_application))
+
+
+async def _serve_worker(index: int, updates, build_application: Callable):
+    from telegram import Update
+
+    app = build_application(updater=False)
+    loop = asyncio.get_running_loop()
+    async with app:
+        await app.start()
+        logger.info(f"Worker {index} ready")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates.get)
+                if data is None:
+                    break
+                await app.update_queue.put(Update.de_json(data, app.bot))
+        finally:
+            await app.stop()
+
+# ------------------- Front -------------------
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        front: "WebhookFront" = self.server.front
+        if self.path != front.path:
+            self.send_error(404)
+            return
+        if front.secret_token and self.headers.get(SECRET_HEADER) != front.secret_token:
+            self.send_error(403)
+            return
+        try:
+            update = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except (ValueError, json.JSONDecodeError):
+            self.send_error(400)
+            return
+        front.dispatch(update)
+        # Acknowledge right away; Telegram re-sends updates that aren't answered quickly
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # one line per update would drown the log
+
+
+class WebhookFront:
+    """
+    Receives Telegram's webhook POSTs and shards them over worker processes by chat_id.
+    build_application(updater=False) must be a module-level function: workers are started
+    with the "spawn" method and import it afresh, rather than inheriting this process's threads.
+    """
+
+    def __init__(self, build_application: Callable, workers: int, path: str = "/telegram",
+                 secret_token: Optional[str] = None, worker_init: Optional[Callable] = None):
+        self.build_application = build_application
+        self.workers = workers
+        self.path = path
+        self.secret_token = secret_token
+        self.worker_init = worker_init
+        self._context = multiprocessing.get_context("spawn")
+        self.queues: List = [self._context.Queue() for _ in range(workers)]
+        self.processes: List = [None] * workers
+        self._stopping = threading.Event()
+
+    def dispatch(self, update: dict):
+        shard = shard_of(chat_id_of(update), self.workers)
+        self.queues[shard].put(update)
+        metrics.inc("webhook_updates_total", shard=shard)
+
+    def _start_worker(self, index: int):
+        process = self._context.Process(
+            target=run_worker, name=f"bot-worker-{index}", daemon=True,
+            args=(index, self.queues[index], self.build_application, self.worker_init, self.workers),
+        )
+        process.start()
+        self.processes[index] = process
+
+    def supervise(self):
+        """Blocks, restarting any worker that exits until stop() is called."""
+        while not self._stopping.wait(SUPERVISE_INTERVAL):
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}; restarting it")
+                    metrics.inc("webhook_worker_restarts_total", shard=index)
+                    self._start_worker(index)
+
+    def serve(self, host: str, port: int):
+        for index in range(self.workers):
+            self._start_worker(index)
+        server = ThreadingHTTPServer((host, port), _WebhookHandler)
+        server.daemon_threads = True
+        server.front = self
+        threading.Thread(target=server.serve_forever, name="webhook", daemon=True).start()
+        logger.info(f"Serving the webhook on {host}:{port}{self.path} with {self.workers} workers")
+        try:
+            self.supervise()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+            self.stop()
+
+    def stop(self, timeout: float = 10.0):
+        """Lets every worker finish what is queued, then waits for it to exit."""
+        self._stopping.set()
+        for queue in self.queues:
+            queue.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+                if process.is_alive():
+                    process.terminate()
+
+
+def set_webhook(token: str, url: str, secret_token: Optional[str] = None):
+    """Points Telegram at the front; every update type is forwarded."""
+    from telegram import Bot, Update
+
+    async def register():
+        async with Bot(token) as bot:
+            await bot.set_webhook(url=url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+
+    asyncio.run(register())
+
+
+def serve_webhook(build_application: Callable, token: str, url: str, port: int, workers: int,
+                  host: str = "0.0.0.0", path: str = "/telegram", secret_token: Optional[str] = None,
+                  worker_init: Optional[Callable] = None):
+    """Registers `url` with Telegram and serves it until interrupted."""
+    set_webhook(token, url, secret_token)
+    WebhookFront(build_application, workers, path, secret_token, worker_init).serve(host, port)
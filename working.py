@@ -1,10 +1,27 @@
 # ------------------- Imports ---------------------
 
+import asyncio
 import json
 import logging
-from openai import OpenAI
+import random
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Optional
+from urllib.parse import urlsplit
 from my_secrets import OPENROUTER_API_KEY, OPENROUTER_API_BASE,EXA_API_KEY  # Your API settings
-from exa_py import Exa
+import clients
+import metrics
+import scheduler
+from metrics import timed_stage
+from passages import estimate_tokens, select_passages
+from llm_cache import LLMCache, cached_chat, cached_chat_async, default_cache
+from artifacts import ArtifactSink, RunDirectorySink, new_run_id
+from singleflight import SingleFlight
+from stance import StanceClassifier
+from near_duplicates import DEFAULT_THRESHOLD as NEAR_DUPLICATE_THRESHOLD, collapse_near_duplicates
+from request_context import RequestContext, gather_within, map_within
+from topic_index import TopicIndex
 
 
 # ------------------- Logging Setup -------------------
@@ -15,24 +32,140 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# How many articles are classified in parallel by default (1 = sequential)
+DEFAULT_CLASSIFY_CONCURRENCY = 5
+
+# Batch classification: extra prompt tokens per article slot, answer tokens per label
+BATCH_SLOT_TOKENS = 12
+BATCH_ANSWER_TOKENS = 6
+
+# Two-phase Exa retrieval: per-document character cap, and how many extra hits to
+# search for so that dropping duplicates still leaves max_results URLs
+DEFAULT_DOC_CHAR_BUDGET = 4000
+# Per-document cap on the query-relevant highlights fetched instead of the text (highlights_only)
+DEFAULT_HIGHLIGHT_CHAR_BUDGET = 1000
+SEARCH_OVERFETCH = 2
+
+# Local stance labels: share of them still sent to the LLM to measure agreement
+# (stance_agreement_total). A search tag is only a prior - one side's query can find an
+# article that argues the other side or neither - so when the stance model can't check it
+# (there is none) a larger share is audited; the rest trade some accuracy for LLM calls.
+DEFAULT_STANCE_AUDIT_RATE = 0.05
+DEFAULT_SEARCH_TAG_AUDIT_RATE = 0.25
+
+# Extraction answer fields -> the conflict keys the later stages read
+CONFLICT_FIELDS = {
+    "side_a": "Side A",
+    "side_b": "Side B",
+    "idea": "Idea of the conflict",
+    "search_query_a": "Search query A",
+    "search_query_b": "Search query B",
+}
+
+
+# Identical concurrent runs are computed once: whole runs keyed on the article text, and
+# search + classification keyed on the extracted conflict
+_pipeline_flights = SingleFlight("pipeline")
+_conflict_flights = SingleFlight("search_and_classify")
+
+
+def normalize_text(text: str) -> str:
+    """Casefolded words without punctuation or extra whitespace, so trivially different copies compare equal."""
+    return " ".join(re.findall(r"\w+", (text or "").casefold()))
+
+
+def normalize_url(url: str) -> str:
+    """Lowercased scheme/host without 'www.', fragment or trailing slash, so mirrors of one link compare equal."""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return f"{host}{path}" + (f"?{parts.query}" if parts.query else "")
+
+
+@dataclass
+class PipelineResult:
+    """Everything one run_pipeline call produced, handed from stage to stage in memory."""
+    run_id: str
+    conflict: dict                                      # "Side A" / "Side B" / "Idea of the conflict"
+    search_results: list = field(default_factory=list)  # [{"url": ..., "text": ...}]
+    classified: Optional[dict] = None                   # same shape as classified_bias_output.json
+    reused_from: Optional[str] = None                   # run_id of the earlier run whose results were reused
+
+    @property
+    def idea(self) -> str:
+        return self.conflict.get("Idea of the conflict") or self.conflict.get("Idea of Conflict") or ""
+
+    def artifacts(self) -> dict:
+        return {
+            "conflict_output": self.conflict,
+            "exa_output": self.search_results,
+            "classified_bias_output": self.classified,
+        }
+
 # ------------------- ConflictExtractor Class -------------------
 
 class ConflictExtractor:
-    def __init__(self, json_path: str, model_name: str):
+    def __init__(self, json_path: Optional[str], model_name: str, cache: Optional[LLMCache] = None,
+                 passage_token_budget: Optional[int] = None, article_text: Optional[str] = None,
+                 stance_model: Optional[StanceClassifier] = None,
+                 stance_audit_rate: float = DEFAULT_STANCE_AUDIT_RATE,
+                 search_tag_audit_rate: float = DEFAULT_SEARCH_TAG_AUDIT_RATE,
+                 near_duplicate_threshold: Optional[float] = NEAR_DUPLICATE_THRESHOLD,
+                 topic_index: Optional[TopicIndex] = None):
         self.json_path = json_path
         self.model_name = model_name
-        self.article_text = self._load_article_text()
-        self.exa = Exa(api_key=EXA_API_KEY)
+        # When set, article texts are cut down to their most relevant passages before prompting
+        self.passage_token_budget = passage_token_budget
+        # Responses are looked up here before any chat call goes to the network
+        self.cache = cache if cache is not None else default_cache()
+        # Articles this local model labels confidently (or that one side's search query found,
+        # unless the model leans the other way) skip the LLM; stance_audit_rate of them go to
+        # the LLM anyway so the two can be compared (stance_agreement_total), and
+        # search_tag_audit_rate of the search tags no model could check
+        self.stance_model = stance_model
+        self.stance_audit_rate = stance_audit_rate
+        self.search_tag_audit_rate = search_tag_audit_rate
+        # Mirrors and syndicated copies above this shingle similarity count as one source (None: keep all)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        # Completed runs are stored here; an article or claim similar enough to a fresh one
+        # reuses its conflict and classification instead of searching and classifying again
+        self.topic_index = topic_index
+        # Callers that already hold the text (the bot) pass it directly instead of a JSON file
+        self.article_text = article_text if article_text is not None else self._load_article_text()
+        # Shared, pooled clients; the async ones are looked up per event loop on first use
+        self.exa = clients.registry().exa()
+        self._async_exa = None
 
         try:
-            self.client = OpenAI(
-                base_url=OPENROUTER_API_BASE,
-                api_key=OPENROUTER_API_KEY
-            )
+            self.client = clients.registry().openai(OPENROUTER_API_BASE, OPENROUTER_API_KEY)
+            self._async_client = None
         except Exception as e:
             logger.error(f"Failed to initialize OpenAI client: {str(e)}")
             raise
 
+    @property
+    def async_client(self):
+        """Async twin of self.client, used by the *_async pipeline so the bot's event loop never blocks."""
+        if self._async_client is not None:
+            return self._async_client
+        return clients.registry().async_openai(OPENROUTER_API_BASE, OPENROUTER_API_KEY)
+
+    @async_client.setter
+    def async_client(self, client):
+        self._async_client = client
+
+    @property
+    def async_exa(self):
+        if self._async_exa is not None:
+            return self._async_exa
+        return clients.registry().async_exa()
+
+    @async_exa.setter
+    def async_exa(self, client):
+        self._async_exa = client
+
     def _load_article_text(self) -> str:
         try:
             with open(self.json_path, "r", encoding="utf-8") as file:
@@ -43,86 +176,634 @@ class ConflictExtractor:
             raise
 
     def _build_prompt(self) -> str:
+        article_text = self.article_text
+        if self.passage_token_budget:
+            article_text = select_passages(article_text, None, self.passage_token_budget)
         return f"""
 Given the following text, extract:
 1. The main idea in conflict.
 2. The two sides involved in the conflict, labeling them as 'Side A' and 'Side B'.
+3. For each side, a short web search query that would find articles supporting that side's position.
 
-Output the result in this format:
-Side A: 
-Side B: 
-Idea of the conflict:
+Respond ONLY with a JSON object with exactly these keys:
+{{"side_a": "...", "side_b": "...", "idea": "...", "search_query_a": "...", "search_query_b": "..."}}
 
 Text:
-\"\"\"{self.article_text}\"\"\"
+\"\"\"{article_text}\"\"\"
 """
 
-    def extract_conflict(self) -> dict:
+    @timed_stage("extract_conflict")
+    def extract_conflict(self, ctx: Optional[RequestContext] = None) -> dict:
+        """:param ctx: The request's context; the call gets its "extract_conflict" budget"""
         prompt = self._build_prompt()
 
         try:
-            response = self.client.chat.completions.create(
+            result_text = cached_chat(
+                self.client, self.cache,
                 model=self.model_name,
                 messages=[{"role": "user", "content": prompt}],
-                temperature=0.5
+                temperature=0.5,
+                stage="extract_conflict",
+                ctx=ctx.stage("extract_conflict") if ctx is not None else None
             )
-
-            result_text = response.choices[0].message.content.strip()
+            result_text = (result_text or "").strip()
             if not result_text:
                 raise ValueError("No valid content returned from the model.")
 
             logger.info(f"Raw model output:\n{result_text}")
-            # Manually parse the structured text
-            parsed = {}
-            for line in result_text.splitlines():
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    parsed[key.strip()] = value.strip()
+            return self._parse_conflict_output(result_text)
+
+        except Exception as e:
+            logger.error(f"An error occurred during extraction: {str(e)}")
+            return {"error": str(e)}
 
-            return parsed
+    @timed_stage("extract_conflict")
+    async def extract_conflict_async(self, ctx: Optional[RequestContext] = None) -> dict:
+        """Same as extract_conflict, but awaits the model instead of blocking the caller."""
+        prompt = self._build_prompt()
+
+        try:
+            result_text = await cached_chat_async(
+                self.async_client, self.cache,
+                model=self.model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.5,
+                stage="extract_conflict",
+                ctx=ctx.stage("extract_conflict") if ctx is not None else None
+            )
+            result_text = (result_text or "").strip()
+            if not result_text:
+                raise ValueError("No valid content returned from the model.")
+
+            logger.info(f"Raw model output:\n{result_text}")
+            return self._parse_conflict_output(result_text)
 
         except Exception as e:
             logger.error(f"An error occurred during extraction: {str(e)}")
             return {"error": str(e)}
-        
-    from exa_py import Exa
 
-    def search_conflict_urls(self, idea_of_conflict: str, exa_api_key: str , max_results: int = 5) -> list:
-        # Initialize Exa client with API key
+    def _parse_conflict_output(self, result_text: str) -> dict:
+        """
+        Maps the model's JSON object onto the "Side A" / "Side B" / "Idea of the conflict" keys
+        the later stages read, plus "Search query A" / "Search query B".
+        Falls back to "Key: value" lines for answers (or cached responses) in the old format.
+        """
+        match = re.search(r"\{.*\}", result_text, flags=re.DOTALL)
+        if match:
+            try:
+                data = json.loads(match.group(0))
+            except json.JSONDecodeError:
+                data = None
+            if isinstance(data, dict):
+                parsed = {key: str(data[field]).strip() for field, key in CONFLICT_FIELDS.items() if data.get(field)}
+                if parsed:
+                    return parsed
+
+        # Manually parse the structured text
+        parsed = {}
+        for line in result_text.splitlines():
+            if ':' in line:
+                key, value = line.split(':', 1)
+                parsed[key.strip()] = value.strip()
 
+        return parsed
+
+    @timed_stage("search_conflict_urls")
+    def search_conflict_urls(self, idea_of_conflict: str, exa_api_key: str , max_results: int = 5,
+                             two_phase: bool = False, max_characters: int = DEFAULT_DOC_CHAR_BUDGET,
+                             highlights_only: bool = False, ctx: Optional[RequestContext] = None) -> list:
+        """
+        Searches Exa for articles about the conflict.
+        By default one search_and_contents call downloads the full text of the max_results hits.
+        With two_phase=True the search runs without contents, duplicate URLs are dropped,
+        and only the kept URLs get their contents fetched, capped at max_characters
+        (or just query-relevant highlights when highlights_only=True).
+        With ctx, no request is sent or retried once it is cancelled or out of time.
+        """
         try:
+            if two_phase:
+                with metrics.span("exa_call", op="search"):
+                    hits = self._exa_call(lambda: self.exa.search(idea_of_conflict, num_results=max_results * SEARCH_OVERFETCH, contents=False), ctx)
+                urls = self._select_urls(hits, max_results)
+                if not urls:
+                    return []
+                with metrics.span("exa_call", op="get_contents"):
+                    result = self._exa_call(lambda: self.exa.get_contents(urls, **self._contents_options(idea_of_conflict, max_characters, highlights_only)), ctx)
+                logger.info(f"Fetched trimmed contents for {len(urls)} URLs")
+                return self._collect_fetched_contents(urls, result, max_characters, highlights_only)
+
             # Use Exa's search_and_contents method to search the query and fetch results
-            result = self.exa.search_and_contents(idea_of_conflict, text=True)
+            with metrics.span("exa_call", op="search_and_contents"):
+                result = self._exa_call(lambda: self.exa.search_and_contents(idea_of_conflict, num_results=max_results, text=True), ctx)
             logger.info(f"Raw Exa search results:\n{result}")
-            #json.loads(result)
-
-            # Extract URLs from the 'results' field in the response
-            #urls = []
-            results_list=[]
-            if hasattr(result, 'results'):
-                for item in result.results[:max_results]:
-                    url = getattr(item, 'url', None)
-                    text = getattr(item, 'text', None)
-                    #if url:
-                    #    urls.append({"url": url})
-                    if url and text:
-                        results_list.append({"url": url, "text": text})
-                    elif url:
-                        results_list.append({"url": url, "text": ""})
-            return results_list
+            return self._collect_search_results(result, max_results)
 
         except Exception as e:
             logger.error(f"Exa API call failed: {str(e)}")
             return [{"error": str(e)}]
 
+    @timed_stage("search_conflict_urls")
+    async def search_conflict_urls_async(self, idea_of_conflict: str, exa_api_key: str, max_results: int = 5,
+                                         two_phase: bool = False, max_characters: int = DEFAULT_DOC_CHAR_BUDGET,
+                                         highlights_only: bool = False, ctx: Optional[RequestContext] = None) -> list:
+        """Same as search_conflict_urls, but uses the async Exa client; cancelling ctx aborts the request in flight."""
+        try:
+            if two_phase:
+                with metrics.span("exa_call", op="search"):
+                    hits = await self._exa_call_async(lambda: self.async_exa.search(idea_of_conflict, num_results=max_results * SEARCH_OVERFETCH, contents=False), ctx)
+                urls = self._select_urls(hits, max_results)
+                if not urls:
+                    return []
+                with metrics.span("exa_call", op="get_contents"):
+                    result = await self._exa_call_async(lambda: self.async_exa.get_contents(urls, **self._contents_options(idea_of_conflict, max_characters, highlights_only)), ctx)
+                logger.info(f"Fetched trimmed contents for {len(urls)} URLs")
+                return self._collect_fetched_contents(urls, result, max_characters, highlights_only)
+
+            with metrics.span("exa_call", op="search_and_contents"):
+                result = await self._exa_call_async(lambda: self.async_exa.search_and_contents(idea_of_conflict, num_results=max_results, text=True), ctx)
+            logger.info(f"Raw Exa search results:\n{result}")
+            return self._collect_search_results(result, max_results)
+
+        except Exception as e:
+            logger.error(f"Exa API call failed: {str(e)}")
+            return [{"error": str(e)}]
+
+    def search_sides(self, conflict: dict, max_results: int = 5, ctx: Optional[RequestContext] = None,
+                     **search_options) -> list:
+        """
+        Runs the extracted per-side queries ("Search query A" / "Search query B") as
+        concurrent Exa searches, each for half of max_results, and tags every hit with the
+        group whose query found it. Without both queries it searches the idea, untagged.
+        With ctx, the searches share its "search" budget; a side whose search hasn't
+        finished by then contributes nothing.
+        """
+        ctx = ctx.stage("search") if ctx is not None else None
+        queries = self._side_queries(conflict)
+        if not queries:
+            return self.search_conflict_urls(self._claim_and_sides(conflict)[0], EXA_API_KEY, max_results,
+                                             ctx=ctx, **search_options)
+        per_side = -(-max_results // len(queries))
+
+        def search(query):
+            return self.search_conflict_urls(query[1], EXA_API_KEY, per_side, ctx=ctx, **search_options)
+
+        pool = ThreadPoolExecutor(max_workers=len(queries))
+        try:
+            found = map_within(ctx, pool, search, queries) if ctx is not None else list(pool.map(search, queries))
+        finally:
+            pool.shutdown(wait=False)  # a search past the deadline finishes on its own; nobody waits for it
+        return self._tag_by_side(queries, self._finished_searches(queries, found, ctx))
+
+    async def search_sides_async(self, conflict: dict, max_results: int = 5, ctx: Optional[RequestContext] = None,
+                                 **search_options) -> list:
+        """Same as search_sides, with the per-side searches awaited together (and aborted at the deadline)."""
+        ctx = ctx.stage("search") if ctx is not None else None
+        queries = self._side_queries(conflict)
+        if not queries:
+            return await self.search_conflict_urls_async(self._claim_and_sides(conflict)[0], EXA_API_KEY,
+                                                         max_results, ctx=ctx, **search_options)
+        per_side = -(-max_results // len(queries))
+        searches = [
+            self.search_conflict_urls_async(query, EXA_API_KEY, per_side, ctx=ctx, **search_options)
+            for _, query in queries
+        ]
+        found = await (gather_within(ctx, searches) if ctx is not None else asyncio.gather(*searches))
+        return self._tag_by_side(queries, self._finished_searches(queries, found, ctx))
+
+    def _finished_searches(self, queries: list, found: list, ctx: Optional[RequestContext]) -> list:
+        """Replaces the searches that ran out of time (None) with empty results."""
+        late = [group for (group, _), results in zip(queries, found) if results is None]
+        if late:
+            ctx.mark_partial()
+            metrics.inc("stage_deadline_exceeded_total", stage="search")
+            logger.warning(f"Search ran out of time; going on without the results for {', '.join(late)}")
+        return [results if results is not None else [] for results in found]
+
+    def _side_queries(self, conflict: dict) -> list:
+        queries = [("Group A", conflict.get("Search query A")), ("Group B", conflict.get("Search query B"))]
+        return queries if all(query for _, query in queries) else []
+
+    def _tag_by_side(self, queries: list, found: list) -> list:
+        """
+        Interleaves the sides' results so a cut keeps both represented. A URL both searches
+        found is kept once, untagged, and left for classification to decide.
+        """
+        merged, by_url = [], {}
+        for rank in range(max(map(len, found))):
+            for (group, query), results in zip(queries, found):
+                if rank >= len(results):
+                    continue
+                entry = dict(results[rank])
+                if not entry.get("url"):
+                    merged.append(entry)  # a failed search's error entry
+                    continue
+                key = normalize_url(entry["url"])
+                if key in by_url:
+                    if by_url[key].get("side") != group:
+                        by_url[key].pop("side", None)
+                        by_url[key].pop("query", None)
+                    continue
+                entry.update(side=group, query=query)
+                by_url[key] = entry
+                merged.append(entry)
+        return merged
+
+    def _exa_call(self, fn, ctx: Optional[RequestContext] = None):
+        """Sends an Exa request through the shared scheduler (rate limit, retries, ctx's deadline and cancellation)."""
+        return scheduler.scheduler().call(fn, "exa", priority=scheduler.priority_for("search"), ctx=ctx)
+
+    async def _exa_call_async(self, fn, ctx: Optional[RequestContext] = None):
+        return await scheduler.scheduler().call_async(fn, "exa", priority=scheduler.priority_for("search"), ctx=ctx)
+
+    def _collect_search_results(self, result, max_results: int) -> list:
+        # Extract URLs from the 'results' field in the response
+        results_list=[]
+        if hasattr(result, 'results'):
+            for item in result.results[:max_results]:
+                url = getattr(item, 'url', None)
+                text = getattr(item, 'text', None)
+                if url and text:
+                    results_list.append({"url": url, "text": text})
+                elif url:
+                    results_list.append({"url": url, "text": ""})
+        return results_list
+
+    def _select_urls(self, hits, max_results: int) -> list:
+        # Keep the first max_results distinct URLs, in search-rank order
+        urls, seen = [], set()
+        for item in getattr(hits, 'results', []):
+            url = getattr(item, 'url', None)
+            if not url:
+                continue
+            key = normalize_url(url)
+            if key in seen:
+                continue
+            seen.add(key)
+            urls.append(url)
+            if len(urls) == max_results:
+                break
+        return urls
+
+    def _contents_options(self, idea_of_conflict: str, max_characters: int, highlights_only: bool) -> dict:
+        if highlights_only:
+            # text=False explicitly: without it exa_py asks for the full text as well
+            return {"text": False, "highlights": {"query": idea_of_conflict,
+                                                  "max_characters": min(max_characters, DEFAULT_HIGHLIGHT_CHAR_BUDGET)}}
+        return {"text": {"max_characters": max_characters}}
+
+    def _collect_fetched_contents(self, urls: list, result, max_characters: int, highlights_only: bool = False) -> list:
+        # get_contents may skip or reorder URLs, so map back onto the kept list
+        fetched = {}
+        for item in getattr(result, 'results', []):
+            if highlights_only:
+                text = " ... ".join(getattr(item, 'highlights', None) or [])
+            else:
+                text = getattr(item, 'text', None)
+            fetched[getattr(item, 'url', None)] = (text or "")[:max_characters]
+        return [{"url": url, "text": fetched.get(url, "")} for url in urls]
+
 
     def classify_bias_and_aggregate(self,
         urls_text_json_path: str,
         sides_json_path: str,
         model_client,  # This should be your OpenAI client (extractor.client)
         model_name: str,
-        output_path: str = "classified_bias_output.json"
+        output_path: str = "classified_bias_output.json",
+        max_concurrency: int = DEFAULT_CLASSIFY_CONCURRENCY,
+        batch_token_budget: Optional[int] = None
     ):
+        """
+        Classifies every fetched article as leaning toward Group A or Group B.
+        Up to max_concurrency requests run at once (1 = one after another);
+        sources are still listed in the order of the search results.
+        With batch_token_budget set, several articles share one request whose
+        prompt stays under that many (estimated) tokens.
+        """
+        url_entries, sides_data = self._load_classification_inputs(
+            urls_text_json_path, sides_json_path
+        )
+        output = self._classify_entries(
+            url_entries, sides_data, model_client, model_name,
+            max_concurrency, batch_token_budget
+        )
+        self._save_classified(output, output_path)
+        return output
+
+    @timed_stage("classify")
+    def _classify_entries(self, url_entries: list, sides_data: dict, model_client, model_name: str,
+                          max_concurrency: int = DEFAULT_CLASSIFY_CONCURRENCY,
+                          batch_token_budget: Optional[int] = None, ctx: Optional[RequestContext] = None):
+        """
+        With ctx, classification gets its "classify" budget; articles whose call hasn't
+        finished by then are left out of the groups instead of holding up the debate.
+        """
+        ctx = ctx.stage("classify") if ctx is not None else None
+        claim, side_a, side_b = self._claim_and_sides(sides_data)
+        groups = self._empty_groups(side_a, side_b)
+        entries = self._bias_entries(url_entries, claim, side_a, side_b)
+        local, remote = self._local_stances(entries, side_a, side_b, self._search_tags(url_entries))
+        batches = self._plan_batches(claim, side_a, side_b, [entries[i] for i in remote], batch_token_budget)
+
+        def classify(batch):
+            if ctx is not None and (ctx.cancelled or ctx.expired):
+                return None
+            return self._classify_batch(model_client, model_name, claim, side_a, side_b, batch, ctx)
+
+    # For each batch of URL/texts, classify bias using the model
+        if max_concurrency > 1 and len(batches) > 1:
+            pool = ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches)))
+            try:
+                batch_answers = map_within(ctx, pool, classify, batches) if ctx is not None else list(pool.map(classify, batches))
+            finally:
+                pool.shutdown(wait=False)  # calls past the deadline time out on their own
+        else:
+            batch_answers = [classify(batch) for batch in batches]
+
+        # pool.map keeps input order, so the groups are filled deterministically
+        batch_answers = self._finished_batches(batches, batch_answers, ctx)
+        answers = self._merge_stances(len(entries), local, remote, batch_answers)
+        for (url, _), answer in zip(entries, answers):
+            if answer is not None:
+                self._add_to_group(groups, url, answer)
+
+        return self._build_classified(claim, groups)
+
+    async def classify_bias_and_aggregate_async(self,
+        urls_text_json_path: str,
+        sides_json_path: str,
+        model_client,  # This should be your AsyncOpenAI client (extractor.async_client)
+        model_name: str,
+        output_path: str = "classified_bias_output.json",
+        max_concurrency: int = DEFAULT_CLASSIFY_CONCURRENCY,
+        batch_token_budget: Optional[int] = None
+    ):
+        """Same as classify_bias_and_aggregate, but awaits the classification calls."""
+        url_entries, sides_data = self._load_classification_inputs(
+            urls_text_json_path, sides_json_path
+        )
+        output = await self._classify_entries_async(
+            url_entries, sides_data, model_client, model_name,
+            max_concurrency, batch_token_budget
+        )
+        self._save_classified(output, output_path)
+        return output
+
+    @timed_stage("classify")
+    async def _classify_entries_async(self, url_entries: list, sides_data: dict, model_client, model_name: str,
+                                      max_concurrency: int = DEFAULT_CLASSIFY_CONCURRENCY,
+                                      batch_token_budget: Optional[int] = None, ctx: Optional[RequestContext] = None):
+        # Works on in-memory stage results, so concurrent runs can't read each other's files
+        ctx = ctx.stage("classify") if ctx is not None else None
+        claim, side_a, side_b = self._claim_and_sides(sides_data)
+        groups = self._empty_groups(side_a, side_b)
+        entries = self._bias_entries(url_entries, claim, side_a, side_b)
+        local, remote = self._local_stances(entries, side_a, side_b, self._search_tags(url_entries))
+        batches = self._plan_batches(claim, side_a, side_b, [entries[i] for i in remote], batch_token_budget)
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def classify(batch):
+            async with semaphore:
+                return await self._classify_batch_async(model_client, model_name, claim, side_a, side_b, batch, ctx)
+
+        # gather returns answers in batch order, whatever order the calls finish in; past the
+        # deadline, the unfinished calls are aborted and their articles left out
+        calls = [classify(batch) for batch in batches]
+        batch_answers = await (gather_within(ctx, calls) if ctx is not None else asyncio.gather(*calls))
+        batch_answers = self._finished_batches(batches, batch_answers, ctx)
+        answers = self._merge_stances(len(entries), local, remote, batch_answers)
+        for (url, _), answer in zip(entries, answers):
+            if answer is not None:
+                self._add_to_group(groups, url, answer)
+
+        return self._build_classified(claim, groups)
+
+    def _finished_batches(self, batches: list, batch_answers: list, ctx: Optional[RequestContext]) -> list:
+        """Gives the batches that ran out of time (None) an unknown label per article."""
+        late = sum(len(batch) for batch, answers in zip(batches, batch_answers) if answers is None)
+        if late:
+            ctx.mark_partial()
+            metrics.inc("stage_deadline_exceeded_total", stage="classify")
+            logger.warning(f"Classification ran out of time; leaving out {late} of the articles")
+        return [answers if answers is not None else [None] * len(batch) for batch, answers in zip(batches, batch_answers)]
+
+    def _bias_entries(self, url_entries: list, claim: str, side_a: str, side_b: str) -> list:
+        query = f"{claim} {side_a} {side_b}"
+        seen_lines = set()  # shared across articles, so site chrome repeated on every page is dropped
+        entries = []
+        for entry in url_entries:
+            url = entry.get("url", "")
+            text = entry.get("text", "")
+
+            if not text.strip():
+                continue  # skip empty texts
+
+            if self.passage_token_budget:
+                text = select_passages(text, query, self.passage_token_budget, seen_lines)
+            entries.append((url, text))
+        return entries
+
+    def _search_tags(self, url_entries: list) -> dict:
+        """{url: group} for results only one side's search query found (see search_sides)."""
+        return {entry["url"]: entry["side"] for entry in url_entries if entry.get("url") and entry.get("side")}
+
+    def _local_stances(self, entries: list, side_a: str, side_b: str, search_tags: Optional[dict] = None):
+        """
+        Labels the entries that don't need the LLM: those a single side's search found, if the
+        stance model (when there is one) leans the same way, then those the model is confident
+        about. A tag the model leans against goes to the LLM.
+        :return: ({entry index: (label, "search" or "model")}, indices of the entries the LLM still has to classify)
+        """
+        search_tags = search_tags or {}
+        if self.stance_model is None and not search_tags:
+            return {}, list(range(len(entries)))
+        local, remote, rejected = {}, [], 0
+        for i, (url, text) in enumerate(entries):
+            audit_rate = self.stance_audit_rate
+            if url in search_tags:
+                tag = search_tags[url]
+                if self.stance_model is None:
+                    local[i] = (tag, "search")
+                    audit_rate = self.search_tag_audit_rate
+                elif (self.stance_model.predict(text, side_a, side_b) >= 0.5) == (tag == "Group A"):
+                    local[i] = (tag, "search")
+                else:
+                    rejected += 1
+            elif self.stance_model is not None:
+                label = self.stance_model.classify(text, side_a, side_b)
+                if label is not None:
+                    local[i] = (label, "model")
+            if i not in local:
+                remote.append(i)
+            elif random.random() < audit_rate:
+                remote.append(i)
+        tagged = sum(1 for _, source in local.values() if source == "search")
+        metrics.inc("search_tag_labels_total", tagged)
+        metrics.inc("search_tag_rejected_total", rejected)
+        metrics.inc("stance_local_labels_total", len(local) - tagged)
+        metrics.inc("stance_llm_labels_total", len(remote))
+        logger.info(f"Labeled {len(local)} of {len(entries)} articles without the LLM ({tagged} by search query, "
+                    f"{rejected} search tags overruled by the stance model)")
+        return local, remote
+
+    def _merge_stances(self, count: int, local: dict, remote: list, batch_answers: list) -> list:
+        """
+        One answer per entry: the LLM's where it was asked and answered (audited ones included),
+        else the local label, so a failed or late audit keeps the article's local label.
+        """
+        answers = [local[i][0] if i in local else None for i in range(count)]
+        llm_answers = [answer for chunk in batch_answers for answer in chunk]
+        for i, answer in zip(remote, llm_answers):
+            if answer is None:
+                continue
+            if i in local:
+                label, source = local[i]
+                agree = ("A" in answer) == (label == "Group A")
+                metrics.inc("stance_agreement_total", result="agree" if agree else "disagree", source=source)
+            answers[i] = answer
+        return answers
+
+    def _plan_batches(self, claim: str, side_a: str, side_b: str, entries: list, token_budget: Optional[int]) -> list:
+        """
+        Greedily packs consecutive (url, text) entries into batches whose batch prompt
+        stays within token_budget. Without a budget every article gets its own request.
+        """
+        if not token_budget:
+            return [[entry] for entry in entries]
+
+        overhead = estimate_tokens(self._build_batch_bias_prompt(claim, side_a, side_b, []))
+        batches, current, used = [], [], overhead
+        for entry in entries:
+            cost = estimate_tokens(entry[1]) + BATCH_SLOT_TOKENS
+            if current and used + cost > token_budget:
+                batches.append(current)
+                current, used = [], overhead
+            current.append(entry)
+            used += cost
+        if current:
+            batches.append(current)
+        return batches
+
+    def _classify_batch(self, model_client, model_name: str, claim: str, side_a: str, side_b: str, batch: list,
+                        ctx: Optional[RequestContext] = None) -> list:
+        if len(batch) == 1:
+            url, text = batch[0]
+            return [self._classify_one(model_client, model_name, url, self._build_bias_prompt(claim, side_a, side_b, text), ctx)]
+
+        prompt = self._build_batch_bias_prompt(claim, side_a, side_b, [text for _, text in batch])
+        try:
+            answer = cached_chat(
+                model_client, self.cache,
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=BATCH_ANSWER_TOKENS * len(batch) + 10,
+                stage="classify",
+                ctx=ctx
+            )
+            answers = self._parse_batch_answer(answer, len(batch))
+        except Exception as e:
+            logging.error(f"Error classifying batch of {len(batch)} articles: {e}")
+            answers = None
+
+        if answers is not None:
+            return answers
+
+        if ctx is not None and (ctx.cancelled or ctx.expired):
+            return [None] * len(batch)
+        logging.warning(f"Batch classification failed, falling back to {len(batch)} single calls")
+        return [
+            self._classify_one(model_client, model_name, url, self._build_bias_prompt(claim, side_a, side_b, text), ctx)
+            for url, text in batch
+        ]
+
+    async def _classify_batch_async(self, model_client, model_name: str, claim: str, side_a: str, side_b: str, batch: list,
+                                    ctx: Optional[RequestContext] = None) -> list:
+        if len(batch) == 1:
+            url, text = batch[0]
+            return [await self._classify_one_async(model_client, model_name, url, self._build_bias_prompt(claim, side_a, side_b, text), ctx)]
+
+        prompt = self._build_batch_bias_prompt(claim, side_a, side_b, [text for _, text in batch])
+        try:
+            answer = await cached_chat_async(
+                model_client, self.cache,
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=BATCH_ANSWER_TOKENS * len(batch) + 10,
+                stage="classify",
+                ctx=ctx
+            )
+            answers = self._parse_batch_answer(answer, len(batch))
+        except Exception as e:
+            logging.error(f"Error classifying batch of {len(batch)} articles: {e}")
+            answers = None
+
+        if answers is not None:
+            return answers
+
+        if ctx is not None and (ctx.cancelled or ctx.expired):
+            return [None] * len(batch)
+        logging.warning(f"Batch classification failed, falling back to {len(batch)} single calls")
+        return [
+            await self._classify_one_async(model_client, model_name, url, self._build_bias_prompt(claim, side_a, side_b, text), ctx)
+            for url, text in batch
+        ]
+
+    def _parse_batch_answer(self, answer: str, expected: int) -> Optional[list]:
+        # The answer must be a JSON array with exactly one string per article slot
+        if not answer:
+            return None
+        start, end = answer.find("["), answer.rfind("]")
+        if start == -1 or end <= start:
+            return None
+        try:
+            labels = json.loads(answer[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(labels, list) or len(labels) != expected:
+            return None
+        if not all(isinstance(label, str) for label in labels):
+            return None
+        return [label.strip() for label in labels]
+
+    def _classify_one(self, model_client, model_name: str, url: str, prompt: str, ctx: Optional[RequestContext] = None):
+        # Failures are logged and return None, so one bad URL never sinks the others
+        try:
+            answer = cached_chat(
+                model_client, self.cache,
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=10,
+                stage="classify",
+                ctx=ctx
+            )
+            return answer.strip()
+
+        except Exception as e:
+            logging.error(f"Error classifying bias for {url}: {e}")
+            return None
+
+    async def _classify_one_async(self, model_client, model_name: str, url: str, prompt: str,
+                                  ctx: Optional[RequestContext] = None):
+        try:
+            answer = await cached_chat_async(
+                model_client, self.cache,
+                model=model_name,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.0,
+                max_tokens=10,
+                stage="classify",
+                ctx=ctx
+            )
+            return answer.strip()
+
+        except Exception as e:
+            logging.error(f"Error classifying bias for {url}: {e}")
+            return None
+
+    def _load_classification_inputs(self, urls_text_json_path: str, sides_json_path: str):
     # Load the URLs/texts
         with open(urls_text_json_path, "r", encoding="utf-8") as f:
             url_entries = json.load(f)
@@ -130,7 +811,9 @@ Text:
     # Load the sides and claim
         with open(sides_json_path, "r", encoding="utf-8") as f:
             sides_data = json.load(f)
+        return url_entries, sides_data
 
+    def _claim_and_sides(self, sides_data: dict):
     # Extract claim and sides
         claim = (
             sides_data.get("Idea of the conflict") or
@@ -140,23 +823,16 @@ Text:
         )
         side_a = sides_data.get("Side A", "Side A")
         side_b = sides_data.get("Side B", "Side B")
+        return claim, side_a, side_b
 
-    # Prepare groups for output
-        groups = {
+    def _empty_groups(self, side_a: str, side_b: str) -> dict:
+        return {
             "Group A": {"name": side_a, "sources": []},
             "Group B": {"name": side_b, "sources": []}
         }
 
-    # For each URL/text, classify bias using the model
-        for entry in url_entries:
-            url = entry.get("url", "")
-            text = entry.get("text", "")
-
-            if not text.strip():
-                continue  # skip empty texts
-
-        # Build the prompt
-            prompt = f"""
+    def _build_bias_prompt(self, claim: str, side_a: str, side_b: str, text: str) -> str:
+        return f"""
     Given the following claim and the two groups, classify whether the provided article text is biased toward Group A or Group B. Only respond with "Group A" or "Group B".
 
     Claim: {claim}
@@ -168,74 +844,275 @@ Text:
     \"\"\"{text}\"\"\"
     """
 
-            try:
-                response = model_client.chat.completions.create(
-                    model=model_name,
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=0.0,
-                    max_tokens=10
-                )
-                answer = response.choices[0].message.content.strip()
-            # Normalize answer
-                if "A" in answer:
-                    groups["Group A"]["sources"].append(url)
-                elif "B" in answer:
-                    groups["Group B"]["sources"].append(url)
-                else:
-                    logging.warning(f"Unrecognized model response for {url}: {answer}")
+    def _build_batch_bias_prompt(self, claim: str, side_a: str, side_b: str, texts: list) -> str:
+        articles = "\n".join(
+            f"Article {i}:\n    \"\"\"{text}\"\"\"\n" for i, text in enumerate(texts)
+        )
+        return f"""
+    Given the following claim and the two groups, classify whether each of the numbered article texts below is biased toward Group A or Group B.
+
+    Claim: {claim}
+
+    Group A: {side_a}
+    Group B: {side_b}
+
+    {articles}
+    Respond ONLY with a JSON array holding one entry per article, in article order, each entry being "Group A" or "Group B".
+    Example for 3 articles: ["Group A", "Group B", "Group A"]
+    """
 
-            except Exception as e:
-                logging.error(f"Error classifying bias for {url}: {e}")
+    def _add_to_group(self, groups: dict, url: str, answer: str):
+    # Normalize answer
+        if "A" in answer:
+            groups["Group A"]["sources"].append(url)
+        elif "B" in answer:
+            groups["Group B"]["sources"].append(url)
+        else:
+            logging.warning(f"Unrecognized model response for {url}: {answer}")
 
+    def _build_classified(self, claim: str, groups: dict) -> dict:
     # Prepare final output
-        output = {
+        return {
             "claim": claim,
             "groups": groups
         }
 
+    def _save_classified(self, output: dict, output_path: str):
     # Save to JSON
         with open(output_path, "w", encoding="utf-8") as f:
             json.dump(output, f, indent=2, ensure_ascii=False)
         print(f"Classification results saved to {output_path}")
 
-        return output
-
+    @timed_stage("run_pipeline")
     def run_pipeline(
         self,
-        conflict_output_path="conflict_output.json",
-        exa_output_path="exa_output.json",
-        classified_output_path="classified_bias_output.json",
-        exa_max_results=10
-    ):
+        exa_max_results=10,
+        classify_concurrency=DEFAULT_CLASSIFY_CONCURRENCY,
+        classify_batch_token_budget=None,
+        exa_two_phase=False,
+        exa_max_characters=DEFAULT_DOC_CHAR_BUDGET,
+        exa_highlights_only=False,
+        sink: Optional[ArtifactSink] = None,
+        ctx: Optional[RequestContext] = None
+    ) -> PipelineResult:
+        """
+        Runs extraction -> search -> classification, passing each stage's result on in memory.
+        Nothing touches the disk unless a sink is given to keep a copy of the run.
+        Concurrent runs over the same article share one computation, and runs whose articles
+        yield the same conflict share the search and classification. With a topic index, a run
+        whose article (or extracted claim) is similar to a fresh indexed run's reuses that
+        run's classification (and, for the article, its conflict); its search_results are empty.
+        :param ctx: Deadline and cancellation of the request; each stage gets its budget from
+            it (see request_context.STAGE_BUDGETS). Raises Cancelled if it is cancelled, and
+            DeadlineExceeded if it runs out before the search could start.
+        :return: The PipelineResult; its .classified is None if no conflict idea was found
+        """
+        search_options = dict(
+            exa_max_results=exa_max_results,
+            classify_batch_token_budget=classify_batch_token_budget,
+            exa_two_phase=exa_two_phase,
+            exa_max_characters=exa_max_characters,
+            exa_highlights_only=exa_highlights_only,
+        )
+        reused = self._reuse_topic(self.article_text, "request", sink)
+        if reused is not None:
+            return reused
+        return _pipeline_flights.do(
+            self._article_key(search_options),
+            lambda flight_ctx: self._run_pipeline(search_options, classify_concurrency, sink, flight_ctx),
+            ctx,
+        )
+
+    def _run_pipeline(self, search_options: dict, classify_concurrency: int,
+                      sink: Optional[ArtifactSink], ctx: RequestContext) -> PipelineResult:
     # Step 1: Extract conflict info from the article
-        result = self.extract_conflict()
-        self.pretty_print(result)
-        self.save_to_json(result, conflict_output_path)
+        run = PipelineResult(run_id=new_run_id(), conflict=self.extract_conflict(ctx))
+        ctx.check()
+        self.pretty_print(run.conflict)
 
     # Step 2: Get the main idea of conflict
-        idea = result.get("Idea of the conflict") or result.get("Idea of Conflict") or ""
-        if not idea:
+        if not run.idea:
             logger.warning("No idea of conflict found to search URLs.")
-            return
+            self._persist_run(run, sink)
+            return run
+
+        reused = self._reuse_topic(self._topic_claim(run.conflict), "claim", sink, run)
+        if reused is not None:
+            return reused
 
-    # Step 3: Search for related URLs and save them
-        urls = self.search_conflict_urls(idea, EXA_API_KEY, exa_max_results)
-        self.save_urls_to_json(urls, exa_output_path)
+    # Steps 3 and 4: Search for related URLs, then classify bias and aggregate results
+        run.search_results, run.classified, complete = _conflict_flights.do(
+            self._conflict_key(run, search_options),
+            lambda flight_ctx: self._search_and_classify(run, search_options, classify_concurrency, flight_ctx),
+            ctx,
+        )
+        self._persist_run(run, sink)
+        if complete:
+            self._index_topic(run)
+        logger.info(f"Pipeline run {run.run_id} complete.")
+        return run
 
-    # Step 4: Classify bias and aggregate results
-        classified = self.classify_bias_and_aggregate(
-            urls_text_json_path=exa_output_path,
-            sides_json_path=conflict_output_path,
+    def _search_and_classify(self, run: PipelineResult, search_options: dict, classify_concurrency: int,
+                             ctx: RequestContext):
+        search_results = self.search_sides(
+            run.conflict, search_options["exa_max_results"], ctx,
+            two_phase=search_options["exa_two_phase"],
+            max_characters=search_options["exa_max_characters"],
+            highlights_only=search_options["exa_highlights_only"]
+        )
+        ctx.raise_if_cancelled()
+        search_results = self._collapse_duplicates(search_results)
+        classified = self._classify_entries(
+            url_entries=search_results,
+            sides_data=run.conflict,
             model_client=self.client,
             model_name=self.model_name,
-            output_path=classified_output_path
+            max_concurrency=classify_concurrency,
+            batch_token_budget=search_options["classify_batch_token_budget"],
+            ctx=ctx
         )
-        logger.info(f"Pipeline complete. Final classified output saved to {classified_output_path}")
-        return classified
+        ctx.raise_if_cancelled()
+        return search_results, classified, not ctx.partial
+
+    @timed_stage("run_pipeline")
+    async def run_pipeline_async(
+        self,
+        exa_max_results=10,
+        classify_concurrency=DEFAULT_CLASSIFY_CONCURRENCY,
+        classify_batch_token_budget=None,
+        exa_two_phase=False,
+        exa_max_characters=DEFAULT_DOC_CHAR_BUDGET,
+        exa_highlights_only=False,
+        sink: Optional[ArtifactSink] = None,
+        ctx: Optional[RequestContext] = None
+    ) -> PipelineResult:
+        """
+        Awaitable version of run_pipeline. Every network call goes through the async
+        OpenAI/Exa clients, so other chats keep being served while this one is prepared.
+        When many chats send the same article at once, they all await a single run.
+        Cancelling ctx aborts the calls in flight right away (unless another chat is still
+        waiting for the same run).
+        :return: The PipelineResult; its .classified is None if no conflict idea was found
+        """
+        search_options = dict(
+            exa_max_results=exa_max_results,
+            classify_batch_token_budget=classify_batch_token_budget,
+            exa_two_phase=exa_two_phase,
+            exa_max_characters=exa_max_characters,
+            exa_highlights_only=exa_highlights_only,
+        )
+        reused = self._reuse_topic(self.article_text, "request", sink)
+        if reused is not None:
+            return reused
+        return await _pipeline_flights.do_async(
+            self._article_key(search_options),
+            lambda flight_ctx: self._run_pipeline_async(search_options, classify_concurrency, sink, flight_ctx),
+            ctx,
+        )
+
+    async def _run_pipeline_async(self, search_options: dict, classify_concurrency: int,
+                                  sink: Optional[ArtifactSink], ctx: RequestContext) -> PipelineResult:
+        run = PipelineResult(run_id=new_run_id(), conflict=await self.extract_conflict_async(ctx))
+        ctx.check()
+        self.pretty_print(run.conflict)
+
+        if not run.idea:
+            logger.warning("No idea of conflict found to search URLs.")
+            self._persist_run(run, sink)
+            return run
+
+        reused = self._reuse_topic(self._topic_claim(run.conflict), "claim", sink, run)
+        if reused is not None:
+            return reused
+
+        run.search_results, run.classified, complete = await _conflict_flights.do_async(
+            self._conflict_key(run, search_options),
+            lambda flight_ctx: self._search_and_classify_async(run, search_options, classify_concurrency, flight_ctx),
+            ctx,
+        )
+        self._persist_run(run, sink)
+        if complete:
+            self._index_topic(run)
+        logger.info(f"Pipeline run {run.run_id} complete.")
+        return run
+
+    async def _search_and_classify_async(self, run: PipelineResult, search_options: dict, classify_concurrency: int,
+                                         ctx: RequestContext):
+        search_results = await self.search_sides_async(
+            run.conflict, search_options["exa_max_results"], ctx,
+            two_phase=search_options["exa_two_phase"],
+            max_characters=search_options["exa_max_characters"],
+            highlights_only=search_options["exa_highlights_only"]
+        )
+        ctx.raise_if_cancelled()
+        search_results = self._collapse_duplicates(search_results)
+        classified = await self._classify_entries_async(
+            url_entries=search_results,
+            sides_data=run.conflict,
+            model_client=self.async_client,
+            model_name=self.model_name,
+            max_concurrency=classify_concurrency,
+            batch_token_budget=search_options["classify_batch_token_budget"],
+            ctx=ctx
+        )
+        ctx.raise_if_cancelled()
+        return search_results, classified, not ctx.partial
+
+    def _collapse_duplicates(self, search_results: list) -> list:
+        """Drops mirrors of earlier results before anything is sent to the LLM."""
+        if self.near_duplicate_threshold is None:
+            return search_results
+        kept = collapse_near_duplicates(search_results, self.near_duplicate_threshold, normalize_url)
+        metrics.inc("near_duplicate_sources_total", len(search_results) - len(kept))
+        return kept
+
+    def _article_key(self, search_options: dict) -> tuple:
+        # Everything that changes the outcome; concurrency and the sink only change how it is produced
+        return (normalize_text(self.article_text), self.model_name, self.passage_token_budget,
+                self.near_duplicate_threshold, tuple(sorted(search_options.items())))
+
+    def _conflict_key(self, run: PipelineResult, search_options: dict) -> tuple:
+        # The sides are part of the key: they name the groups articles are classified into
+        return (normalize_text(run.idea), normalize_text(run.conflict.get("Side A", "")),
+                normalize_text(run.conflict.get("Side B", "")), self.model_name,
+                self.near_duplicate_threshold, tuple(sorted(search_options.items())))
+
+    def _reuse_topic(self, text: str, field: str, sink: Optional[ArtifactSink],
+                     run: Optional[PipelineResult] = None) -> Optional[PipelineResult]:
+        """
+        The run completed with the stored results of the indexed topic most similar to `text`
+        (keeping run's own conflict when it already has one), or None on a miss.
+        """
+        if self.topic_index is None or not text.strip():
+            return None
+        with metrics.span("topic_lookup", field=field):
+            match = self.topic_index.lookup(text, field)
+        metrics.inc("topic_index_lookups_total", field=field, result="miss" if match is None else "hit")
+        if match is None:
+            return None
+        logger.info(f"Reusing run {match.run_id} ({field} similarity {match.similarity:.2f})")
+        if run is None:
+            run = PipelineResult(run_id=new_run_id(), conflict=match.conflict)
+        run.classified, run.reused_from = match.classified, match.run_id
+        self._persist_run(run, sink)
+        return run
+
+    def _index_topic(self, run: PipelineResult):
+        # Runs that found no sources aren't worth repeating
+        if self.topic_index is None or not run.classified:
+            return
+        if not any(group.get("sources") for group in run.classified.get("groups", {}).values()):
+            return
+        self.topic_index.add(run.run_id, self.article_text, self._topic_claim(run.conflict), run.conflict, run.classified)
+
+    def _topic_claim(self, conflict: dict) -> str:
+        claim, side_a, side_b = self._claim_and_sides(conflict)
+        return f"{claim}\n{side_a}\n{side_b}"
+
+    def _persist_run(self, run: PipelineResult, sink: Optional[ArtifactSink]):
+        if sink is not None:
+            sink.save_run(run.run_id, run.artifacts())
 
-        
-    
-        
     def save_urls_to_json(self, urls: list, output_path: str):
         try:
             with open(output_path, "w", encoding="utf-8") as f:
@@ -269,7 +1146,7 @@ if __name__ == "__main__":
     json_path = "tayaraToMahmoud.json"
 
     extractor = ConflictExtractor(json_path, model_name)
-    extractor.run_pipeline()
+    extractor.run_pipeline(sink=RunDirectorySink())
 
 
 